@@ -0,0 +1,177 @@
+"""
+A local, OpenAI-compatible chat completions server that stands in for Groq
+during benchmarks. It answers the prompts the two services send with canned
+but valid output: investigation questions as JSON, SQL for the seeded
+customers/products/support_tickets schema, and summaries. Latency, jitter
+and an error rate are configurable, so LLM time can be held constant while
+the rest of the stack is measured.
+
+    python benchmarks/fake_llm.py --port 9000 --latency-ms 400 --jitter-ms 100
+
+Point the services at it with LLM_BASE_URL=http://localhost:9000 (the Groq
+client adds /openai/v1; plain /v1 is served too).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.environ.get("FAKE_LLM_LATENCY_MS", "300"))
+JITTER_MS = float(os.environ.get("FAKE_LLM_JITTER_MS", "50"))
+# Share of calls answered with HTTP 429, to exercise the gateway's retries.
+ERROR_RATE = float(os.environ.get("FAKE_LLM_ERROR_RATE", "0"))
+
+app = FastAPI(title="Fake LLM")
+stats = {"calls": 0, "errors": 0, "by_kind": {}}
+
+_PRODUCT_NAME = re.compile(r'called "([^"]+)"|investigating "([^"]+)"')
+_QUESTION = re.compile(r"\*\*User Question[^*]*\*\*\s*(.+?)\s*\*\*SQL Query", re.DOTALL)
+_GROUP_BY = re.compile(r"identified by the column `(\w+)`")
+
+
+# --- Canned answers ---
+
+def _questions(prompt: str) -> str:
+    match = _PRODUCT_NAME.search(prompt)
+    subject = f'"{match.group(1) or match.group(2)}"' if match else "this product"
+    return json.dumps({"questions": [
+        f"What are the 20 most recent support tickets for {subject}?",
+        f"How many support tickets for {subject} are in each status?",
+        f"Which customers opened the most support tickets for {subject}?",
+    ]})
+
+
+def _product_filter(question: str) -> str:
+    match = re.search(r'"([^"]+)"', question)
+    if match:
+        return "p.product_name = '{}'".format(match.group(1).replace("'", "''"))
+    match = re.search(r"product (?:id )?(\d+)", question)
+    return f"p.product_id = {match.group(1)}" if match else "TRUE"
+
+
+def _sql(question: str) -> str:
+    text = question.lower()
+    where = _product_filter(question)
+    if "each status" in text or "how many" in text:
+        return (
+            "SELECT t.status, COUNT(*) AS ticket_count FROM support_tickets t "
+            f"JOIN products p ON p.product_id = t.product_id WHERE {where} GROUP BY t.status ORDER BY ticket_count DESC"
+        )
+    if "customer" in text:
+        return (
+            "SELECT c.customer_id, c.first_name, c.last_name, COUNT(*) AS ticket_count FROM support_tickets t "
+            "JOIN customers c ON c.customer_id = t.customer_id JOIN products p ON p.product_id = t.product_id "
+            f"WHERE {where} GROUP BY c.customer_id, c.first_name, c.last_name ORDER BY ticket_count DESC LIMIT 10"
+        )
+    return (
+        "SELECT t.ticket_id, t.subject, t.status, t.created_at FROM support_tickets t "
+        f"JOIN products p ON p.product_id = t.product_id WHERE {where} ORDER BY t.created_at DESC LIMIT 20"
+    )
+
+
+def _template_sql(question: str, group_by: str) -> str:
+    text = question.lower()
+    if "each status" in text or "how many" in text:
+        return (
+            f"SELECT t.{group_by}, t.status, COUNT(*) AS ticket_count FROM support_tickets t "
+            f"WHERE t.{group_by} = ANY($1) GROUP BY t.{group_by}, t.status ORDER BY t.{group_by}"
+        )
+    if "customer" in text:
+        return (
+            f"SELECT t.{group_by}, c.customer_id, c.first_name, c.last_name, COUNT(*) AS ticket_count "
+            "FROM support_tickets t JOIN customers c ON c.customer_id = t.customer_id "
+            f"WHERE t.{group_by} = ANY($1) GROUP BY t.{group_by}, c.customer_id, c.first_name, c.last_name "
+            f"ORDER BY t.{group_by}, ticket_count DESC"
+        )
+    return (
+        f"SELECT t.{group_by}, t.ticket_id, t.subject, t.status, t.created_at FROM support_tickets t "
+        f"WHERE t.{group_by} = ANY($1) ORDER BY t.{group_by}, t.created_at DESC"
+    )
+
+
+def _summary(prompt: str) -> str:
+    match = _PRODUCT_NAME.search(prompt)
+    product = (match.group(1) or match.group(2)) if match else "the product"
+    return (
+        f"Support activity for {product} is dominated by a few recurring complaints, most of them already "
+        "closed, with a smaller group of recent open tickets that repeat the same issue and point to a "
+        "persistent defect rather than isolated user error."
+    )
+
+
+def answer(prompt: str):
+    """Returns (kind, content) for a prompt sent by either service."""
+    if "generate a JSON list" in prompt:
+        return "questions", _questions(prompt)
+    question = _QUESTION.search(prompt)
+    if question:
+        group_by = _GROUP_BY.search(prompt)
+        if group_by:
+            return "template_sql", _template_sql(question.group(1), group_by.group(1))
+        return "sql", _sql(question.group(1))
+    if "diagnostics expert investigating" in prompt:
+        return "summary", _summary(prompt)
+    return "other", "OK"
+
+
+# --- Endpoints ---
+
+@app.post("/openai/v1/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = "\n".join(message.get("content") or "" for message in body.get("messages", []))
+    stats["calls"] += 1
+
+    await asyncio.sleep(max(0.0, random.gauss(LATENCY_MS, JITTER_MS)) / 1000)
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"message": "Rate limit reached (fake)", "type": "rate_limit"}}, status_code=429)
+
+    kind, content = answer(prompt)
+    stats["by_kind"][kind] = stats["by_kind"].get(kind, 0) + 1
+    prompt_tokens = len(prompt) // 4 + 1
+    completion_tokens = len(content) // 4 + 1
+    return {
+        "id": f"chatcmpl-fake-{stats['calls']}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def main(argv=None):
+    global LATENCY_MS, JITTER_MS, ERROR_RATE
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS, help="Mean response time.")
+    parser.add_argument("--jitter-ms", type=float, default=JITTER_MS, help="Standard deviation of the response time.")
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE, help="Share of calls answered with 429.")
+    args = parser.parse_args(argv)
+    LATENCY_MS, JITTER_MS, ERROR_RATE = args.latency_ms, args.jitter_ms, args.error_rate
+    # Imported here so the app can also be mounted in-process (e.g. over httpx.ASGITransport).
+    import uvicorn
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Fills the Text-to-SQL database with synthetic customers, products and
+support tickets, at any scale, using COPY.
+
+The data is shaped like a real support desk rather than uniform noise:
+ticket volume per product and per customer follows a Zipf distribution (a
+few products and customers account for most tickets), tickets cluster in
+recent months, old tickets are mostly closed, and subjects are drawn from
+a small set of per-category complaints with minor variations, so the same
+issue is reported many times in slightly different words.
+
+The same --seed always produces the same rows. Product names depend only on
+the product id (see product_name()), so the load test can address products
+without reading them back.
+
+    python benchmarks/generate_data.py --customers 100000 --products 2000 --tickets 5000000 --truncate
+"""
+import argparse
+import bisect
+import datetime
+import itertools
+import os
+import random
+import sys
+import time
+
+CATEGORIES = {
+    "Electronics": (
+        ["Laptop", "Tablet", "Monitor", "Headphones", "Smartwatch", "Camera"],
+        ["Screen flickering", "Battery drains quickly", "Will not power on", "Overheating during use",
+         "Bluetooth keeps disconnecting", "Charging port loose", "Audio crackling", "Touchscreen unresponsive"],
+    ),
+    "Networking": (
+        ["Router", "Mesh Node", "Switch", "Modem", "Access Point"],
+        ["Cannot connect to Wi-Fi", "Connection drops every few minutes", "Slow speeds on 5GHz",
+         "Firmware update failed", "Admin page not loading", "Port forwarding not working"],
+    ),
+    "Storage": (
+        ["Hard Drive", "SSD", "NAS", "USB Stick", "Memory Card"],
+        ["Drive not recognized", "Files corrupted after copy", "Very slow transfer speeds",
+         "Clicking noise", "Sync keeps failing", "Capacity shown incorrectly"],
+    ),
+    "Home": (
+        ["Thermostat", "Smart Plug", "Doorbell", "Vacuum", "Light Bulb"],
+        ["App cannot find device", "Schedule not applied", "Device goes offline overnight",
+         "Voice assistant integration broken", "Motion alerts delayed"],
+    ),
+}
+# Share of products per category.
+CATEGORY_WEIGHTS = {"Electronics": 0.4, "Networking": 0.2, "Storage": 0.2, "Home": 0.2}
+BRANDS = ["Quantum", "DataStream", "Cloud-Sync", "Nimbus", "Vertex", "Helix", "Orbit", "Apex", "Lumen", "Pulse"]
+
+FIRST_NAMES = ["Alice", "Bob", "Charlie", "Dana", "Eli", "Fatima", "George", "Hana", "Ivan", "Julia",
+               "Kofi", "Lena", "Mateo", "Nina", "Omar", "Priya", "Quinn", "Rosa", "Sam", "Tariq"]
+LAST_NAMES = ["Johnson", "Smith", "Brown", "Garcia", "Nguyen", "Kim", "Patel", "Müller", "Rossi", "Silva",
+              "Cohen", "Okafor", "Larsen", "Tanaka", "Novak", "Dubois", "Haddad", "Murphy", "Lopez", "Singh"]
+SUBJECT_VARIANTS = ["{}", "{}", "{}", "{} again", "{} after update", "{} - urgent", "Still: {}", "{} since yesterday"]
+DESCRIPTIONS = [
+    "My {product} has this problem: {issue}. I already restarted it.",
+    "Since last week my {product} shows this issue: {issue}. Please advise.",
+    "{issue} on my {product}. This is the second time it happens.",
+    "Bought the {product} two months ago. {issue}. I need a replacement.",
+]
+
+# How strongly ticket volume concentrates on the most popular products and customers.
+PRODUCT_ZIPF_S = 1.1
+CUSTOMER_ZIPF_S = 0.8
+# Tickets are spread over this many days before "now", weighted towards recent ones.
+HISTORY_DAYS = 3 * 365
+COPY_CHUNK_ROWS = 10000
+
+
+def product_name(product_id: int) -> str:
+    """Deterministic product name; load tests rebuild it from the id."""
+    category = category_of(product_id)
+    kinds = CATEGORIES[category][0]
+    brand = BRANDS[product_id % len(BRANDS)]
+    kind = kinds[(product_id // len(BRANDS)) % len(kinds)]
+    return f"{brand} {kind} {product_id}"
+
+
+def category_of(product_id: int) -> str:
+    # A fixed hash of the id, so the category does not depend on the random seed.
+    point = (product_id * 2654435761 % 2 ** 32) / 2 ** 32
+    for category, weight in CATEGORY_WEIGHTS.items():
+        if point < weight:
+            return category
+        point -= weight
+    return category
+
+
+def zipf_sampler(rng: random.Random, n: int, s: float, first_id: int = 1):
+    """Returns a function drawing ids first_id..first_id+n-1 with Zipf(s) popularity over a shuffled order."""
+    cumulative = list(itertools.accumulate(1 / rank ** s for rank in range(1, n + 1)))
+    total = cumulative[-1]
+    # Popularity is assigned to ids in random order, not by id.
+    ids = list(range(first_id, first_id + n))
+    rng.shuffle(ids)
+
+    def sample():
+        return ids[bisect.bisect_left(cumulative, rng.random() * total)]
+
+    return sample
+
+
+def _escape(value) -> str:
+    """Formats a value for COPY ... FROM STDIN (text format)."""
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class _CopySource:
+    """A read()-able file over generated rows, so COPY streams without building the data in memory."""
+
+    def __init__(self, rows):
+        self._lines = ("\t".join(_escape(value) for value in row) + "\n" for row in rows)
+        self._buffer = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = "".join(itertools.islice(self._lines, COPY_CHUNK_ROWS))
+            if not chunk:
+                break
+            self._buffer += chunk.encode("utf-8")
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    readline = read
+
+
+# --- Row generators ---
+
+def customer_rows(rng: random.Random, first_id: int, count: int, today: datetime.date):
+    for customer_id in range(first_id, first_id + count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        joined = today - datetime.timedelta(days=rng.randint(0, 5 * 365))
+        yield customer_id, first, last, f"{first}.{last}.{customer_id}@example.com".lower(), joined
+
+
+def product_rows(rng: random.Random, first_id: int, count: int):
+    for product_id in range(first_id, first_id + count):
+        # Prices are log-normal: mostly cheap items with a long tail.
+        price = round(min(rng.lognormvariate(4.5, 0.9), 9999.99), 2)
+        yield product_id, product_name(product_id), category_of(product_id), price
+
+
+def ticket_rows(rng: random.Random, count: int, pick_product, pick_customer, now: datetime.datetime):
+    for _ in range(count):
+        product_id = pick_product()
+        category = category_of(product_id)
+        issue = rng.choice(CATEGORIES[category][1])
+        # Exponential age: half of all tickets are from roughly the last 4 months.
+        age_days = min(rng.expovariate(1 / 180), HISTORY_DAYS)
+        created_at = now - datetime.timedelta(days=age_days, seconds=rng.randint(0, 86399))
+        if age_days < 7:
+            status = rng.choices(("open", "in_progress", "closed"), (0.6, 0.3, 0.1))[0]
+        elif age_days < 60:
+            status = rng.choices(("open", "in_progress", "closed"), (0.2, 0.3, 0.5))[0]
+        else:
+            status = rng.choices(("open", "in_progress", "closed"), (0.03, 0.02, 0.95))[0]
+        product = product_name(product_id)
+        yield (
+            pick_customer(),
+            product_id,
+            rng.choice(SUBJECT_VARIANTS).format(issue),
+            rng.choice(DESCRIPTIONS).format(product=product, issue=issue),
+            status,
+            created_at.replace(microsecond=0),
+        )
+
+
+# --- Loading ---
+
+def _copy(cur, table: str, columns: tuple, rows):
+    started = time.perf_counter()
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", _CopySource(rows))
+    print(f"  {table}: {cur.rowcount} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+def _next_id(cur, table: str, column: str) -> int:
+    cur.execute(f"SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}")
+    return cur.fetchone()[0]
+
+
+def generate(conn, customers: int, products: int, tickets: int, seed: int = 42, truncate: bool = False):
+    rng = random.Random(seed)
+    now = datetime.datetime.now().replace(microsecond=0)
+    with conn.cursor() as cur:
+        if truncate:
+            cur.execute("TRUNCATE support_tickets, customers, products RESTART IDENTITY CASCADE")
+        first_customer = _next_id(cur, "customers", "customer_id")
+        first_product = _next_id(cur, "products", "product_id")
+
+        _copy(cur, "customers", ("customer_id", "first_name", "last_name", "email", "join_date"),
+              customer_rows(rng, first_customer, customers, now.date()))
+        _copy(cur, "products", ("product_id", "product_name", "category", "price"),
+              product_rows(rng, first_product, products))
+        _copy(cur, "support_tickets", ("customer_id", "product_id", "subject", "description", "status", "created_at"),
+              ticket_rows(rng, tickets,
+                          zipf_sampler(rng, products, PRODUCT_ZIPF_S, first_product),
+                          zipf_sampler(rng, customers, CUSTOMER_ZIPF_S, first_customer),
+                          now))
+
+        # Ids were given explicitly, so move the sequences past them.
+        for table, column in (("customers", "customer_id"), ("products", "product_id")):
+            cur.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), (SELECT MAX({column}) FROM {table}))"
+            )
+    conn.commit()
+
+    # ANALYZE cannot run inside the transaction block psycopg2 opens.
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE customers, products, support_tickets")
+    conn.autocommit = False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--tickets", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true", help="Empty the three tables first (ids restart at 1).")
+    parser.add_argument(
+        "--dsn",
+        default=os.environ.get("BENCH_DSN", "host=localhost port=5432 dbname=mydb user=nandana password=anadnan123"),
+        help="libpq connection string for the Text-to-SQL database (default: the docker-compose one on localhost).",
+    )
+    args = parser.parse_args(argv)
+    if min(args.customers, args.products) < 1 or args.tickets < 0:
+        parser.error("--customers and --products must be at least 1 and --tickets at least 0.")
+
+    # Imported here so loadtest.py can reuse product_name() without a database driver.
+    import psycopg2
+
+    started = time.perf_counter()
+    conn = psycopg2.connect(args.dsn)
+    try:
+        generate(conn, args.customers, args.products, args.tickets, args.seed, args.truncate)
+    finally:
+        conn.close()
+    print(f"Done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
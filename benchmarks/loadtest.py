@@ -0,0 +1,404 @@
+"""
+Load scenarios for both services, with results saved as JSON so runs can
+be compared.
+
+Scenarios:
+  ask       POST /ask on the Text-to-SQL API with questions about generated products
+  diagnose  POST /tools/diagnose-product on the Diagnostics API (single diagnosis)
+  fleet     POST /tools/diagnose-fleet on the Diagnostics API (batch diagnosis)
+
+Each run reports p50/p95/p99 latency, throughput, errors and the peak
+resident memory of the processes (--pid) or containers (--container) under
+test, and writes benchmarks/results/<time>-<scenario>[-<label>].json.
+
+    python benchmarks/loadtest.py run ask --concurrency 16 --requests 2000 --container text_to_sql_service
+    python benchmarks/loadtest.py compare results/before.json results/after.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import time
+
+import httpx
+
+from generate_data import PRODUCT_ZIPF_S, product_name, zipf_sampler
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+TEXT_TO_SQL_URL = os.environ.get("BENCH_TEXT_TO_SQL_URL", "http://localhost:8000")
+DIAGNOSTICS_URL = os.environ.get("BENCH_DIAGNOSTICS_URL", "http://localhost:8001")
+COLUMNAR_MEDIA_TYPE = "application/vnd.text-to-sql.columnar+json"
+
+QUESTION_TEMPLATES = [
+    'What are the 20 most recent support tickets for "{}"?',
+    'How many support tickets for "{}" are in each status?',
+    'Which customers opened the most support tickets for "{}"?',
+]
+# Metrics compared between runs, and whether a higher value is better.
+COMPARED_METRICS = [
+    ("throughput_rps", True),
+    ("latency_ms.p50", False),
+    ("latency_ms.p95", False),
+    ("latency_ms.p99", False),
+    ("error_rate", False),
+]
+
+
+# --- Scenarios ---
+
+class Scenario:
+    """Builds the requests of one scenario; products are drawn with the generator's Zipf skew."""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.pick_product = zipf_sampler(self.rng, args.products, PRODUCT_ZIPF_S)
+
+    def request(self):
+        """Returns (method, url, kwargs) for the next request."""
+        raise NotImplementedError
+
+
+class AskScenario(Scenario):
+    def __init__(self, args):
+        super().__init__(args)
+        # A fixed pool of distinct questions sets the SQL cache hit rate.
+        self.questions = [
+            self.rng.choice(QUESTION_TEMPLATES).format(product_name(self.pick_product()))
+            for _ in range(args.distinct_questions)
+        ]
+
+    def request(self):
+        headers = {"Accept": COLUMNAR_MEDIA_TYPE} if self.args.columnar else {}
+        return "POST", f"{self.args.text_to_sql_url}/ask", {
+            "json": {"question": self.rng.choice(self.questions)},
+            "headers": headers,
+        }
+
+
+class DiagnoseScenario(Scenario):
+    def request(self):
+        product_id = self.pick_product()
+        return "POST", f"{self.args.diagnostics_url}/tools/diagnose-product", {
+            "json": {"product_id": product_id, "product_name": product_name(product_id)},
+        }
+
+
+class FleetScenario(Scenario):
+    def request(self):
+        product_ids = set()
+        while len(product_ids) < min(self.args.fleet_size, self.args.products):
+            product_ids.add(self.pick_product())
+        return "POST", f"{self.args.diagnostics_url}/tools/diagnose-fleet", {
+            "json": {"products": [
+                {"product_id": product_id, "product_name": product_name(product_id)}
+                for product_id in sorted(product_ids)
+            ]},
+        }
+
+
+SCENARIOS = {"ask": AskScenario, "diagnose": DiagnoseScenario, "fleet": FleetScenario}
+
+
+# --- Memory sampling ---
+
+_SIZE = re.compile(r"([\d.]+)\s*([KMG]i?B|B)")
+_UNITS = {"B": 1, "KB": 1e3, "MB": 1e6, "GB": 1e9, "KiB": 2 ** 10, "MiB": 2 ** 20, "GiB": 2 ** 30}
+
+
+def _proc_status_mb(pid: int, field: str):
+    """Reads VmRSS or VmHWM (peak) from /proc/<pid>/status, in MB."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def _docker_memory_mb(containers: list) -> dict:
+    try:
+        output = subprocess.run(
+            ["docker", "stats", "--no-stream", "--format", "{{.Name}} {{.MemUsage}}", *containers],
+            capture_output=True, text=True, timeout=10, check=True,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    usage = {}
+    for line in output.splitlines():
+        name, _, rest = line.partition(" ")
+        match = _SIZE.search(rest)
+        if match:
+            usage[name] = float(match.group(1)) * _UNITS[match.group(2)] / 2 ** 20
+    return usage
+
+
+class MemorySampler:
+    """
+    Tracks peak memory while a run is in progress. Local processes report
+    their kernel high-water mark (VmHWM, peak since the process started);
+    containers are sampled with docker stats.
+    """
+
+    def __init__(self, pids: dict, containers: list, interval: float = 1.0):
+        self.pids = pids
+        self.containers = containers
+        self.interval = interval
+        self.peaks = {}
+
+    def _record(self, name: str, mb):
+        if mb is not None:
+            self.peaks[name] = max(self.peaks.get(name, 0.0), round(mb, 1))
+
+    async def run(self):
+        while True:
+            for name, pid in self.pids.items():
+                self._record(name, _proc_status_mb(pid, "VmRSS"))
+            if self.containers:
+                for name, mb in (await asyncio.to_thread(_docker_memory_mb, self.containers)).items():
+                    self._record(name, mb)
+            await asyncio.sleep(self.interval)
+
+    def finish(self) -> dict:
+        for name, pid in self.pids.items():
+            self._record(name, _proc_status_mb(pid, "VmHWM"))
+        return self.peaks
+
+
+# --- Running ---
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+async def _run(scenario: Scenario, args) -> dict:
+    samples = []
+    status_counts = {}
+    bytes_received = 0
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        issued = 0
+
+        async def worker(limit: float, deadline: float = None, record: bool = True):
+            nonlocal issued, bytes_received
+            while issued < limit and (deadline is None or time.monotonic() < deadline):
+                issued += 1
+                method, url, kwargs = scenario.request()
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, url, **kwargs)
+                    status = str(response.status_code)
+                    size = len(response.content)
+                except httpx.HTTPError as e:
+                    status, size = type(e).__name__, 0
+                latency = time.perf_counter() - started
+                if record:
+                    samples.append((latency, status))
+                    status_counts[status] = status_counts.get(status, 0) + 1
+                    bytes_received += size
+
+        if args.warmup:
+            print(f"Warming up with {args.warmup} requests...", file=sys.stderr)
+            await asyncio.gather(*(worker(args.warmup, record=False) for _ in range(args.concurrency)))
+            issued = 0
+
+        sampler = MemorySampler(dict(args.pid), args.container)
+        sampling = asyncio.create_task(sampler.run())
+        print(f"Running {args.scenario} at concurrency {args.concurrency}...", file=sys.stderr)
+        if args.duration:
+            limit, deadline = float("inf"), time.monotonic() + args.duration
+        else:
+            limit, deadline = args.requests, None
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(limit, deadline) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        sampling.cancel()
+        await asyncio.gather(sampling, return_exceptions=True)
+
+    ok = sorted(latency * 1000 for latency, status in samples if status.startswith("2"))
+    errors = len(samples) - len(ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "status_counts": status_counts,
+        "duration_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "min": round(ok[0], 2) if ok else 0.0,
+            "mean": round(sum(ok) / len(ok), 2) if ok else 0.0,
+            "p50": round(percentile(ok, 50), 2),
+            "p90": round(percentile(ok, 90), 2),
+            "p95": round(percentile(ok, 95), 2),
+            "p99": round(percentile(ok, 99), 2),
+            "max": round(ok[-1], 2) if ok else 0.0,
+        },
+        "bytes_received": bytes_received,
+        "peak_rss_mb": sampler.finish(),
+        # ru_maxrss is in KB on Linux.
+        "loadtest_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _save(result: dict, output: str = None) -> str:
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        suffix = f"-{result['label']}" if result["label"] else ""
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{result['scenario']}{suffix}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    return output
+
+
+def _print_result(result: dict):
+    latency = result["latency_ms"]
+    print(f"{result['scenario']}: {result['requests']} requests in {result['duration_seconds']}s, "
+          f"{result['errors']} errors")
+    print(f"  throughput  {result['throughput_rps']} req/s")
+    print(f"  latency ms  p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    for name, mb in sorted(result["peak_rss_mb"].items()):
+        print(f"  peak RSS    {name}: {mb} MB")
+
+
+def command_run(args) -> int:
+    scenario = SCENARIOS[args.scenario](args)
+    result = {
+        "scenario": args.scenario,
+        "label": args.label,
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("command", "func", "output")
+        },
+    }
+    result.update(asyncio.run(_run(scenario, args)))
+    path = _save(result, args.output)
+    _print_result(result)
+    print(f"Saved {path}", file=sys.stderr)
+    return 0
+
+
+# --- Comparing ---
+
+def _metric(result: dict, path: str):
+    value = result
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> tuple:
+    """Returns (rows, regressions): one (metric, before, after, change) row per metric."""
+    metrics = list(COMPARED_METRICS)
+    for name in sorted(set(baseline.get("peak_rss_mb", {})) | set(candidate.get("peak_rss_mb", {}))):
+        metrics.append((f"peak_rss_mb.{name}", False))
+
+    rows, regressions = [], []
+    for metric, higher_is_better in metrics:
+        before, after = _metric(baseline, metric), _metric(candidate, metric)
+        if before is None or after is None:
+            rows.append((metric, before, after, None))
+            continue
+        change = (after - before) / before if before else (0.0 if after == before else float("inf"))
+        rows.append((metric, before, after, change))
+        worse = -change if higher_is_better else change
+        # An error rate that appears from zero is a regression whatever the threshold.
+        if worse > threshold or (metric == "error_rate" and before == 0 and after > 0):
+            regressions.append(metric)
+    return rows, regressions
+
+
+def _format(value) -> str:
+    return "n/a" if value is None else f"{value:,.2f}".rstrip("0").rstrip(".")
+
+
+def command_compare(args) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline.get("scenario") != candidate.get("scenario"):
+        print(f"Warning: comparing different scenarios ({baseline.get('scenario')} vs {candidate.get('scenario')}).",
+              file=sys.stderr)
+
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    print(f"{'metric':<32}{'baseline':>14}{'candidate':>14}{'change':>10}")
+    for metric, before, after, change in rows:
+        shown = "n/a" if change is None else f"{change:+.1%}"
+        flag = "  <-- regression" if metric in regressions else ""
+        print(f"{metric:<32}{_format(before):>14}{_format(after):>14}{shown:>10}{flag}")
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}.")
+        return 1
+    return 0
+
+
+def _pid_arg(value: str):
+    name, _, pid = value.rpartition("=")
+    if not pid.isdigit():
+        raise argparse.ArgumentTypeError("expected NAME=PID or PID")
+    return name or pid, int(pid)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run a load scenario and save its result.")
+    run.add_argument("scenario", choices=sorted(SCENARIOS))
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--requests", type=int, default=500, help="Measured requests (ignored with --duration).")
+    run.add_argument("--duration", type=float, default=None, help="Run for this many seconds instead.")
+    run.add_argument("--warmup", type=int, default=20, help="Unmeasured requests sent first.")
+    run.add_argument("--timeout", type=float, default=120)
+    run.add_argument("--products", type=int, default=500, help="Products in the database (see generate_data.py).")
+    run.add_argument("--distinct-questions", type=int, default=100, help="ask: size of the question pool.")
+    run.add_argument("--columnar", action="store_true", help="ask: request the columnar response format.")
+    run.add_argument("--fleet-size", type=int, default=50, help="fleet: products per request.")
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--text-to-sql-url", default=TEXT_TO_SQL_URL)
+    run.add_argument("--diagnostics-url", default=DIAGNOSTICS_URL)
+    run.add_argument("--pid", type=_pid_arg, action="append", default=[],
+                     help="Local process to track, as NAME=PID. Repeatable.")
+    run.add_argument("--container", action="append", default=[], help="Docker container to track. Repeatable.")
+    run.add_argument("--label", default="", help="Added to the result file name, e.g. the branch.")
+    run.add_argument("--output", default=None, help="Result file (default: benchmarks/results/...).")
+    run.set_defaults(func=command_run)
+
+    diff = commands.add_parser("compare", help="Compare two saved results.")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+    diff.add_argument("--threshold", type=float, default=0.10,
+                      help="Relative change that counts as a regression (default 0.10).")
+    diff.set_defaults(func=command_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
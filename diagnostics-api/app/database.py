@@ -1,8 +1,12 @@
 import os
+import hashlib
+import logging
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, RealDictCursor, execute_values
 import json # Moved import to the top for clarity
 
+logger = logging.getLogger(__name__)
+
 def get_db_connection():
     """Establishes a connection to the diagnostics database."""
     try:
@@ -18,32 +22,74 @@ def get_db_connection():
         )
         return conn
     except psycopg2.OperationalError as e:
-        print(f"ERROR: Could not connect to the diagnostics database: {e}")
+        logger.error("Could not connect to the diagnostics database: %s", e)
         raise
 
-def save_diagnosis_result(product_id: int, product_name: str, summary: str, raw_data: dict):
+def payload_hash(raw_data) -> str:
+    """Content address of a raw_data payload: sha256 of its canonical JSON."""
+    canonical = json.dumps(raw_data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def save_diagnosis_results(reports: list) -> list:
     """
-    Saves the result of a product diagnosis to the diagnosis_reports table.
+    Saves many diagnosis reports in one transaction and returns their
+    report_ids in the same order. Each report is a dict with product_id,
+    product_name, summary, raw_data and optionally watermark.
+
+    raw_data is stored once per distinct payload in diagnosis_payloads;
+    reports only reference it by hash, so identical results are not written again.
     """
+    payloads = {}
+    rows = []
+    for report in reports:
+        digest = payload_hash(report["raw_data"])
+        payloads.setdefault(digest, report["raw_data"])
+        watermark = report.get("watermark")
+        rows.append((
+            report["product_id"],
+            report["product_name"],
+            report["summary"],
+            digest,
+            json.dumps(watermark) if watermark is not None else None,
+        ))
+
     conn = None
     try:
         conn = get_db_connection()
         with conn.cursor() as cur:
-            sql = """
-                INSERT INTO diagnosis_reports (product_id, product_name, summary, raw_data)
-                VALUES (%s, %s, %s, %s)
+            # Only ship payloads the database does not have yet.
+            cur.execute(
+                "SELECT payload_hash FROM diagnosis_payloads WHERE payload_hash = ANY(%s);",
+                (list(payloads),),
+            )
+            known = {row[0] for row in cur.fetchall()}
+            new_payloads = [(digest, json.dumps(raw_data, default=str))
+                            for digest, raw_data in payloads.items() if digest not in known]
+            if new_payloads:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO diagnosis_payloads (payload_hash, raw_data) VALUES %s
+                    ON CONFLICT (payload_hash) DO NOTHING;
+                    """,
+                    new_payloads,
+                )
+            report_ids = execute_values(
+                cur,
+                """
+                INSERT INTO diagnosis_reports (product_id, product_name, summary, payload_hash, watermark)
+                VALUES %s
                 RETURNING report_id;
-            """
-            # Convert raw_data dict to a JSON string to store in the database
-            raw_data_json = json.dumps(raw_data)
-            
-            cur.execute(sql, (product_id, product_name, summary, raw_data_json))
-            report_id = cur.fetchone()[0]
+                """,
+                rows,
+                page_size=len(rows),
+                fetch=True,
+            )
             conn.commit()
-            print(f"Successfully saved diagnosis report with ID: {report_id}")
-            return report_id
+            logger.info("Saved %d diagnosis reports (%d new payloads)", len(rows), len(new_payloads))
+            return [row[0] for row in report_ids]
     except Exception as e:
-        print(f"ERROR: Could not save diagnosis result to database: {e}")
+        logger.error("Could not save diagnosis results to database: %s", e)
         # If there's an error, roll back any changes
         if conn:
             conn.rollback()
@@ -51,3 +97,129 @@ def save_diagnosis_result(product_id: int, product_name: str, summary: str, raw_
     finally:
         if conn:
             conn.close()
+
+def save_diagnosis_result(product_id: int, product_name: str, summary: str, raw_data: dict,
+                          watermark: dict = None):
+    """
+    Saves the result of a product diagnosis to the diagnosis_reports table.
+    """
+    return save_diagnosis_results([{
+        "product_id": product_id,
+        "product_name": product_name,
+        "summary": summary,
+        "raw_data": raw_data,
+        "watermark": watermark,
+    }])[0]
+
+def get_latest_report(product_id: int):
+    """Returns the most recent diagnosis report for a product, or None."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT r.report_id, r.product_id, r.product_name, r.summary, p.raw_data, r.watermark, r.created_at
+                FROM diagnosis_reports r
+                LEFT JOIN diagnosis_payloads p ON p.payload_hash = r.payload_hash
+                WHERE r.product_id = %s
+                ORDER BY r.created_at DESC, r.report_id DESC
+                LIMIT 1;
+                """,
+                (product_id,),
+            )
+            return cur.fetchone()
+    finally:
+        if conn:
+            conn.close()
+
+# --- Diagnosis Jobs ---
+
+def create_job(job_id: str, product_id: int, product_name: str):
+    """Records a newly submitted diagnosis job in the queued state."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO diagnosis_jobs (job_id, product_id, product_name, status)
+                VALUES (%s, %s, %s, 'queued');
+                """,
+                (job_id, product_id, product_name),
+            )
+            conn.commit()
+    except Exception as e:
+        logger.error("Could not create diagnosis job: %s", e)
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+def update_job(job_id: str, status: str, report_id: int = None, error: str = None):
+    """Moves a diagnosis job to a new status, recording its report or error."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE diagnosis_jobs
+                SET status = %s, report_id = %s, error = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = %s;
+                """,
+                (status, report_id, error, job_id),
+            )
+            conn.commit()
+    except Exception as e:
+        logger.error("Could not update diagnosis job %s: %s", job_id, e)
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+def get_job(job_id: str):
+    """Returns a diagnosis job together with its report, or None if unknown."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT j.job_id::text AS job_id, j.product_id, j.product_name, j.status,
+                       j.report_id, j.error, j.created_at, j.updated_at,
+                       r.summary, p.raw_data
+                FROM diagnosis_jobs j
+                LEFT JOIN diagnosis_reports r ON r.report_id = j.report_id
+                LEFT JOIN diagnosis_payloads p ON p.payload_hash = r.payload_hash
+                WHERE j.job_id = %s;
+                """,
+                (job_id,),
+            )
+            return cur.fetchone()
+    finally:
+        if conn:
+            conn.close()
+
+def get_unfinished_jobs():
+    """Returns jobs that were queued or running when the service last stopped."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT job_id::text AS job_id, product_id, product_name
+                FROM diagnosis_jobs
+                WHERE status IN ('queued', 'running')
+                ORDER BY created_at;
+                """
+            )
+            return cur.fetchall()
+    finally:
+        if conn:
+            conn.close()
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+from . import tools
+from . import database
+from . import report_writer
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+
+DIAGNOSIS_WORKERS = int(os.environ.get("DIAGNOSIS_WORKERS", "4"))
+DIAGNOSIS_QUEUE_MAX = int(os.environ.get("DIAGNOSIS_QUEUE_MAX", "100"))
+# Finished jobs kept in memory for fast polling; older ones are read from the database.
+DIAGNOSIS_JOBS_RETAINED = int(os.environ.get("DIAGNOSIS_JOBS_RETAINED", "1000"))
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at DIAGNOSIS_QUEUE_MAX."""
+
+
+async def run_diagnosis(product_id: int, product_name: str):
+    """
+    Runs one diagnosis and queues its report for writing, unless the latest
+    report could be reused as is. Returns (report, saved): `saved` is a
+    future for the new report_id, or None when the report was reused and
+    already carries its report_id. The write is not waited for.
+    """
+    report = await tools.diagnose_product(product_id=product_id, product_name=product_name)
+    if "error" in report:
+        raise RuntimeError(report["error"])
+    if report["freshness"] == "reused":
+        return report, None
+    # Written by the report writer together with reports from other workers.
+    report["report_id"] = None
+    saved = await report_writer.report_writer.enqueue(
+        product_id=report["product_id"],
+        product_name=report["product_name"],
+        summary=report["summary"],
+        raw_data=report["raw_data"],
+        watermark=report.get("watermark"),
+    )
+    return report, saved
+
+
+class JobManager:
+    """
+    Runs diagnoses on a bounded pool of asyncio workers.
+
+    Submissions for a product that already has a queued or running job are
+    coalesced onto that job, so concurrent identical requests share one
+    execution. Job state is mirrored to the diagnosis_jobs table and
+    unfinished jobs are re-queued on startup.
+    """
+
+    def __init__(self, workers: int = DIAGNOSIS_WORKERS, queue_max: int = DIAGNOSIS_QUEUE_MAX):
+        self.workers = workers
+        self.queue_max = queue_max
+        self._queue = None
+        self._tasks = []
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+        self._changed = None
+        self._report_writes = set()
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._changed = asyncio.Condition()
+        try:
+            unfinished = await asyncio.to_thread(database.get_unfinished_jobs)
+        except Exception as e:
+            logger.warning("Could not recover unfinished jobs: %s", e)
+            unfinished = []
+        for row in unfinished:
+            job = self._new_job(row["job_id"], row["product_id"], row["product_name"])
+            self._in_flight[job["product_id"]] = job["job_id"]
+            self._queue.put_nowait(job["job_id"])
+        if unfinished:
+            logger.info("Re-queued %d unfinished jobs", len(unfinished))
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def settle(self):
+        """Waits until jobs whose reports were still being written have their report_id."""
+        await asyncio.gather(*self._report_writes, return_exceptions=True)
+
+    def _new_job(self, job_id: str, product_id: int, product_name: str) -> dict:
+        job = {
+            "job_id": job_id,
+            "product_id": product_id,
+            "product_name": product_name,
+            "status": "queued",
+            "report_id": None,
+            "error": None,
+            "report": None,
+            "created_at": time.time(),
+            "updated_at": time.time(),
+        }
+        self._jobs[job_id] = job
+        self._trim()
+        return job
+
+    def _trim(self):
+        # Drop the oldest finished jobs once the in-memory table is full.
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= DIAGNOSIS_JOBS_RETAINED:
+                break
+            if self._jobs[job_id]["status"] in TERMINAL_STATUSES:
+                del self._jobs[job_id]
+
+    async def submit(self, product_id: int, product_name: str):
+        """Returns (job, deduplicated). Raises QueueFullError if the queue is full."""
+        existing = self._in_flight.get(product_id)
+        if existing is not None:
+            return self._jobs[existing], True
+        if self._queue.qsize() >= self.queue_max:
+            raise QueueFullError(f"Diagnosis queue is full ({self.queue_max} jobs waiting).")
+
+        job = self._new_job(str(uuid.uuid4()), product_id, product_name)
+        self._in_flight[product_id] = job["job_id"]
+        try:
+            await asyncio.to_thread(database.create_job, job["job_id"], product_id, product_name)
+        except Exception:
+            del self._in_flight[product_id]
+            del self._jobs[job["job_id"]]
+            raise
+        self._queue.put_nowait(job["job_id"])
+        return job, False
+
+    async def _set_status(self, job: dict, status: str, **fields):
+        job.update(fields, status=status, updated_at=time.time())
+        try:
+            await asyncio.to_thread(
+                database.update_job, job["job_id"], status, job["report_id"], job["error"]
+            )
+        except Exception as e:
+            logger.warning("Could not persist status of job %s: %s", job["job_id"], e)
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs[job_id]
+            try:
+                await self._set_status(job, "running")
+                report, saved = await run_diagnosis(job["product_id"], job["product_name"])
+                await self._set_status(job, "succeeded", report_id=report["report_id"], report=report)
+                if saved is not None:
+                    task = asyncio.create_task(self._record_report_id(job, saved))
+                    self._report_writes.add(task)
+                    task.add_done_callback(self._report_writes.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Worker %d: job %s failed: %s", worker_id, job_id, e)
+                await self._set_status(job, "failed", error=str(e))
+            finally:
+                if self._in_flight.get(job["product_id"]) == job_id:
+                    del self._in_flight[job["product_id"]]
+                self._queue.task_done()
+
+    async def _record_report_id(self, job: dict, saved: asyncio.Future):
+        # The job succeeded before its report was written; fill in the id once it is.
+        try:
+            report_id = await saved
+        except Exception as e:
+            logger.warning("Report of job %s was not saved: %s", job["job_id"], e)
+            return
+        job["report_id"] = report_id
+        job["report"]["report_id"] = report_id
+        try:
+            await asyncio.to_thread(
+                database.update_job, job["job_id"], job["status"], report_id, job["error"]
+            )
+        except Exception as e:
+            logger.warning("Could not persist report_id of job %s: %s", job["job_id"], e)
+
+    async def get(self, job_id: str):
+        """Returns a job from memory, falling back to the diagnosis_jobs table."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        try:
+            uuid.UUID(job_id)
+        except ValueError:
+            return None
+        row = await asyncio.to_thread(database.get_job, job_id)
+        if row is None:
+            return None
+        report = None
+        if row["report_id"] is not None:
+            report = {
+                "product_id": row["product_id"],
+                "product_name": row["product_name"],
+                "summary": row["summary"],
+                "raw_data": row["raw_data"],
+                "report_id": row["report_id"],
+            }
+        return {
+            "job_id": row["job_id"],
+            "product_id": row["product_id"],
+            "product_name": row["product_name"],
+            "status": row["status"],
+            "report_id": row["report_id"],
+            "error": row["error"],
+            "report": report,
+            "created_at": row["created_at"].timestamp(),
+            "updated_at": row["updated_at"].timestamp(),
+        }
+
+    async def watch(self, job_id: str):
+        """Yields a snapshot of the job each time it changes, until it finishes."""
+        job = await self.get(job_id)
+        if job is None:
+            return
+        last_status = None
+        while True:
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield dict(job)
+            if job["status"] in TERMINAL_STATUSES or job_id not in self._jobs:
+                return
+            async with self._changed:
+                await self._changed.wait()
+
+    async def wait(self, job_id: str) -> dict:
+        """Waits for a job to finish and returns its final state."""
+        job = None
+        async for job in self.watch(job_id):
+            pass
+        return job
+
+
+job_manager = JobManager()
@@ -0,0 +1,212 @@
+# Shared module. text-to-sql-api/app/llm.py is the source and diagnostics-api/app/llm.py
+# a vendored copy that must stay byte-identical: edit the source, then run
+# python scripts/sync_shared_modules.py --write.
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+
+from . import observability
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+
+LLM_MODEL = os.environ.get("LLM_MODEL", "llama-3.1-8b-instant")
+# Point the client at any OpenAI-compatible server (e.g. a local fake for
+# tests and benchmarks) instead of api.groq.com.
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL") or None
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BACKOFF = float(os.environ.get("LLM_RETRY_BACKOFF", "0.5"))
+LLM_RETRY_BACKOFF_MAX = float(os.environ.get("LLM_RETRY_BACKOFF_MAX", "8"))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+
+
+class LLMError(Exception):
+    """Raised when the LLM call fails; `retryable` marks transient failures."""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class LLMResult:
+    """The text of a completion plus what it cost."""
+
+    def __init__(self, content: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.content = content
+        self.latency = latency
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+# --- Backends ---
+
+class GroqBackend:
+    """
+    Talks to Groq (or any OpenAI-compatible server at LLM_BASE_URL) through
+    one long-lived async client, so every call reuses warm HTTPS connections.
+    """
+
+    def __init__(self, base_url: str = LLM_BASE_URL):
+        # Imported here so other backends work without the groq package.
+        import groq
+
+        self._errors = groq
+        self._client = groq.AsyncGroq(
+            api_key=os.environ.get("GROQ_API_KEY") or "not-needed",
+            base_url=base_url,
+            timeout=LLM_TIMEOUT,
+            # Retries are handled by the gateway, with jitter and accounting.
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                timeout=LLM_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONCURRENCY,
+                    max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                ),
+            ),
+        )
+
+    async def complete(self, messages: list, model: str, temperature: float,
+                       response_format: dict = None, timeout: float = LLM_TIMEOUT):
+        """Returns (content, usage) where usage has prompt_tokens/completion_tokens."""
+        kwargs = {"response_format": response_format} if response_format else {}
+        try:
+            completion = await self._client.chat.completions.create(
+                messages=messages, model=model, temperature=temperature, timeout=timeout, **kwargs
+            )
+        except (self._errors.APITimeoutError, self._errors.APIConnectionError,
+                self._errors.RateLimitError, self._errors.InternalServerError) as e:
+            raise LLMError(str(e), retryable=True) from e
+        except self._errors.APIError as e:
+            raise LLMError(str(e)) from e
+
+        if not completion.choices:
+            raise LLMError("The LLM returned an empty 'choices' list.")
+        usage = completion.usage
+        return completion.choices[0].message.content, {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        }
+
+    async def aclose(self):
+        await self._client.close()
+
+
+# --- Gateway ---
+
+class LLMGateway:
+    """
+    The single entry point for LLM calls in this process.
+
+    It owns one backend, caps in-flight calls at LLM_MAX_CONCURRENCY to stay
+    under provider rate limits, applies a per-call timeout, retries transient
+    failures with jittered exponential backoff, and accounts latency and
+    token usage. Any object with the GroqBackend `complete` signature can be
+    plugged in with set_backend().
+    """
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._semaphore = None
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def set_backend(self, backend):
+        self._backend = backend
+
+    def _get_backend(self):
+        if self._backend is None:
+            self._backend = GroqBackend()
+        return self._backend
+
+    def _get_semaphore(self):
+        # Created lazily so it belongs to the running event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        return self._semaphore
+
+    async def chat(self, prompt: str, temperature: float = 0, response_format: dict = None,
+                   model: str = None, timeout: float = LLM_TIMEOUT) -> LLMResult:
+        """Sends a single-message chat completion and returns an LLMResult."""
+        backend = self._get_backend()
+        messages = [{"role": "user", "content": prompt}]
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                async with self._get_semaphore():
+                    started = time.perf_counter()
+                    try:
+                        content, usage = await asyncio.wait_for(
+                            backend.complete(messages, model or LLM_MODEL, temperature, response_format, timeout),
+                            timeout=timeout,
+                        )
+                    except asyncio.TimeoutError as e:
+                        raise LLMError(f"LLM call timed out after {timeout}s", retryable=True) from e
+                    latency = time.perf_counter() - started
+            except LLMError as e:
+                if not e.retryable or attempt == LLM_MAX_RETRIES:
+                    self.errors += 1
+                    raise
+                self.retries += 1
+                delay = random.uniform(0, min(LLM_RETRY_BACKOFF_MAX, LLM_RETRY_BACKOFF * (2 ** attempt)))
+                logger.warning("LLM attempt %d failed (%s); retrying in %.2fs", attempt + 1, e, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            self.calls += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+            observability.LLM_TOKENS.inc(usage.get("prompt_tokens", 0), kind="prompt")
+            observability.LLM_TOKENS.inc(usage.get("completion_tokens", 0), kind="completion")
+            return LLMResult(content or "", latency, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_latency_seconds": round(self.total_latency / self.calls, 4) if self.calls else 0.0,
+            "max_latency_seconds": round(self.max_latency, 4),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+    async def aclose(self):
+        if self._backend is not None and hasattr(self._backend, "aclose"):
+            await self._backend.aclose()
+        if isinstance(self._backend, GroqBackend):
+            # A fresh client is built on next use.
+            self._backend = None
+        self._semaphore = None
+
+
+gateway = LLMGateway()
+
+
+async def chat(prompt: str, temperature: float = 0, response_format: dict = None,
+               model: str = None, timeout: float = LLM_TIMEOUT) -> LLMResult:
+    return await gateway.chat(prompt, temperature, response_format, model, timeout)
+
+
+def set_backend(backend):
+    gateway.set_backend(backend)
+
+
+def stats() -> dict:
+    return gateway.stats()
+
+
+async def close():
+    await gateway.aclose()
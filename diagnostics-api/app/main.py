@@ -1,20 +1,48 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import os
+import asyncio
+import json
+import logging
+from datetime import datetime
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 
 # Import our custom modules
 from . import tools
-from . import database
+from . import jobs
+from . import llm
+from . import observability
+from . import report_writer
+from . import reports
 
 # Load environment variables from .env file
 load_dotenv()
 
+observability.configure_logging()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await report_writer.report_writer.start()
+    await jobs.job_manager.start()
+    yield
+    await jobs.job_manager.stop()
+    # Flush reports that are still queued for writing, then record their ids on the jobs.
+    await report_writer.report_writer.stop()
+    await jobs.job_manager.settle()
+    # Close the shared keep-alive clients used for M2M and LLM calls.
+    await tools.close_http_client()
+    await llm.close()
+
+
 app = FastAPI(
     title="Diagnostics API",
     description="A service that runs automated diagnostic tools.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 
@@ -30,41 +58,196 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+# Request counters/latency histograms and the Prometheus /metrics endpoint.
+observability.install(app)
+
 # --- Pydantic Models ---
 class DiagnoseRequest(BaseModel):
     product_id: int
     product_name: str
 
+class FleetDiagnoseRequest(BaseModel):
+    products: list[DiagnoseRequest]
+
 # --- API Endpoints ---
+@app.get("/admin/llm", tags=["Admin"])
+async def llm_stats():
+    """Returns call, retry, latency and token counters for the LLM gateway."""
+    return llm.stats()
+
+@app.get("/admin/report-writer", tags=["Admin"])
+async def report_writer_stats():
+    """Returns queue depth and batch counters for the report writer."""
+    return report_writer.report_writer.stats()
+
 @app.post("/tools/diagnose-product", tags=["Tools"])
 async def run_product_diagnosis(request: DiagnoseRequest):
     """
     Triggers the product diagnosis tool, saves the result, 
     and returns the final report.
+    Concurrent requests for the same product share one execution.
     """
     try:
-        # 1. Run the actual "detective tool" from tools.py
-        diagnosis_report = tools.diagnose_product_issues(
-            product_id=request.product_id,
-            product_name=request.product_name
-        )
+        # 1. Run the "detective tool" through the job queue, joining any
+        #    diagnosis already in flight for this product
+        job, _ = await jobs.job_manager.submit(request.product_id, request.product_name)
+        job = await jobs.job_manager.wait(job["job_id"])
 
-        if "error" in diagnosis_report:
+        if job["status"] == "failed":
             # If the tool itself returned an error, pass it along
-            raise HTTPException(status_code=500, detail=diagnosis_report["error"])
-
-        # 2. Save the successful diagnosis report to our own database
-        database.save_diagnosis_result(
-            product_id=diagnosis_report["product_id"],
-            product_name=diagnosis_report["product_name"],
-            summary=diagnosis_report["summary"],
-            raw_data=diagnosis_report["raw_data"]
-        )
+            raise HTTPException(status_code=500, detail=job["error"])
 
-        # 3. Return the report to the user
-        return diagnosis_report
+        # 2. The worker queued the report for saving; return it to the user
+        report = dict(job["report"])
+        report.pop("report_id", None)
+        return report
 
+    except HTTPException:
+        raise
+    except jobs.QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         # This will catch any unexpected errors during the process
-        print(f"An unexpected error occurred in the main endpoint: {e}")
+        logger.exception("An unexpected error occurred in the main endpoint: %s", e)
+        raise HTTPException(status_code=500, detail=f"An unexpected server error occurred: {e}")
+
+
+@app.post("/jobs/diagnose-product", status_code=202, tags=["Jobs"])
+async def submit_product_diagnosis(request: DiagnoseRequest):
+    """
+    Queues a product diagnosis and returns its job id right away. If a job
+    for the same product is already queued or running, that job is returned.
+    """
+    try:
+        job, deduplicated = await jobs.job_manager.submit(request.product_id, request.product_name)
+    except jobs.QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"job_id": job["job_id"], "status": job["status"], "deduplicated": deduplicated}
+
+
+@app.get("/jobs/{job_id}", tags=["Jobs"])
+async def get_job(job_id: str):
+    """Returns the status of a diagnosis job, with its report once it has succeeded."""
+    job = await jobs.job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+@app.get("/jobs/{job_id}/events", tags=["Jobs"])
+async def stream_job_events(job_id: str):
+    """Streams the job's status changes as Server-Sent Events until it finishes."""
+    if await jobs.job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+
+    async def events():
+        async for job in jobs.job_manager.watch(job_id):
+            yield f"event: {job['status']}\ndata: {json.dumps(job, default=str)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/tools/diagnose-fleet", tags=["Tools"])
+async def run_fleet_diagnosis(request: FleetDiagnoseRequest):
+    """
+    Diagnoses many products in one run using shared, set-based SQL templates,
+    saves one report per product, and returns the per-product summaries.
+    """
+    try:
+        products = [product.model_dump() for product in request.products]
+        fleet_report = await tools.diagnose_fleet(products)
+
+        if "error" in fleet_report:
+            raise HTTPException(status_code=500, detail=fleet_report["error"])
+
+        # Queued together, the reports are written in as few batches as possible.
+        # The response does not wait for the write; failures are logged by the writer.
+        for report in fleet_report["reports"]:
+            await report_writer.report_writer.enqueue(
+                product_id=report["product_id"],
+                product_name=report["product_name"],
+                summary=report["summary"],
+                raw_data=report["raw_data"]
+            )
+
+        # The raw data is stored with each report; keep the response small.
+        return {
+            "questions": fleet_report["questions"],
+            "reports": [
+                {key: report[key] for key in ("product_id", "product_name", "summary")}
+                for report in fleet_report["reports"]
+            ],
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("An unexpected error occurred in the fleet endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"An unexpected server error occurred: {e}")
+
+
+# --- Report History ---
+# List views return DEFAULT_FIELDS; pass ?fields=a,b,... (e.g. raw_data) for more.
+
+@app.get("/reports/latest", tags=["Reports"])
+async def get_latest_reports(
+    product_id: list[int] = Query(None),
+    fields: str = None,
+    limit: int = None,
+    cursor: str = None,
+):
+    """Returns the latest report of every product, or of the given product_ids."""
+    try:
+        return await asyncio.to_thread(
+            reports.latest_reports, product_id, reports.parse_fields(fields), limit, cursor
+        )
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/reports", tags=["Reports"])
+async def list_reports(
+    product_id: int = None,
+    since: datetime = None,
+    until: datetime = None,
+    q: str = None,
+    contains: str = None,
+    fields: str = None,
+    limit: int = None,
+    cursor: str = None,
+):
+    """
+    Returns reports newest first. Filters: product_id, a [since, until) time
+    range, q (full-text search over the summary and raw data) and contains
+    (a JSON document the raw data must contain). Pass next_cursor back as
+    cursor to get the next page.
+    """
+    try:
+        document = json.loads(contains) if contains else None
+        return await asyncio.to_thread(
+            reports.list_reports,
+            product_id=product_id,
+            since=since,
+            until=until,
+            text=q,
+            contains=document,
+            fields=reports.parse_fields(fields),
+            limit=limit,
+            cursor=cursor,
+        )
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/reports/{report_id}", tags=["Reports"])
+async def get_report(report_id: int, fields: str = None):
+    """Returns one report; all fields unless fields is given."""
+    try:
+        selected = reports.parse_fields(fields) if fields else list(reports.REPORT_FIELDS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    report = await asyncio.to_thread(reports.get_report, report_id, selected)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Unknown report: {report_id}")
+    return report
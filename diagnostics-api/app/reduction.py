@@ -0,0 +1,262 @@
+import json
+import os
+import re
+from collections import Counter
+from datetime import datetime
+
+# --- Configuration ---
+
+# Rough upper bound, in tokens, on the data put into one summary prompt.
+SUMMARY_TOKEN_BUDGET = int(os.environ.get("SUMMARY_TOKEN_BUDGET", "3000"))
+# Most rows and most values per column kept for each question before the budget is applied.
+REDUCTION_SAMPLE_ROWS = int(os.environ.get("REDUCTION_SAMPLE_ROWS", "8"))
+REDUCTION_TOP_VALUES = int(os.environ.get("REDUCTION_TOP_VALUES", "8"))
+# Word-set (Jaccard) similarity at which two texts count as the same complaint.
+REDUCTION_SIMILARITY = float(os.environ.get("REDUCTION_SIMILARITY", "0.8"))
+# Longest text kept in a sample row or a top-text entry.
+REDUCTION_MAX_TEXT_CHARS = int(os.environ.get("REDUCTION_MAX_TEXT_CHARS", "160"))
+
+# Key under which the last-resort fallback reports how many questions it had to leave out.
+OMITTED_KEY = "omitted_questions"
+
+# String columns with at most this many distinct values are counted like a status.
+_CATEGORY_MAX_DISTINCT = 20
+# Texts are compared against at most this many clusters, which keeps deduplication linear.
+_MAX_CLUSTERS = 200
+_TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}")
+_WORD = re.compile(r"[a-z]+")
+
+
+def estimate_tokens(text: str) -> int:
+    # A tokenizer-free estimate: about four characters per token for JSON.
+    return len(text) // 4 + 1
+
+
+def compact(data) -> str:
+    """JSON without indentation or spaces after separators."""
+    return json.dumps(data, separators=(",", ":"), default=str, ensure_ascii=False)
+
+
+def _clip(value, limit: int = REDUCTION_MAX_TEXT_CHARS):
+    if isinstance(value, str) and len(value) > limit:
+        return value[:limit - 1] + "…"
+    return value
+
+
+# --- Near-duplicate texts ---
+
+def _words(text: str) -> frozenset:
+    return frozenset(_WORD.findall(text.lower()))
+
+
+def cluster_texts(texts: list, similarity: float = REDUCTION_SIMILARITY) -> list:
+    """
+    Groups near-identical texts. Returns [(representative, count)] with the
+    biggest groups first; the representative is the first text of its group.
+    """
+    clusters = []  # [representative, words, count]
+    exact = {}
+    for text in texts:
+        words = _words(text)
+        key = " ".join(sorted(words))
+        if key in exact:
+            exact[key][2] += 1
+            continue
+        match = None
+        for cluster in clusters[:_MAX_CLUSTERS]:
+            other = cluster[1]
+            # Jaccard can only reach the threshold when the sizes are close enough.
+            if not words or not other or min(len(words), len(other)) < similarity * max(len(words), len(other)):
+                continue
+            if len(words & other) / len(words | other) >= similarity:
+                match = cluster
+                break
+        if match is None:
+            match = [text, words, 0]
+            clusters.append(match)
+        match[2] += 1
+        exact[key] = match
+    clusters.sort(key=lambda cluster: -cluster[2])
+    return [(representative, count) for representative, _, count in clusters]
+
+
+# --- Column aggregates ---
+
+def _time_buckets(values: list, top: int) -> dict:
+    """Counts ISO timestamps per hour, day, month or year, whichever suits the span."""
+    try:
+        first = datetime.fromisoformat(min(values)[:19])
+        last = datetime.fromisoformat(max(values)[:19])
+    except ValueError:
+        return None
+    span_days = (last - first).days
+    if span_days <= 2:
+        name, width = "by_hour", 13
+    elif span_days <= 90:
+        name, width = "by_day", 10
+    elif span_days <= 3 * 365:
+        name, width = "by_month", 7
+    else:
+        name, width = "by_year", 4
+    buckets = Counter(value[:width] for value in values)
+    # Keep the most recent buckets; older ones are folded into one count.
+    keys = sorted(buckets)
+    recent = keys[-max(top, 1):]
+    summary = {"first": min(values), "last": max(values), name: {key: buckets[key] for key in recent}}
+    if len(keys) > len(recent):
+        summary["earlier"] = sum(buckets[key] for key in keys[:-len(recent)])
+    return summary
+
+
+def _numeric(values: list) -> dict:
+    return {
+        "min": min(values),
+        "max": max(values),
+        "avg": round(sum(values) / len(values), 2),
+    }
+
+
+def _column_summary(name: str, values: list, top: int):
+    present = [value for value in values if value is not None]
+    if not present:
+        return {"nulls": len(values)}
+    summary = {}
+    if len(present) < len(values):
+        summary["nulls"] = len(values) - len(present)
+
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        if name == "id" or name.endswith("_id"):
+            summary["distinct"] = len(set(present))
+        else:
+            summary.update(_numeric(present))
+        return summary
+    if not all(isinstance(value, str) for value in present):
+        counts = Counter(compact(value) for value in present)
+        summary["distinct"] = len(counts)
+        return summary
+
+    if all(_TIMESTAMP.match(value) for value in present):
+        buckets = _time_buckets(present, top)
+        if buckets is not None:
+            summary.update(buckets)
+            return summary
+
+    counts = Counter(present)
+    if len(counts) <= _CATEGORY_MAX_DISTINCT:
+        summary["counts"] = dict(counts.most_common(top))
+        if len(counts) > top:
+            summary["other"] = sum(counts.values()) - sum(summary["counts"].values())
+        return summary
+
+    # Free text, e.g. ticket subjects: count the distinct complaints behind it.
+    clusters = cluster_texts(present)
+    summary["distinct"] = len(clusters)
+    summary["top"] = [[_clip(text), count] for text, count in clusters[:top]]
+    return summary
+
+
+def _sample(rows: list, size: int) -> list:
+    """Evenly spaced rows, first and last included, with long texts clipped."""
+    if size <= 0:
+        return []
+    if len(rows) <= size:
+        picked = rows
+    elif size == 1:
+        picked = rows[:1]
+    else:
+        step = (len(rows) - 1) / (size - 1)
+        picked = [rows[round(i * step)] for i in range(size)]
+    return [
+        {key: _clip(value) for key, value in row.items()} if isinstance(row, dict) else _clip(row)
+        for row in picked
+    ]
+
+
+def reduce_rows(rows: list, sample_rows: int = REDUCTION_SAMPLE_ROWS, top: int = REDUCTION_TOP_VALUES) -> dict:
+    """Aggregates one question's rows: row count, per-column summaries and a sample."""
+    reduced = {"rows": len(rows)}
+    dict_rows = [row for row in rows if isinstance(row, dict)]
+    if dict_rows:
+        columns = list(dict.fromkeys(key for row in dict_rows for key in row))
+        reduced["columns"] = {
+            column: _column_summary(column, [row.get(column) for row in dict_rows], top)
+            for column in columns
+        }
+    reduced["sample"] = _sample(rows, sample_rows)
+    return reduced
+
+
+# --- Prompt data ---
+
+def _trim(reduced: dict, sample_rows: int, top: int) -> dict:
+    """Shrinks an already reduced question to a smaller sample and shorter top lists."""
+    trimmed = dict(reduced, sample=_sample(reduced["sample"], sample_rows))
+    if "columns" in reduced:
+        trimmed["columns"] = {
+            column: dict(summary, top=summary["top"][:top]) if "top" in summary else summary
+            for column, summary in reduced["columns"].items()
+        }
+    return trimmed
+
+
+def _clip_entry(data):
+    """Clips an error entry (or any other non-list answer) value by value; nested values are flattened to text."""
+    def clip(value):
+        return _clip(compact(value) if isinstance(value, (dict, list)) else value)
+
+    if isinstance(data, dict):
+        return {key: clip(value) for key, value in data.items()}
+    return clip(data)
+
+
+def _fit_counts(raw_data: dict, budget: int) -> str:
+    """
+    Last resort: row counts and clipped errors only. Whole questions are
+    dropped from the end until the JSON fits, so it always stays valid.
+    """
+    entries = [
+        (question, {"rows": len(data)} if isinstance(data, list) else _clip_entry(data))
+        for question, data in raw_data.items()
+    ]
+    while True:
+        kept = dict(entries)
+        if len(entries) < len(raw_data):
+            kept[OMITTED_KEY] = len(raw_data) - len(entries)
+        text = compact(kept)
+        if estimate_tokens(text) <= budget or not entries:
+            return text
+        entries.pop()
+
+
+def reduce_for_prompt(raw_data: dict, budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    Returns the collected data as compact JSON within the token budget. Data
+    that fits is passed through whole. Otherwise each question's rows are
+    replaced by aggregates and a sample, and the sample and top lists are
+    shrunk until the text fits. The result is always valid JSON; as a last
+    resort only row counts and clipped errors are kept, and questions that
+    still do not fit are left out and counted under OMITTED_KEY.
+    """
+    text = compact(raw_data)
+    if estimate_tokens(text) <= budget:
+        return text
+
+    reduced = {
+        question: reduce_rows(data) if isinstance(data, list) else data
+        for question, data in raw_data.items()
+    }
+    sample_rows, top = REDUCTION_SAMPLE_ROWS, REDUCTION_TOP_VALUES
+    while True:
+        text = compact({
+            question: _trim(data, sample_rows, top) if isinstance(raw_data[question], list) else data
+            for question, data in reduced.items()
+        })
+        if estimate_tokens(text) <= budget or (sample_rows == 0 and top <= 1):
+            break
+        if sample_rows > 0:
+            sample_rows //= 2
+        else:
+            top //= 2
+    if estimate_tokens(text) > budget:
+        text = _fit_counts(raw_data, budget)
+    return text
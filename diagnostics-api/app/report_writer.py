@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import time
+
+from . import database
+from . import observability
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+
+# A batch is written as soon as it has this many reports...
+REPORT_WRITE_BATCH_SIZE = int(os.environ.get("REPORT_WRITE_BATCH_SIZE", "50"))
+# ...or once its oldest report has waited this long (seconds).
+REPORT_WRITE_FLUSH_INTERVAL = float(os.environ.get("REPORT_WRITE_FLUSH_INTERVAL", "0.5"))
+REPORT_WRITE_QUEUE_MAX = int(os.environ.get("REPORT_WRITE_QUEUE_MAX", "1000"))
+
+# Queued by stop(); everything ahead of it is written before the flusher exits.
+_STOP = object()
+
+
+class ReportWriter:
+    """
+    Write-behind persistence for diagnosis reports.
+
+    Reports are queued in memory and a background flusher writes them in
+    batches, one transaction per batch (see database.save_diagnosis_results).
+    A batch is written once it is full or its oldest report has waited
+    flush_interval, whichever comes first. Callers get a future for the
+    report_id and never have to wait for it: a response can go out while its
+    report is still queued. Failed writes are logged here, so an unobserved
+    future is fine. Everything still queued is flushed on stop().
+    """
+
+    def __init__(self, batch_size: int = REPORT_WRITE_BATCH_SIZE,
+                 flush_interval: float = REPORT_WRITE_FLUSH_INTERVAL,
+                 queue_max: int = REPORT_WRITE_QUEUE_MAX):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_max = queue_max
+        self._queue = None
+        self._task = None
+        self.batches = 0
+        self.reports = 0
+        self.failures = 0
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_max)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Writes whatever is still queued, then stops the flusher."""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def enqueue(self, product_id: int, product_name: str, summary: str, raw_data: dict,
+                      watermark: dict = None) -> asyncio.Future:
+        """Queues a report and returns a future that resolves to its report_id."""
+        future = asyncio.get_running_loop().create_future()
+        # _flush already logs failures; mark them retrieved for callers that never await.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        report = {
+            "product_id": product_id,
+            "product_name": product_name,
+            "summary": summary,
+            "raw_data": raw_data,
+            "watermark": watermark,
+        }
+        # Waits here only when the queue is full, which applies backpressure.
+        await self._queue.put((report, future))
+        return future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        try:
+            with observability.timed("report_persist"):
+                report_ids = await asyncio.to_thread(
+                    database.save_diagnosis_results, [report for report, _ in batch]
+                )
+        except Exception as e:
+            self.failures += 1
+            logger.error("Failed to write a batch of %d reports: %s", len(batch), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.reports += len(batch)
+        for (_, future), report_id in zip(batch, report_ids):
+            if not future.done():
+                future.set_result(report_id)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "reports": self.reports,
+            "avg_batch_size": round(self.reports / self.batches, 2) if self.batches else 0.0,
+            "failures": self.failures,
+        }
+
+
+report_writer = ReportWriter()
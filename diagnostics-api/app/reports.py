@@ -0,0 +1,183 @@
+import base64
+import json
+import os
+
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from . import database
+
+# --- Configuration ---
+
+REPORTS_PAGE_SIZE = int(os.environ.get("REPORTS_PAGE_SIZE", "50"))
+REPORTS_PAGE_MAX = int(os.environ.get("REPORTS_PAGE_MAX", "200"))
+
+# Fields a caller may ask for, and where each one comes from. raw_data is the
+# only one that needs the payload join, so list views skip it unless asked.
+REPORT_FIELDS = {
+    "report_id": "r.report_id",
+    "product_id": "r.product_id",
+    "product_name": "r.product_name",
+    "summary": "r.summary",
+    "watermark": "r.watermark",
+    "created_at": "r.created_at",
+    "payload_hash": "r.payload_hash",
+    "raw_data": "p.raw_data",
+}
+DEFAULT_FIELDS = ("report_id", "product_id", "product_name", "summary", "created_at")
+
+# These expressions must match the indexes in init-db-diagnostics/init.sql.
+_SUMMARY_MATCHES = "to_tsvector('english', coalesce(r.summary, '')) @@ websearch_to_tsquery('english', %s)"
+_PAYLOAD_MATCHES = """r.payload_hash IN (
+        SELECT payload_hash FROM diagnosis_payloads
+        WHERE to_tsvector('english', raw_data) @@ websearch_to_tsquery('english', %s))"""
+_PAYLOAD_CONTAINS = """r.payload_hash IN (
+        SELECT payload_hash FROM diagnosis_payloads WHERE raw_data @> %s::jsonb)"""
+
+
+def parse_fields(fields: str = None) -> list:
+    """Turns a comma-separated field list into a list of known fields. Raises ValueError."""
+    if not fields:
+        return list(DEFAULT_FIELDS)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in REPORT_FIELDS]
+    if unknown:
+        raise ValueError(
+            f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(REPORT_FIELDS)}."
+        )
+    return list(dict.fromkeys(requested))
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    """Reverses encode_cursor(). Raises ValueError for anything it did not produce."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+def _page_size(limit: int = None) -> int:
+    return max(1, min(limit or REPORTS_PAGE_SIZE, REPORTS_PAGE_MAX))
+
+
+def _select(fields: list, keys: tuple) -> tuple:
+    """
+    Builds the select list and FROM clause for the requested fields. The
+    pagination keys are always selected so the next cursor can be built.
+    """
+    columns = list(dict.fromkeys(list(fields) + list(keys)))
+    select_list = sql.SQL(", ").join(
+        sql.SQL("{} AS {}").format(sql.SQL(REPORT_FIELDS[column]), sql.Identifier(column))
+        for column in columns
+    )
+    source = "diagnosis_reports r"
+    if "raw_data" in columns:
+        source += " LEFT JOIN diagnosis_payloads p ON p.payload_hash = r.payload_hash"
+    return select_list, sql.SQL(source)
+
+
+def _fetch(query, params: list) -> list:
+    conn = None
+    try:
+        conn = database.get_db_connection()
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, params)
+            return cur.fetchall()
+    finally:
+        if conn:
+            conn.close()
+
+
+def _page(rows: list, fields: list, size: int, key) -> dict:
+    """Trims the look-ahead row, builds next_cursor and drops unrequested keys."""
+    next_cursor = encode_cursor(key(rows[size - 1])) if len(rows) > size else None
+    return {
+        "reports": [{field: row[field] for field in fields} for row in rows[:size]],
+        "next_cursor": next_cursor,
+    }
+
+
+def latest_reports(product_ids: list = None, fields: list = DEFAULT_FIELDS, limit: int = None,
+                   cursor: str = None) -> dict:
+    """
+    The most recent report of each product (or of the given products),
+    ordered by product_id and paginated on it.
+    """
+    size = _page_size(limit)
+    select_list, source = _select(fields, ("product_id",))
+    conditions, params = [], []
+    if product_ids:
+        conditions.append("r.product_id = ANY(%s)")
+        params.append(list(product_ids))
+    if cursor:
+        conditions.append("r.product_id > %s")
+        params.append(int(decode_cursor(cursor, 1)[0]))
+    query = sql.SQL(
+        "SELECT DISTINCT ON (r.product_id) {select_list} FROM {source} {where} "
+        "ORDER BY r.product_id, r.created_at DESC, r.report_id DESC LIMIT %s"
+    ).format(
+        select_list=select_list,
+        source=source,
+        where=sql.SQL("WHERE " + " AND ".join(conditions) if conditions else ""),
+    )
+    rows = _fetch(query, params + [size + 1])
+    return _page(rows, fields, size, lambda row: [row["product_id"]])
+
+
+def list_reports(product_id: int = None, since=None, until=None, text: str = None,
+                 contains: dict = None, fields: list = DEFAULT_FIELDS, limit: int = None,
+                 cursor: str = None) -> dict:
+    """
+    Reports newest first, optionally for one product, within [since, until),
+    matching a full-text query over the summary and raw data, and/or whose
+    raw_data contains a JSON document. Paginated on (created_at, report_id).
+    """
+    size = _page_size(limit)
+    select_list, source = _select(fields, ("created_at", "report_id"))
+    conditions, params = [], []
+    if product_id is not None:
+        conditions.append("r.product_id = %s")
+        params.append(product_id)
+    if since is not None:
+        conditions.append("r.created_at >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("r.created_at < %s")
+        params.append(until)
+    if text:
+        conditions.append(f"({_SUMMARY_MATCHES} OR {_PAYLOAD_MATCHES})")
+        params.extend([text, text])
+    if contains is not None:
+        conditions.append(_PAYLOAD_CONTAINS)
+        params.append(json.dumps(contains))
+    if cursor:
+        created_at, report_id = decode_cursor(cursor, 2)
+        conditions.append("(r.created_at, r.report_id) < (%s::timestamptz, %s)")
+        params.extend([created_at, int(report_id)])
+    query = sql.SQL(
+        "SELECT {select_list} FROM {source} {where} "
+        "ORDER BY r.created_at DESC, r.report_id DESC LIMIT %s"
+    ).format(
+        select_list=select_list,
+        source=source,
+        where=sql.SQL("WHERE " + " AND ".join(conditions) if conditions else ""),
+    )
+    rows = _fetch(query, params + [size + 1])
+    return _page(rows, fields, size, lambda row: [row["created_at"].isoformat(), row["report_id"]])
+
+
+def get_report(report_id: int, fields: list = tuple(REPORT_FIELDS)):
+    """Returns one report with the requested fields, or None."""
+    select_list, source = _select(fields, ())
+    query = sql.SQL("SELECT {select_list} FROM {source} WHERE r.report_id = %s").format(
+        select_list=select_list, source=source,
+    )
+    rows = _fetch(query, [report_id])
+    return rows[0] if rows else None
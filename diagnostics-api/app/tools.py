@@ -1,9 +1,15 @@
 import os
 import httpx
 import json
-from groq import Groq
-import time
-import traceback
+import asyncio
+import logging
+
+from . import database
+from . import llm
+from . import observability
+from . import reduction
+
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 # --- FIX APPLIED HERE ---
@@ -11,40 +17,142 @@ import traceback
 # set in docker-compose.yml. This makes the code flexible.
 TEXT_TO_SQL_API_URL = os.environ.get("TEXT_TO_SQL_API_URL")
 if not TEXT_TO_SQL_API_URL:
-    print("--- [DIAGNOSTICS] FATAL: TEXT_TO_SQL_API_URL environment variable not set. ---")
+    logger.warning("TEXT_TO_SQL_API_URL environment variable not set; using the docker-compose default.")
     # Set a fallback, but this should always be provided by docker-compose.
     TEXT_TO_SQL_API_URL = "http://text_to_sql_service:8000/ask"
 
+# All questions of a diagnosis are answered with one call to the batch endpoint.
+TEXT_TO_SQL_BATCH_URL = os.environ.get("TEXT_TO_SQL_BATCH_URL", TEXT_TO_SQL_API_URL.rstrip("/") + "/batch")
+DIAGNOSIS_BATCH_TIMEOUT = float(os.environ.get("DIAGNOSIS_BATCH_TIMEOUT", "60"))
+
+# Fleet diagnosis runs each question as one set-based template over all products.
+TEXT_TO_SQL_GROUPED_URL = os.environ.get("TEXT_TO_SQL_GROUPED_URL", TEXT_TO_SQL_API_URL.rstrip("/") + "/grouped")
+FLEET_MAX_ROWS_PER_PRODUCT = int(os.environ.get("FLEET_MAX_ROWS_PER_PRODUCT", "50"))
+FLEET_TIMEOUT = float(os.environ.get("FLEET_TIMEOUT", "300"))
+
+# Watermark checks let repeat diagnoses reuse or incrementally update the last report.
+TEXT_TO_SQL_BASE_URL = os.environ.get("TEXT_TO_SQL_BASE_URL", TEXT_TO_SQL_API_URL.rstrip("/").rsplit("/ask", 1)[0])
+DIAGNOSIS_INCREMENTAL_MAX_NEW = int(os.environ.get("DIAGNOSIS_INCREMENTAL_MAX_NEW", "20"))
+
+# Result format requested from /ask, /ask/batch and /ask/grouped; see the Text-to-SQL API's encoding module.
+TEXT_TO_SQL_COLUMNAR_MEDIA_TYPE = "application/vnd.text-to-sql.columnar+json"
+
+# Fan-out settings, used when the batch endpoint is unavailable.
+DIAGNOSIS_MAX_CONCURRENCY = int(os.environ.get("DIAGNOSIS_MAX_CONCURRENCY", "5"))
+DIAGNOSIS_QUESTION_TIMEOUT = float(os.environ.get("DIAGNOSIS_QUESTION_TIMEOUT", "30"))
+
+# --- Shared HTTP Client ---
+# One keep-alive client is shared by every diagnosis so M2M calls reuse warm
+# connections. It is opened and closed by the application lifespan.
+_http_client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=DIAGNOSIS_QUESTION_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=max(DIAGNOSIS_MAX_CONCURRENCY, 10),
+                max_keepalive_connections=max(DIAGNOSIS_MAX_CONCURRENCY, 10),
+            ),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 
 # --- Main Tool Function ---
 
-def diagnose_product_issues(product_id: int, product_name: str):
+async def diagnose_product(product_id: int, product_name: str):
+    """
+    Diagnoses a product, reusing earlier work when its tickets allow it.
+
+    The product's ticket watermark is compared with the one stored on its
+    latest report. If nothing changed, that report is returned as is
+    ("reused"). If only a few new tickets were added and no older ticket
+    changed, only the new tickets are summarized on top of the previous
+    summary ("incremental"). Otherwise a full diagnosis runs ("full").
+    The returned report carries its "freshness" and the current "watermark".
+    """
+    latest = await asyncio.to_thread(database.get_latest_report, product_id)
+    previous = latest["watermark"] if latest else None
+    watermark = await _fetch_ticket_watermark(product_id, previous["max_created_at"] if previous else None)
+
+    if watermark is not None and previous is not None:
+        current = {key: watermark[key] for key in ("ticket_count", "max_created_at", "status_digest")}
+        if current == previous:
+            logger.info("Tickets unchanged for product %s; reusing report %s", product_id, latest["report_id"])
+            return {
+                "product_id": product_id,
+                "product_name": product_name,
+                "summary": latest["summary"],
+                "raw_data": latest["raw_data"],
+                "watermark": previous,
+                "freshness": "reused",
+                "report_id": latest["report_id"],
+            }
+
+        new_count = watermark["ticket_count"] - previous["ticket_count"]
+        older_unchanged = (
+            watermark.get("prior_ticket_count") == previous["ticket_count"]
+            and watermark.get("prior_status_digest") == previous["status_digest"]
+        )
+        if older_unchanged and 0 < new_count <= DIAGNOSIS_INCREMENTAL_MAX_NEW:
+            new_tickets = await _fetch_new_tickets(product_id, previous["max_created_at"])
+            if new_tickets is not None:
+                logger.info("%d new tickets for product %s; updating summary", new_count, product_id)
+                summary = await _update_summary_with_new_data(product_name, latest["summary"], new_tickets)
+                raw_data = dict(latest["raw_data"] or {})
+                # Successive incremental reports keep accumulating the new tickets.
+                key = "New support tickets since the last full diagnosis"
+                raw_data[key] = list(raw_data.get(key, [])) + new_tickets
+                return {
+                    "product_id": product_id,
+                    "product_name": product_name,
+                    "summary": summary,
+                    "raw_data": raw_data,
+                    "watermark": current,
+                    "freshness": "incremental",
+                }
+
+    report = await diagnose_product_issues(product_id=product_id, product_name=product_name)
+    if "error" not in report:
+        report["freshness"] = "full"
+        # A report with failed questions is not tied to the tickets it saw, so
+        # the next diagnosis runs in full instead of reusing or extending it.
+        failed = any(isinstance(data, dict) and "error" in data for data in report["raw_data"].values())
+        if watermark is not None and not failed:
+            report["watermark"] = {key: watermark[key] for key in ("ticket_count", "max_created_at", "status_digest")}
+    return report
+
+
+async def diagnose_product_issues(product_id: int, product_name: str):
     """
     This is our main "Detective" tool. It investigates product issues dynamically.
     """
-    print(f"\n--- [DIAGNOSTICS] STEP 1: Starting diagnosis for product: {product_name} (ID: {product_id}) ---")
+    logger.info("Starting diagnosis for product %s (ID: %s)", product_name, product_id)
     try:
         # 1. Generate investigatory questions
-        print("\n--- [DIAGNOSTICS] STEP 2: Generating investigatory questions from Groq... ---")
-        questions_to_ask = _get_investigatory_questions(product_name)
+        questions_to_ask = await _get_investigatory_questions(product_name)
         if not questions_to_ask:
-            print("--- [DIAGNOSTICS] ERROR: Failed to generate questions. Aborting. ---")
+            logger.error("Failed to generate questions. Aborting.")
             return {"error": "Could not generate investigatory questions from the AI."}
-        print(f"--- [DIAGNOSTICS] SUCCESS: Generated {len(questions_to_ask)} questions: {questions_to_ask} ---")
+        logger.debug("Generated %d questions: %s", len(questions_to_ask), questions_to_ask)
 
-        # 2. Answer each question using Text-to-SQL service
-        print("\n--- [DIAGNOSTICS] STEP 3: Fetching data from Text-to-SQL service... ---")
-        raw_data = {}
-        for question in questions_to_ask:
-            print(f"--- [DIAGNOSTICS] Sub-step: Asking '{question}' ---")
-            data = _fetch_data_from_text_to_sql_api(question)
-            raw_data[question] = data
-            print(f"--- [DIAGNOSTICS] Sub-step: Received data: {json.dumps(data, indent=2)} ---")
+        # 2. Answer all questions in one batch call to the Text-to-SQL service
+        raw_data = await _fetch_batch_from_text_to_sql_api(questions_to_ask)
+        if raw_data is None:
+            # Fall back to one concurrent /ask call per question.
+            raw_data = await _fetch_all_questions(questions_to_ask)
 
         # 3. Create a final summary
-        print("\n--- [DIAGNOSTICS] STEP 4: Creating summary from collected data... ---")
-        summary = _create_summary_from_data(product_name, raw_data)
-        print(f"--- [DIAGNOSTICS] SUCCESS: Generated summary. ---")
+        summary = await _create_summary_from_data(product_name, raw_data)
 
         final_report = {
             "product_id": product_id,
@@ -52,23 +160,100 @@ def diagnose_product_issues(product_id: int, product_name: str):
             "summary": summary,
             "raw_data": raw_data
         }
-        print("\n--- [DIAGNOSTICS] STEP 5: Diagnosis complete. Final report generated. ---")
+        logger.info("Diagnosis complete for product %s", product_id)
         return final_report
 
     except Exception as e:
-        print(f"--- [DIAGNOSTICS] FATAL ERROR in diagnose_product_issues: {e} ---")
-        traceback.print_exc()
+        logger.exception("Unexpected error in diagnose_product_issues: %s", e)
         return {"error": f"An unexpected fatal error occurred during diagnosis: {e}"}
 
 
+async def diagnose_fleet(products: list[dict]):
+    """
+    Diagnoses many products at once. The questions are generated once and
+    each is answered for every product by a single parameterized, set-based
+    query grouped by product_id. Only the per-product summaries remain
+    per product, and products without any data skip the LLM entirely.
+    """
+    logger.info("Starting fleet diagnosis for %d products", len(products))
+    try:
+        # 1. Generate one set of product-agnostic questions
+        questions_to_ask = await _get_investigatory_questions()
+        if not questions_to_ask:
+            logger.error("Failed to generate questions. Aborting.")
+            return {"error": "Could not generate investigatory questions from the AI."}
+        logger.debug("Generated %d questions: %s", len(questions_to_ask), questions_to_ask)
+
+        # 2. Answer every question for every product in one M2M call
+        product_ids = [product["product_id"] for product in products]
+        with observability.timed("m2m_call"):
+            response = await get_http_client().post(
+                TEXT_TO_SQL_GROUPED_URL,
+                json={
+                    "questions": questions_to_ask,
+                    "group_by": "product_id",
+                    "keys": product_ids,
+                    "max_rows_per_group": FLEET_MAX_ROWS_PER_PRODUCT,
+                },
+                headers={"Accept": TEXT_TO_SQL_COLUMNAR_MEDIA_TYPE},
+                timeout=FLEET_TIMEOUT,
+            )
+        response.raise_for_status()
+        results = response.json().get("results", [])
+
+        # 3. Split the grouped rows back into one raw_data dict per product
+        raw_data_by_product = {product_id: {} for product_id in product_ids}
+        for result in results:
+            question = result["question"]
+            groups = _groups_from_response(result)
+            for product_id in product_ids:
+                if result.get("error"):
+                    raw_data_by_product[product_id][question] = {"error": result["error"]}
+                else:
+                    raw_data_by_product[product_id][question] = groups.get(str(product_id), [])
+
+        # 4. Summarize each product, at most DIAGNOSIS_MAX_CONCURRENCY at a time
+        semaphore = asyncio.Semaphore(DIAGNOSIS_MAX_CONCURRENCY)
+
+        async def summarize(product: dict):
+            raw_data = raw_data_by_product[product["product_id"]]
+            has_rows = any(isinstance(data, list) and data for data in raw_data.values())
+            has_errors = any(isinstance(data, dict) for data in raw_data.values())
+            if not has_rows and not has_errors:
+                summary = "No support tickets or related records were found for this product."
+            else:
+                async with semaphore:
+                    summary = await _create_summary_from_data(product["product_name"], raw_data)
+            return {
+                "product_id": product["product_id"],
+                "product_name": product["product_name"],
+                "summary": summary,
+                "raw_data": raw_data,
+            }
+
+        reports = await asyncio.gather(*(summarize(product) for product in products))
+        logger.info("Fleet diagnosis complete (%d reports)", len(reports))
+        return {"questions": questions_to_ask, "reports": reports}
+
+    except Exception as e:
+        logger.exception("Unexpected error in diagnose_fleet: %s", e)
+        return {"error": f"An unexpected fatal error occurred during fleet diagnosis: {e}"}
+
+
 # --- Helper Functions (with added logging) ---
 
-def _get_investigatory_questions(product_name: str) -> list[str]:
-    """Uses Groq to generate a list of questions to ask about a product."""
+async def _get_investigatory_questions(product_name: str = None) -> list[str]:
+    """
+    Uses the LLM to generate a list of questions to ask about a product.
+    Without a product name, the questions are worded to apply to any product.
+    """
     try:
-        client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+        if product_name:
+            situation = f'A customer is having issues with a product called "{product_name}".'
+        else:
+            situation = "We are reviewing every product in our catalog for issues, one product at a time."
         prompt = f"""
-        You are a diagnostics expert. A customer is having issues with a product called "{product_name}".
+        You are a diagnostics expert. {situation}
         Based on a database containing tables for 'customers', 'products', and 'support_tickets',
         generate a JSON list of 3 specific, useful questions you would ask the database to investigate the problem.
         The questions should be simple, natural language.
@@ -77,18 +262,10 @@ def _get_investigatory_questions(product_name: str) -> list[str]:
         ["What are the most recent support tickets for this product?", "Which customers have open tickets for this product?"]
         """
         
-        chat_completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.1-8b-instant",
-            temperature=0.2,
-            response_format={"type": "json_object"},
-        )
-        
-        if not chat_completion.choices:
-            print("--- [DIAGNOSTICS] HELPER ERROR: Groq API returned an empty 'choices' list for questions.")
-            return []
+        with observability.timed("question_generation"):
+            completion = await llm.chat(prompt, temperature=0.2, response_format={"type": "json_object"})
 
-        response_text = chat_completion.choices[0].message.content
+        response_text = completion.content
         response_data = json.loads(response_text)
         
         if isinstance(response_data, list):
@@ -98,32 +275,156 @@ def _get_investigatory_questions(product_name: str) -> list[str]:
                 return value
         return []
     except Exception as e:
-        print(f"--- [DIAGNOSTICS] HELPER ERROR in _get_investigatory_questions: {e}")
-        traceback.print_exc()
+        logger.exception("Could not generate investigatory questions: %s", e)
         return []
 
-def _fetch_data_from_text_to_sql_api(question: str, max_retries: int = 3, delay: int = 2):
+async def _fetch_ticket_watermark(product_id: int, as_of: str = None):
+    """Reads the product's ticket watermark. Returns None if it is unavailable."""
+    params = {"as_of": as_of} if as_of else {}
+    try:
+        response = await get_http_client().get(
+            f"{TEXT_TO_SQL_BASE_URL}/products/{product_id}/ticket-watermark", params=params
+        )
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning("Could not read ticket watermark for product %s: %s", product_id, e)
+        return None
+
+
+async def _fetch_new_tickets(product_id: int, since: str):
+    """Reads the product's tickets created after `since`. Returns None on failure."""
+    try:
+        response = await get_http_client().get(
+            f"{TEXT_TO_SQL_BASE_URL}/products/{product_id}/tickets",
+            params={"since": since, "limit": DIAGNOSIS_INCREMENTAL_MAX_NEW},
+        )
+        response.raise_for_status()
+        return response.json().get("data", [])
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning("Could not read new tickets for product %s: %s", product_id, e)
+        return None
+
+
+async def _fetch_batch_from_text_to_sql_api(questions: list[str]):
+    """
+    Answers every question with a single M2M call to the batch endpoint.
+    Returns None if the batch call itself fails, so the caller can fall back.
+    """
+    client = get_http_client()
+    try:
+        with observability.timed("m2m_call"):
+            response = await client.post(
+                TEXT_TO_SQL_BATCH_URL,
+                json={"questions": questions},
+                headers={"Accept": TEXT_TO_SQL_COLUMNAR_MEDIA_TYPE},
+                timeout=DIAGNOSIS_BATCH_TIMEOUT,
+            )
+        response.raise_for_status()
+        results = response.json().get("results", [])
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning("M2M batch call failed: %s. Falling back to individual questions.", e)
+        return None
+
+    raw_data = {}
+    for question, result in zip(questions, results):
+        if result.get("error"):
+            raw_data[question] = {"error": result["error"]}
+        else:
+            raw_data[question] = _rows_from_response(result)
+        rows = len(raw_data[question]) if isinstance(raw_data[question], list) else 0
+        logger.debug("Received %d rows for %r", rows, question)
+    for question in questions[len(results):]:
+        raw_data[question] = {"error": "No result returned by the Text-to-SQL batch endpoint."}
+    return raw_data
+
+
+async def _fetch_all_questions(questions: list[str]) -> dict:
+    """
+    Asks every question concurrently, at most DIAGNOSIS_MAX_CONCURRENCY at a time.
+    A question that fails or times out gets an error entry; the others still return.
+    """
+    semaphore = asyncio.Semaphore(DIAGNOSIS_MAX_CONCURRENCY)
+
+    async def ask(question: str):
+        async with semaphore:
+            logger.debug("Asking %r", question)
+            try:
+                return await asyncio.wait_for(
+                    _fetch_data_from_text_to_sql_api(question),
+                    timeout=DIAGNOSIS_QUESTION_TIMEOUT,
+                )
+            except asyncio.TimeoutError:
+                logger.warning("M2M call for %r exceeded %ss", question, DIAGNOSIS_QUESTION_TIMEOUT)
+                return {"error": f"Timed out after {DIAGNOSIS_QUESTION_TIMEOUT}s."}
+
+    results = await asyncio.gather(*(ask(q) for q in questions), return_exceptions=True)
+
+    raw_data = {}
+    for question, result in zip(questions, results):
+        if isinstance(result, Exception):
+            logger.error("M2M call for %r failed: %s", question, result)
+            result = {"error": f"Failed to get data from Text-to-SQL API: {result}"}
+        raw_data[question] = result
+        rows = len(result) if isinstance(result, list) else 0
+        logger.debug("Received %d rows for %r", rows, question)
+    return raw_data
+
+
+def _rows_from_response(payload: dict) -> list:
+    """
+    Returns the result rows as dicts, from either the columnar or the default
+    format of /ask or one /ask/batch result.
+    """
+    if "columns" in payload:
+        names = [column["name"] for column in payload["columns"]]
+        return [dict(zip(names, row)) for row in payload.get("rows", [])]
+    return payload.get("data", [])
+
+
+def _groups_from_response(result: dict) -> dict:
+    """Returns one /ask/grouped result's {key: rows as dicts}, columnar or not."""
+    groups = result.get("groups", {})
+    if "columns" not in result:
+        return groups
+    names = [column["name"] for column in result["columns"]]
+    return {key: [dict(zip(names, row)) for row in rows] for key, rows in groups.items()}
+
+
+async def _fetch_data_from_text_to_sql_api(question: str, max_retries: int = 3, delay: int = 2):
     """Makes an M2M call to our Text-to-SQL API with a retry mechanism."""
+    client = get_http_client()
     for attempt in range(max_retries):
         try:
-            response = httpx.post(TEXT_TO_SQL_API_URL, json={"question": question}, timeout=30.0)
+            with observability.timed("m2m_call"):
+                # Columnar rows skip repeating every column name on every row.
+                response = await client.post(
+                    TEXT_TO_SQL_API_URL,
+                    json={"question": question},
+                    headers={"Accept": TEXT_TO_SQL_COLUMNAR_MEDIA_TYPE},
+                )
             response.raise_for_status()
-            return response.json().get("data", [])
+            return _rows_from_response(response.json())
         except httpx.RequestError as e:
-            print(f"--- [DIAGNTICS] M2M ATTEMPT {attempt + 1}/{max_retries} FAILED: Could not connect. Retrying... Error: {e}")
-            time.sleep(delay)
-    print(f"--- [DIAGNOSTICS] M2M FATAL: Failed to get data after {max_retries} attempts.")
+            logger.warning("M2M attempt %d/%d failed, could not connect: %s", attempt + 1, max_retries, e)
+            if attempt + 1 < max_retries:
+                await asyncio.sleep(delay)
+    logger.error("M2M call failed after %d attempts", max_retries)
     return {"error": f"Failed to get data from Text-to-SQL API after {max_retries} attempts."}
 
-def _create_summary_from_data(product_name: str, raw_data: dict) -> str:
-    """Uses Groq to generate a final summary from the collected data."""
+async def _create_summary_from_data(product_name: str, raw_data: dict) -> str:
+    """Uses the LLM to generate a final summary from the collected data."""
     try:
-        client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-        data_string = json.dumps(raw_data, indent=2)
+        # Large results are cut down to aggregates and a sample so the prompt stays within budget.
+        with observability.timed("data_reduction"):
+            data_string = await asyncio.to_thread(reduction.reduce_for_prompt, raw_data)
 
         prompt = f"""
         You are a diagnostics expert investigating "{product_name}".
-        You have gathered the following data:
+        You have gathered the following data, as JSON keyed by question.
+        Large results are condensed: "rows" is the total row count, "columns" holds
+        counts, time buckets and the most common texts (with how often each occurs),
+        and "sample" is a handful of representative rows.
         ---
         {data_string}
         ---
@@ -131,18 +432,38 @@ def _create_summary_from_data(product_name: str, raw_data: dict) -> str:
         If there are support tickets, mention the common themes. If no data, state that.
         """
         
-        chat_completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.1-8b-instant",
-            temperature=0.1,
-        )
-        
-        if not chat_completion.choices:
-            print("--- [DIAGNOSTICS] HELPER ERROR: Groq API returned an empty 'choices' list for summary.")
+        with observability.timed("summary_generation"):
+            completion = await llm.chat(prompt, temperature=0.1)
+        if not completion.content.strip():
             return "Could not generate summary because the AI returned an empty response."
 
-        return chat_completion.choices[0].message.content.strip()
+        return completion.content.strip()
     except Exception as e:
-        print(f"--- [DIAGNOSTICS] HELPER ERROR in _create_summary_from_data: {e}")
-        traceback.print_exc()
+        logger.exception("Could not create summary: %s", e)
         return "Could not generate a summary due to an error."
+
+async def _update_summary_with_new_data(product_name: str, previous_summary: str, new_tickets: list) -> str:
+    """Uses the LLM to fold newly created tickets into an existing summary."""
+    try:
+        tickets_string = reduction.compact(new_tickets)
+
+        prompt = f"""
+        You are a diagnostics expert investigating "{product_name}".
+        This was your previous summary of the situation:
+        ---
+        {previous_summary}
+        ---
+        Since then, these new support tickets were created:
+        ---
+        {tickets_string}
+        ---
+        Based ONLY on the previous summary and the new tickets, write an updated, brief, one-paragraph summary.
+        """
+
+        with observability.timed("summary_generation"):
+            completion = await llm.chat(prompt, temperature=0.1)
+
+        return completion.content.strip() or previous_summary
+    except Exception as e:
+        logger.exception("Could not update summary: %s", e)
+        return previous_summary
@@ -1,15 +1,91 @@
 -- This script will be run the first time the diagnostics database is created.
+-- It is also safe to run again on an existing database: every statement is
+-- idempotent, and the migration below upgrades the original schema in place.
+
+-- Raw diagnosis data, stored once per distinct payload and addressed by the
+-- sha256 of its canonical JSON, so repeated identical results share one row.
+CREATE TABLE IF NOT EXISTS diagnosis_payloads (
+    payload_hash CHAR(64) PRIMARY KEY,
+    raw_data JSONB NOT NULL, -- Using JSONB is efficient for storing and querying JSON data
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
 
 -- Create a table to store the results of our diagnostic reports
-CREATE TABLE diagnosis_reports (
+CREATE TABLE IF NOT EXISTS diagnosis_reports (
     report_id SERIAL PRIMARY KEY,
     product_id INTEGER NOT NULL,
     product_name VARCHAR(255) NOT NULL,
     summary TEXT,
-    raw_data JSONB, -- Using JSONB is efficient for storing and querying JSON data
+    payload_hash CHAR(64) REFERENCES diagnosis_payloads(payload_hash),
+    watermark JSONB, -- Support-ticket watermark the report was built from
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Migration for databases created with the original schema, where each
+-- report kept its own raw_data. raw_data stays as a nullable legacy column;
+-- new reports leave it empty and are read through payload_hash.
+ALTER TABLE diagnosis_reports ADD COLUMN IF NOT EXISTS payload_hash CHAR(64) REFERENCES diagnosis_payloads(payload_hash);
+ALTER TABLE diagnosis_reports ADD COLUMN IF NOT EXISTS watermark JSONB;
+
+-- Moves legacy raw_data into diagnosis_payloads. The hash is taken over
+-- jsonb's own text form, which differs from the service's canonical JSON, so
+-- backfilled payloads are addressable but not shared with new reports.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'diagnosis_reports' AND column_name = 'raw_data'
+    ) THEN
+        INSERT INTO diagnosis_payloads (payload_hash, raw_data)
+        SELECT DISTINCT ON (digest) digest, raw_data
+        FROM (
+            SELECT encode(sha256(convert_to(raw_data::text, 'UTF8')), 'hex') AS digest, raw_data
+            FROM diagnosis_reports
+            WHERE payload_hash IS NULL AND raw_data IS NOT NULL
+        ) legacy
+        ON CONFLICT (payload_hash) DO NOTHING;
+
+        UPDATE diagnosis_reports
+        SET payload_hash = encode(sha256(convert_to(raw_data::text, 'UTF8')), 'hex')
+        WHERE payload_hash IS NULL AND raw_data IS NOT NULL;
+    END IF;
+END $$;
+
+-- Serves the "latest report for this product" freshness check and the
+-- per-product history pages; report_id breaks ties for keyset pagination.
+CREATE INDEX IF NOT EXISTS idx_diagnosis_reports_product_created ON diagnosis_reports (product_id, created_at DESC, report_id DESC);
+
+-- Serves report history and search across all products, newest first.
+CREATE INDEX IF NOT EXISTS idx_diagnosis_reports_created ON diagnosis_reports (created_at DESC, report_id DESC);
+
+-- Full-text search over summaries (GET /reports?q=).
+CREATE INDEX IF NOT EXISTS idx_diagnosis_reports_summary_fts ON diagnosis_reports
+    USING GIN (to_tsvector('english', coalesce(summary, '')));
+
+-- Finds the reports that share a payload.
+CREATE INDEX IF NOT EXISTS idx_diagnosis_reports_payload ON diagnosis_reports (payload_hash);
+
+-- JSON containment (GET /reports?contains=) and full-text search over raw data.
+CREATE INDEX IF NOT EXISTS idx_diagnosis_payloads_raw_data ON diagnosis_payloads USING GIN (raw_data jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_diagnosis_payloads_raw_data_fts ON diagnosis_payloads
+    USING GIN (to_tsvector('english', raw_data));
+
+-- Asynchronous diagnosis jobs. Job state is kept here so queued and running
+-- jobs are picked up again after a restart.
+CREATE TABLE IF NOT EXISTS diagnosis_jobs (
+    job_id UUID PRIMARY KEY,
+    product_id INTEGER NOT NULL,
+    product_name VARCHAR(255) NOT NULL,
+    status VARCHAR(20) NOT NULL CHECK (status IN ('queued', 'running', 'succeeded', 'failed')),
+    report_id INTEGER REFERENCES diagnosis_reports(report_id),
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_diagnosis_jobs_unfinished ON diagnosis_jobs (created_at)
+    WHERE status IN ('queued', 'running');
+
 -- You could add some sample initial data here if needed, for example:
--- INSERT INTO diagnosis_reports (product_id, product_name, summary, raw_data) VALUES 
--- (101, 'Quantum Laptop', 'Initial system check.', '{}');
+-- INSERT INTO diagnosis_reports (product_id, product_name, summary) VALUES 
+-- (101, 'Quantum Laptop', 'Initial system check.');
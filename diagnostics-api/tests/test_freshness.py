@@ -0,0 +1,53 @@
+import asyncio
+
+from app import database
+from app import tools
+
+WATERMARK = {"ticket_count": 3, "max_created_at": "2026-01-01T00:00:00", "status_digest": "abc"}
+
+
+def _patch(monkeypatch, answers: list):
+    """Serves each diagnosis from `answers` and keeps the saved reports in memory."""
+    saved = []
+    runs = []
+
+    async def fetch_ticket_watermark(product_id, since):
+        return dict(WATERMARK)
+
+    async def diagnose_product_issues(product_id, product_name):
+        runs.append(product_id)
+        return {"product_id": product_id, "product_name": product_name,
+                "summary": "summary", "raw_data": answers[len(runs) - 1]}
+
+    def get_latest_report(product_id):
+        return saved[-1] if saved else None
+
+    monkeypatch.setattr(tools, "_fetch_ticket_watermark", fetch_ticket_watermark)
+    monkeypatch.setattr(tools, "diagnose_product_issues", diagnose_product_issues)
+    monkeypatch.setattr(database, "get_latest_report", get_latest_report)
+    return saved, runs
+
+
+def _diagnose(saved: list) -> dict:
+    report = asyncio.run(tools.diagnose_product(product_id=1, product_name="Product 1"))
+    if report["freshness"] != "reused":
+        saved.append(dict(report, report_id=len(saved) + 1, watermark=report.get("watermark")))
+    return report
+
+
+def test_report_with_failed_question_is_not_reused(monkeypatch):
+    failed = {"Open tickets?": {"error": "Timed out after 30.0s."}}
+    answered = {"Open tickets?": [{"ticket_id": 1}]}
+    saved, runs = _patch(monkeypatch, [failed, answered])
+
+    first = _diagnose(saved)
+    assert first["freshness"] == "full" and "watermark" not in first
+
+    second = _diagnose(saved)
+    assert second["freshness"] == "full"
+    assert second["raw_data"] == answered
+    assert runs == [1, 1]
+
+    third = _diagnose(saved)
+    assert third["freshness"] == "reused" and third["report_id"] == 2
+    assert runs == [1, 1]
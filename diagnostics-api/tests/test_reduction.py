@@ -0,0 +1,42 @@
+import json
+
+from app import reduction
+
+
+def _raw_data(questions: int, rows: int) -> dict:
+    return {
+        f"Question {i}: which support tickets mention the reported problem?": [
+            {"ticket_id": j, "subject": f"Screen flickering after update {j} " * 5, "status": "open"}
+            for j in range(rows)
+        ]
+        for i in range(questions)
+    }
+
+
+def test_small_data_is_passed_through():
+    raw_data = {"q": [{"status": "open"}]}
+    assert json.loads(reduction.reduce_for_prompt(raw_data, 1000)) == raw_data
+
+
+def test_large_data_is_reduced_within_budget():
+    text = reduction.reduce_for_prompt(_raw_data(3, 500), 1000)
+    reduced = json.loads(text)
+    assert reduction.estimate_tokens(text) <= 1000
+    assert all(entry["rows"] == 500 for entry in reduced.values())
+
+
+def test_last_resort_drops_whole_questions_and_stays_valid_json():
+    raw_data = _raw_data(40, 50)
+    text = reduction.reduce_for_prompt(raw_data, 200)
+    reduced = json.loads(text)
+    assert reduction.estimate_tokens(text) <= 200
+    omitted = reduced.pop(reduction.OMITTED_KEY)
+    assert omitted + len(reduced) == 40
+    assert all(entry == {"rows": 50} for entry in reduced.values())
+
+
+def test_last_resort_clips_errors():
+    raw_data = _raw_data(30, 50)
+    raw_data = {"failed": {"error": "connection refused " * 500}, **raw_data}
+    reduced = json.loads(reduction.reduce_for_prompt(raw_data, 300))
+    assert len(reduced["failed"]["error"]) <= reduction.REDUCTION_MAX_TEXT_CHARS
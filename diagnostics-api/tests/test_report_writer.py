@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+from app import database
+from app import report_writer
+from app import tools
+from app.jobs import JobManager
+from app.report_writer import ReportWriter
+
+
+def _fake_save(calls: list, delay: float = 0.0):
+    """Stands in for database.save_diagnosis_results; records each batch it is given."""
+    lock = threading.Lock()
+    next_id = [1]
+
+    def save(reports):
+        time.sleep(delay)
+        with lock:
+            calls.append(len(reports))
+            first = next_id[0]
+            next_id[0] += len(reports)
+        return list(range(first, first + len(reports)))
+
+    return save
+
+
+def _report(i: int) -> dict:
+    return {"product_id": i, "product_name": f"Product {i}", "summary": "ok", "raw_data": {"q": [i]}}
+
+
+def test_lone_report_is_flushed_after_the_interval(monkeypatch):
+    calls = []
+    monkeypatch.setattr(database, "save_diagnosis_results", _fake_save(calls))
+
+    async def scenario():
+        writer = ReportWriter(batch_size=50, flush_interval=0.1)
+        await writer.start()
+        started = time.perf_counter()
+        future = await writer.enqueue(**_report(1))
+        queued = time.perf_counter() - started
+        report_id = await future
+        written = time.perf_counter() - started
+        await writer.stop()
+        return report_id, queued, written
+
+    report_id, queued, written = asyncio.run(scenario())
+    assert report_id == 1
+    assert calls == [1]
+    # Queuing returns at once; the write itself waits for the interval.
+    assert queued < 0.05
+    assert written >= 0.1
+
+
+def test_full_batch_is_flushed_before_the_interval(monkeypatch):
+    calls = []
+    monkeypatch.setattr(database, "save_diagnosis_results", _fake_save(calls))
+
+    async def scenario():
+        writer = ReportWriter(batch_size=5, flush_interval=10)
+        await writer.start()
+        futures = [await writer.enqueue(**_report(i)) for i in range(5)]
+        report_ids = await asyncio.wait_for(asyncio.gather(*futures), timeout=1)
+        await writer.stop()
+        return report_ids
+
+    assert asyncio.run(scenario()) == [1, 2, 3, 4, 5]
+    assert calls == [5]
+
+
+def test_job_succeeds_before_its_report_is_written(monkeypatch):
+    calls = []
+    updates = []
+    monkeypatch.setattr(database, "save_diagnosis_results", _fake_save(calls))
+    monkeypatch.setattr(database, "get_unfinished_jobs", lambda: [])
+    monkeypatch.setattr(database, "create_job", lambda *args: None)
+    monkeypatch.setattr(database, "update_job", lambda *args: updates.append(args))
+
+    async def diagnose_product(product_id, product_name):
+        return {**_report(product_id), "freshness": "fresh"}
+
+    monkeypatch.setattr(tools, "diagnose_product", diagnose_product)
+
+    async def scenario():
+        writer = ReportWriter(batch_size=50, flush_interval=0.2)
+        monkeypatch.setattr(report_writer, "report_writer", writer)
+        manager = JobManager(workers=1)
+        await writer.start()
+        await manager.start()
+        job, _ = await manager.submit(7, "Product 7")
+        job = await asyncio.wait_for(manager.wait(job["job_id"]), timeout=0.1)
+        finished = dict(job, report=dict(job["report"]))
+        await manager.stop()
+        await writer.stop()
+        await manager.settle()
+        return finished, await manager.get(job["job_id"])
+
+    finished, job = asyncio.run(scenario())
+    assert finished["status"] == "succeeded"
+    assert finished["report_id"] is None and finished["report"]["report_id"] is None
+    assert job["report_id"] == 1 and job["report"]["report_id"] == 1
+    assert updates[-1] == (job["job_id"], "succeeded", 1, None)
+
+
+def test_reports_queued_during_a_write_share_the_next_batch(monkeypatch):
+    calls = []
+    monkeypatch.setattr(database, "save_diagnosis_results", _fake_save(calls, delay=0.05))
+
+    async def scenario():
+        writer = ReportWriter(batch_size=10)
+        await writer.start()
+        futures = [await writer.enqueue(**_report(i)) for i in range(25)]
+        report_ids = await asyncio.gather(*futures)
+        await writer.stop()
+        return report_ids, writer.stats()
+
+    report_ids, stats = asyncio.run(scenario())
+    assert report_ids == list(range(1, 26))
+    assert sum(calls) == 25
+    assert max(calls) == 10
+    assert stats["reports"] == 25 and stats["failures"] == 0
+
+
+def test_stop_writes_everything_still_queued(monkeypatch):
+    calls = []
+    monkeypatch.setattr(database, "save_diagnosis_results", _fake_save(calls, delay=0.02))
+
+    async def scenario():
+        writer = ReportWriter(batch_size=4)
+        await writer.start()
+        futures = [await writer.enqueue(**_report(i)) for i in range(9)]
+        await writer.stop()
+        return [future.result() for future in futures]
+
+    assert asyncio.run(scenario()) == list(range(1, 10))
+    assert sum(calls) == 9
@@ -0,0 +1,62 @@
+"""
+Keeps the modules both services share identical.
+
+Each service is built from its own directory (see docker-compose.yml), so
+code used by both is vendored: text-to-sql-api/app holds the source copy
+and diagnostics-api/app a byte-identical copy. Edit the source, then run
+
+    python scripts/sync_shared_modules.py          # report copies that differ (exit 1)
+    python scripts/sync_shared_modules.py --write  # overwrite them from the source
+"""
+import argparse
+import difflib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIR = os.path.join("text-to-sql-api", "app")
+COPY_DIRS = [os.path.join("diagnostics-api", "app")]
+SHARED_MODULES = ["llm.py", "observability.py"]
+
+
+def _read(path: str) -> bytes:
+    with open(os.path.join(ROOT, path), "rb") as f:
+        return f.read()
+
+
+def out_of_sync() -> list:
+    """Returns (source, copy) paths for every copy that differs from its source."""
+    stale = []
+    for module in SHARED_MODULES:
+        source = os.path.join(SOURCE_DIR, module)
+        for copy_dir in COPY_DIRS:
+            copy = os.path.join(copy_dir, module)
+            if not os.path.exists(os.path.join(ROOT, copy)) or _read(copy) != _read(source):
+                stale.append((source, copy))
+    return stale
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--write", action="store_true", help="Overwrite stale copies from the source.")
+    args = parser.parse_args(argv)
+
+    stale = out_of_sync()
+    for source, copy in stale:
+        if args.write:
+            with open(os.path.join(ROOT, copy), "wb") as f:
+                f.write(_read(source))
+            print(f"Updated {copy} from {source}")
+            continue
+        copy_lines = _read(copy).decode("utf-8").splitlines() if os.path.exists(os.path.join(ROOT, copy)) else []
+        sys.stdout.writelines(line + "\n" for line in difflib.unified_diff(
+            copy_lines, _read(source).decode("utf-8").splitlines(), copy, source, lineterm="",
+        ))
+    if stale and not args.write:
+        print(f"{len(stale)} shared module(s) out of sync; run with --write to update the copies.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,124 +1,763 @@
 import psycopg2
+import psycopg2.errors
+import psycopg2.pool
 from psycopg2.extras import RealDictCursor
+import asyncio
+import logging
 import os
+import random
+import threading
 import time
+from contextlib import contextmanager
 
-# --- Database Connection ---
+from . import query_log
+from . import sql_guard
 
-# This function establishes a connection to the PostgreSQL database.
-# It includes a retry mechanism to handle initial connection delays.
-def get_db_connection():
-    """Establishes and returns a connection to the PostgreSQL database."""
-    retries = 5
-    while retries > 0:
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+
+# Pool sizing and connect-retry behaviour can be tuned per deployment.
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.environ.get("DB_POOL_CHECKOUT_TIMEOUT", "10"))
+DB_CONNECT_RETRIES = int(os.environ.get("DB_CONNECT_RETRIES", "5"))
+DB_CONNECT_BACKOFF = float(os.environ.get("DB_CONNECT_BACKOFF", "0.5"))
+DB_CONNECT_BACKOFF_MAX = float(os.environ.get("DB_CONNECT_BACKOFF_MAX", "8"))
+# Seconds libpq waits for a server to answer a connect; without it an unreachable host blocks until the TCP timeout.
+DB_CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", "5"))
+
+# Optional read replicas for generated queries, as "host[:port],host[:port]".
+# They share DB_NAME, DB_USER and DB_PASSWORD with the primary.
+DB_READ_HOSTS = [host.strip() for host in os.environ.get("DB_READ_HOSTS", "").split(",") if host.strip()]
+# "round_robin" or "least_connections".
+DB_READ_ROUTING = os.environ.get("DB_READ_ROUTING", "round_robin").lower()
+DB_READ_POOL_MAX_SIZE = int(os.environ.get("DB_READ_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE)))
+# How long a replica that failed is skipped before it is tried again.
+DB_READ_COOLDOWN = float(os.environ.get("DB_READ_COOLDOWN", "30"))
+
+
+# Names of the common built-in Postgres types, by type OID. Others are looked
+# up in pg_type on first use (see _type_names).
+PG_TYPE_NAMES = {
+    16: "bool",
+    17: "bytea",
+    18: "char",
+    19: "name",
+    20: "int8",
+    21: "int2",
+    23: "int4",
+    25: "text",
+    26: "oid",
+    114: "json",
+    700: "float4",
+    701: "float8",
+    1042: "bpchar",
+    1043: "varchar",
+    1082: "date",
+    1083: "time",
+    1114: "timestamp",
+    1184: "timestamptz",
+    1186: "interval",
+    1266: "timetz",
+    1700: "numeric",
+    2950: "uuid",
+    3802: "jsonb",
+}
+
+
+def _connection_params(host: str = None, port: str = None):
+    """Reads the connection settings provided in docker-compose.yml."""
+    return {
+        "dbname": os.environ.get("DB_NAME"),
+        "user": os.environ.get("DB_USER"),
+        "password": os.environ.get("DB_PASSWORD"),
+        "host": host or os.environ.get("DB_HOST"),  # This will be 'text_to_sql_db' from docker-compose
+        "port": port or os.environ.get("DB_PORT"),  # This will be '5432' from docker-compose
+        "connect_timeout": DB_CONNECT_TIMEOUT,
+    }
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for connect retries."""
+    return random.uniform(0, min(DB_CONNECT_BACKOFF_MAX, DB_CONNECT_BACKOFF * (2 ** attempt)))
+
+
+# --- Connection Pool ---
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of PostgreSQL connections.
+
+    psycopg2's ThreadedConnectionPool raises as soon as it is exhausted, so
+    checkouts are gated by a semaphore and wait for a free slot instead.
+    Connections are health-checked on checkout and replaced if they are broken.
+    """
+
+    def __init__(self, min_size: int, max_size: int, **conn_params):
+        self.min_size = min_size
+        self.max_size = max_size
+        self._conn_params = conn_params
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._pool = psycopg2.pool.ThreadedConnectionPool(min_size, max_size, **conn_params)
+        self._in_use_lock = threading.Lock()
+        self.in_use = 0
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        try:
+            # Roll back anything a previous borrower left open, then ping.
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout: float = DB_POOL_CHECKOUT_TIMEOUT):
+        if not self._slots.acquire(timeout=timeout):
+            raise psycopg2.pool.PoolError(f"Timed out after {timeout}s waiting for a database connection")
+        try:
+            # Every idle connection may be broken (e.g. after a server restart);
+            # once they are all discarded, getconn() opens fresh ones.
+            for _ in range(self.max_size + 1):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    break
+                logger.warning("Discarding broken pooled connection.")
+                self._pool.putconn(conn, close=True)
+            else:
+                raise psycopg2.pool.PoolError("Could not get a working database connection")
+        except Exception:
+            self._slots.release()
+            raise
+        with self._in_use_lock:
+            self.in_use += 1
+        return conn
+
+    def putconn(self, conn, close: bool = False):
+        try:
+            if not close and not conn.closed:
+                # Never hand a connection with an open transaction to the next borrower.
+                conn.rollback()
+            self._pool.putconn(conn, close=close or bool(conn.closed))
+        except psycopg2.Error:
+            self._pool.putconn(conn, close=True)
+        finally:
+            with self._in_use_lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _create_pool() -> ConnectionPool:
+    """Creates the pool, retrying with backoff while the database starts up."""
+    for attempt in range(DB_CONNECT_RETRIES):
         try:
-            # --- FIX APPLIED HERE ---
-            # The environment variable names now match the ones provided in docker-compose.yml
-            # (e.g., DB_NAME instead of POSTGRES_DB)
-            conn = psycopg2.connect(
-                dbname=os.environ.get("DB_NAME"),
-                user=os.environ.get("DB_USER"),
-                password=os.environ.get("DB_PASSWORD"),
-                host=os.environ.get("DB_HOST"), # This will be 'text_to_sql_db' from docker-compose
-                port=os.environ.get("DB_PORT")  # This will be '5432' from docker-compose
+            pool = ConnectionPool(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, **_connection_params())
+            logger.info("Connection pool ready (min=%d, max=%d)", DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)
+            return pool
+        except psycopg2.OperationalError as e:
+            remaining = DB_CONNECT_RETRIES - attempt - 1
+            logger.error("Could not connect to database (%d attempts left): %s", remaining, e)
+            if remaining:
+                time.sleep(_backoff_delay(attempt))
+    raise psycopg2.OperationalError(f"Could not connect to database after {DB_CONNECT_RETRIES} attempts")
+
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _create_pool()
+    return _pool
+
+
+async def open_pool():
+    """
+    Opens the pool at application startup without blocking the event loop.
+    Connect attempts run in a worker thread and the backoff uses asyncio.sleep.
+    """
+    global _pool
+    for attempt in range(DB_CONNECT_RETRIES):
+        try:
+            pool = await asyncio.to_thread(
+                ConnectionPool, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, **_connection_params()
             )
-            print("--- [DATABASE] SUCCESS: Connected to PostgreSQL. ---")
-            return conn
+            with _pool_lock:
+                if _pool is None:
+                    _pool = pool
+                else:
+                    pool.closeall()
+            logger.info("Connection pool ready (min=%d, max=%d)", DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)
+            return
         except psycopg2.OperationalError as e:
-            print(f"--- [DATABASE] ERROR: Could not connect to database. Retrying... ({retries} attempts left) ---")
-            print(f"--- [DATABASE] Details: {e} ---")
-            retries -= 1
-            time.sleep(5) # Wait for 5 seconds before retrying
-    return None
+            remaining = DB_CONNECT_RETRIES - attempt - 1
+            logger.error("Could not connect to database (%d attempts left): %s", remaining, e)
+            if remaining:
+                await asyncio.sleep(_backoff_delay(attempt))
+    # Leave the pool unset; it will be created lazily on the first request.
+    logger.warning("Starting without a connection pool; will retry on first request.")
+
+
+def close_pool():
+    """Closes every pooled connection. Called on application shutdown."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+    read_router.close()
+
+
+@contextmanager
+def get_db_connection():
+    """
+    Checks a healthy connection out of the pool and returns it when done.
+    Connections that hit a connection-level error are discarded, not reused.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    discard = False
+    try:
+        yield conn
+    except psycopg2.errors.QueryCanceled:
+        # A statement timeout is an OperationalError too, but the connection is fine.
+        raise
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        pool.putconn(conn, close=discard)
+
+
+# --- Read Replicas ---
+
+class Replica:
+    """One read endpoint: its lazily created pool and its health."""
+
+    def __init__(self, address: str):
+        host, _, port = address.partition(":")
+        self.address = address
+        self.conn_params = _connection_params(host, port or None)
+        self.pool = None
+        self.down_until = 0.0
+        self.failures = 0
+        self.served = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.down_until <= time.monotonic()
+
+    @property
+    def in_use(self) -> int:
+        return self.pool.in_use if self.pool else 0
+
+    def mark_down(self, error):
+        self.failures += 1
+        self.down_until = time.monotonic() + DB_READ_COOLDOWN
+        logger.warning("Read replica %s is unavailable, skipping it for %ss: %s", self.address, DB_READ_COOLDOWN, error)
+
+    def status(self) -> dict:
+        return {
+            "address": self.address,
+            "healthy": self.healthy,
+            "in_use": self.in_use,
+            "served": self.served,
+            "failures": self.failures,
+        }
+
+
+class ReadRouter:
+    """
+    Spreads read-only generated queries over DB_READ_HOSTS.
+
+    Replicas are picked round-robin or by fewest connections in use. A
+    replica that cannot be reached is skipped for DB_READ_COOLDOWN seconds,
+    then tried again. When no replica is available the primary pool serves
+    the query, so reads never fail just because replicas are down.
+    """
+
+    def __init__(self, addresses: list, routing: str = DB_READ_ROUTING):
+        self.replicas = [Replica(address) for address in addresses]
+        self.routing = routing
+        self._lock = threading.Lock()
+        self._next = 0
+        self.primary_fallbacks = 0
+
+    def _candidates(self) -> list:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if self.routing == "least_connections":
+            return sorted(healthy, key=lambda replica: replica.in_use)
+        with self._lock:
+            start = self._next
+            self._next += 1
+        if not healthy:
+            return []
+        start %= len(healthy)
+        return healthy[start:] + healthy[:start]
+
+    def _checkout(self, replica: Replica):
+        pool = replica.pool
+        if pool is None:
+            # Connecting can take up to DB_CONNECT_TIMEOUT, so it happens outside
+            # the lock every read goes through; the first pool built wins.
+            built = ConnectionPool(DB_POOL_MIN_SIZE, DB_READ_POOL_MAX_SIZE, **replica.conn_params)
+            with self._lock:
+                if replica.pool is None:
+                    replica.pool = built
+                pool = replica.pool
+            if pool is not built:
+                built.closeall()
+        return pool, pool.getconn()
+
+    @contextmanager
+    def connection(self):
+        for replica in self._candidates():
+            try:
+                pool, conn = self._checkout(replica)
+            except psycopg2.pool.PoolError:
+                # Busy rather than broken; let another endpoint take it.
+                continue
+            except psycopg2.OperationalError as e:
+                replica.mark_down(e)
+                continue
+            replica.served += 1
+            discard = False
+            try:
+                yield conn
+            except psycopg2.errors.QueryCanceled:
+                # The statement timeout fired; the replica itself is fine.
+                raise
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                discard = True
+                replica.mark_down(e)
+                raise
+            finally:
+                pool.putconn(conn, close=discard)
+            return
+
+        if self.replicas:
+            self.primary_fallbacks += 1
+        with get_db_connection() as conn:
+            yield conn
+
+    def status(self) -> dict:
+        return {
+            "routing": self.routing,
+            "replicas": [replica.status() for replica in self.replicas],
+            "primary_fallbacks": self.primary_fallbacks,
+        }
+
+    def close(self):
+        for replica in self.replicas:
+            if replica.pool is not None:
+                replica.pool.closeall()
+                replica.pool = None
+
+
+read_router = ReadRouter(DB_READ_HOSTS)
+
+
+def pool_status() -> dict:
+    """Connections in use on the primary and on each read replica."""
+    primary = {"in_use": _pool.in_use, "max_size": _pool.max_size} if _pool is not None else None
+    return {"primary": primary, "read": read_router.status()}
+
+
+def get_read_connection():
+    """
+    Checks out a connection for read-only generated SQL: from a replica when
+    DB_READ_HOSTS is set, otherwise (or when none is reachable) from the primary.
+    Schema introspection, the SQL cache and the index advisor stay on the primary.
+    """
+    return read_router.connection()
 
 # --- Query Execution ---
 
-# This is the function where the original error was happening.
-def execute_query(sql_query: str):
+# Hard cap on rows returned by a single query, and the fetch size used when streaming.
+ASK_MAX_ROWS = int(os.environ.get("ASK_MAX_ROWS", "10000"))
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "500"))
+# Number of key values bound to one EXECUTE of a grouped template.
+TEMPLATE_KEY_CHUNK_SIZE = int(os.environ.get("TEMPLATE_KEY_CHUNK_SIZE", "1000"))
+
+
+_type_name_lock = threading.Lock()
+
+
+def _type_names(cur, type_codes) -> dict:
+    """Maps type OIDs to names, reading unknown ones from pg_type and remembering them."""
+    missing = {code for code in type_codes if code not in PG_TYPE_NAMES}
+    if missing:
+        cur.execute("SELECT oid, typname FROM pg_catalog.pg_type WHERE oid = ANY(%s)", (list(missing),))
+        with _type_name_lock:
+            for row in cur.fetchall():
+                oid, typname = (row["oid"], row["typname"]) if isinstance(row, dict) else row
+                PG_TYPE_NAMES[oid] = typname
+    return {code: PG_TYPE_NAMES.get(code, str(code)) for code in type_codes}
+
+
+def _columns(cur, description) -> list:
+    """The columnar "columns" header: one {"name", "type"} per result column."""
+    names = _type_names(cur, {column.type_code for column in description})
+    return [{"name": column.name, "type": names[column.type_code]} for column in description]
+
+
+def execute_query(sql_query: str, max_rows: int = ASK_MAX_ROWS, columnar: bool = False):
     """
-    Executes a SQL query against the database and returns the results.
-    Handles potential errors and ensures a list is always returned.
+    Executes a SQL query against the database and returns (results, truncated).
+    At most max_rows rows are fetched; truncated is True if more were available.
+    The query runs read-only under the cost guard and statement timeout, and
+    sql_guard.QueryRejectedError is raised if the guard stops it.
+
+    results is a list of dicts, or with columnar a dict of "columns"
+    ([{"name", "type"}], sent once) and "rows" (one list of values per row).
     """
-    conn = None
     try:
-        conn = get_db_connection()
-        if not conn:
-            print("--- [DATABASE] FATAL: Failed to establish database connection. ---")
-            return None # Return None if connection fails completely
+        with get_read_connection() as conn:
+            # Use RealDictCursor to get results as a list of dictionaries
+            with conn.cursor(cursor_factory=None if columnar else RealDictCursor) as cur:
+                sql_guard.begin(cur)
+                guarded_sql = sql_guard.check(cur, sql_query, max_rows)
+                with query_log.timed(sql_query) as timing:
+                    cur.execute(guarded_sql)
+                    # The guard only lets SELECT and WITH through, so there are always rows to fetch.
+                    # Fetch one extra row to learn whether the cap cut the result short.
+                    results = cur.fetchmany(max_rows + 1)
+                    timing.rows = len(results)
+                    truncated = len(results) > max_rows
+                    results = results[:max_rows]
 
-        # Use RealDictCursor to get results as a list of dictionaries
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(sql_query)
-            
-            # THE FIX IS HERE:
-            # We check if the query will return results before trying to fetch them.
-            # SELECT, WITH, and some other statements have a `description`.
-            if cur.description:
-                results = cur.fetchall()
-                # fetchall() returns an empty list [] if no rows are found, which is perfect.
-                return results
-            else:
-                # This handles non-returning statements like INSERT, UPDATE, DELETE
-                conn.commit()
-                return [{"status": "success", "rows_affected": cur.rowcount}]
+                if not columnar:
+                    return results, truncated
+                return {"columns": _columns(cur, cur.description), "rows": results}, truncated
 
+    except psycopg2.errors.QueryCanceled as e:
+        raise sql_guard.QueryRejectedError.timed_out() from e
     except psycopg2.Error as e:
-        print(f"--- [DATABASE] SQL Execution Error: {e} ---")
-        # In case of an error, it's safer to return None or re-raise
-        # the exception to be handled by the main API endpoint.
+        logger.warning("SQL execution error: %s", e)
         # We re-raise it to provide detailed error info to the user.
         raise e
 
-    finally:
-        if conn:
-            conn.close()
 
-# --- Schema Introspection ---
+async def execute_query_async(sql_query: str, max_rows: int = ASK_MAX_ROWS, columnar: bool = False):
+    """Runs execute_query in a worker thread so the event loop stays free."""
+    return await asyncio.to_thread(execute_query, sql_query, max_rows, columnar)
+
 
-def get_dynamic_schema():
+def execute_queries(sql_queries: list, max_rows: int = ASK_MAX_ROWS, columnar: bool = False) -> list:
     """
-    Dynamically introspects the database to get table and column information.
+    Executes several statements over one pooled connection.
+    Returns one (results, truncated, error) tuple per statement, or None for
+    entries that were None. A failing statement is rolled back and reported
+    without affecting the others; error is the database message, or a
+    sql_guard.QueryRejectedError if the guard stopped the statement.
+    results has the same shape as in execute_query, columnar or not.
+    """
+    outcomes = []
+    with get_read_connection() as conn:
+        for sql_query in sql_queries:
+            if sql_query is None:
+                outcomes.append(None)
+                continue
+            try:
+                with conn.cursor(cursor_factory=None if columnar else RealDictCursor) as cur:
+                    sql_guard.begin(cur)
+                    guarded_sql = sql_guard.check(cur, sql_query, max_rows)
+                    with query_log.timed(sql_query) as timing:
+                        cur.execute(guarded_sql)
+                        results = cur.fetchmany(max_rows + 1)
+                        timing.rows = len(results)
+                        truncated = len(results) > max_rows
+                        results = results[:max_rows]
+                        if columnar:
+                            results = {"columns": _columns(cur, cur.description), "rows": results}
+                        outcomes.append((results, truncated, None))
+                        conn.rollback()
+            except sql_guard.QueryRejectedError as e:
+                conn.rollback()
+                outcomes.append(([], False, e))
+            except psycopg2.errors.QueryCanceled:
+                conn.rollback()
+                outcomes.append(([], False, sql_guard.QueryRejectedError.timed_out()))
+            except psycopg2.Error as e:
+                logger.warning("SQL execution error: %s", e)
+                if conn.closed:
+                    raise
+                conn.rollback()
+                outcomes.append(([], False, e.pgerror or str(e)))
+    return outcomes
+
+
+async def execute_queries_async(sql_queries: list, max_rows: int = ASK_MAX_ROWS, columnar: bool = False) -> list:
+    """Runs execute_queries in a worker thread so the event loop stays free."""
+    return await asyncio.to_thread(execute_queries, sql_queries, max_rows, columnar)
+
+
+def execute_grouped_template(sql_template: str, group_by: str, keys: list, max_rows_per_group: int,
+                             chunk_size: int = TEMPLATE_KEY_CHUNK_SIZE, columnar: bool = False):
     """
-    query = """
-    SELECT
-        c.table_name,
-        c.column_name,
-        c.data_type
-    FROM
-        information_schema.columns c
-    WHERE
-        c.table_schema = 'public'
-    ORDER BY
-        c.table_name,
-        c.ordinal_position;
+    Prepares a set-based template that filters on `group_by = ANY($1)` and
+    executes it for every key, TEMPLATE_KEY_CHUNK_SIZE keys per EXECUTE.
+    Returns ({key: rows}, truncated_keys, columns); each key keeps at most
+    max_rows_per_group rows. Every chunk is checked by the cost guard, which
+    rejects rather than rewrites, since a LIMIT would starve later keys.
+
+    Rows are dicts and columns is None, or with columnar, rows are lists and
+    columns is the shared [{"name", "type"}] header.
     """
-    conn = None
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return None
-        
+    if "$1" not in sql_template:
+        raise ValueError("SQL template does not use the $1 key parameter.")
+    sql_guard.ensure_single_select(sql_template)
+    groups = {}
+    truncated_keys = set()
+    columns = None
+    with get_read_connection() as conn:
+        try:
+            with conn.cursor(cursor_factory=None if columnar else RealDictCursor) as cur:
+                sql_guard.begin(cur)
+                # No parameters are passed here, so '%' in the template is left alone.
+                cur.execute(f"PREPARE grouped_template AS {sql_template}")
+                for start in range(0, len(keys), chunk_size):
+                    execute = cur.mogrify("EXECUTE grouped_template (%s)", (list(keys[start:start + chunk_size]),))
+                    guarded_sql = sql_guard.check(cur, execute.decode(), max_rows_per_group, rewrite=False,
+                                                  single_select=False)
+                    with query_log.timed(sql_template) as timing:
+                        cur.execute(guarded_sql)
+                        names = [col.name for col in cur.description or ()]
+                        if group_by not in names:
+                            raise ValueError(f"SQL template does not return the {group_by} column.")
+                        key_column = names.index(group_by) if columnar else group_by
+                        while True:
+                            batch = cur.fetchmany(STREAM_BATCH_SIZE)
+                            if not batch:
+                                break
+                            timing.rows += len(batch)
+                            for row in batch:
+                                key = row[key_column]
+                                rows = groups.setdefault(key, [])
+                                if len(rows) < max_rows_per_group:
+                                    rows.append(row)
+                                else:
+                                    truncated_keys.add(key)
+                    if columnar and columns is None:
+                        columns = _columns(cur, cur.description)
+        except psycopg2.errors.QueryCanceled as e:
+            raise sql_guard.QueryRejectedError.timed_out() from e
+        finally:
+            # Prepared statements outlive the transaction, so always drop it
+            # before the connection goes back to the pool.
+            if not conn.closed:
+                conn.rollback()
+                with conn.cursor() as cur:
+                    cur.execute("DEALLOCATE ALL")
+                conn.rollback()
+    return groups, sorted(truncated_keys, key=str), columns
+
+
+def guard_query(sql_query: str, max_rows: int = ASK_MAX_ROWS) -> str:
+    """
+    Runs the cost guard on its own and returns the SQL to execute. Used
+    before streaming, so a rejection can still become an HTTP error.
+    """
+    with get_read_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query)
-            columns_info = cur.fetchall()
+            sql_guard.begin(cur)
+            return sql_guard.check(cur, sql_query, max_rows)
 
-        if not columns_info:
-            return None
 
-        # Format the schema into a readable string for the LLM prompt
-        schema_str = ""
-        current_table = ""
-        for col in columns_info:
-            if col['table_name'] != current_table:
-                current_table = col['table_name']
-                schema_str += f"\nTable: {current_table}\n"
-            schema_str += f"  - {col['column_name']} ({col['data_type']})\n"
+async def guard_query_async(sql_query: str, max_rows: int = ASK_MAX_ROWS) -> str:
+    return await asyncio.to_thread(guard_query, sql_query, max_rows)
 
-        return schema_str.strip()
 
-    except psycopg2.Error as e:
-        print(f"--- [DATABASE] Schema Fetch Error: {e} ---")
-        return None
-    finally:
-        if conn:
-            conn.close()
+class RowStream:
+    """
+    Iterates over a query's rows in batches through a server-side (named)
+    cursor, so only one batch is held in memory at a time. Iteration stops
+    after max_rows rows; `truncated` tells whether more rows were available.
+    The cursor runs read-only under the statement timeout; pass SQL that
+    already went through guard_query.
+    """
+
+    def __init__(self, sql_query: str, batch_size: int = STREAM_BATCH_SIZE, max_rows: int = ASK_MAX_ROWS):
+        self.sql_query = sql_query
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.row_count = 0
+        self.truncated = False
+
+    def __iter__(self):
+        with get_read_connection() as conn:
+            with conn.cursor() as setup:
+                sql_guard.begin(setup)
+            with conn.cursor(name="ask_stream", cursor_factory=RealDictCursor) as cur, \
+                    query_log.timed(self.sql_query) as timing:
+                cur.itersize = self.batch_size
+                cur.execute(self.sql_query)
+                while self.row_count < self.max_rows:
+                    batch = cur.fetchmany(min(self.batch_size, self.max_rows - self.row_count))
+                    if not batch:
+                        return
+                    self.row_count += len(batch)
+                    timing.rows = self.row_count
+                    yield batch
+                # The cap was reached; peek one row to see if anything was cut off.
+                self.truncated = bool(cur.fetchmany(1))
+
+
+# --- Support Ticket Watermarks ---
+
+# A cheap summary of a product's ticket history. The status digest changes
+# whenever a ticket is added, removed or changes status; the "prior" columns
+# describe only the tickets created up to as_of, so callers can tell whether
+# older tickets changed or only new ones were added.
+_TICKET_WATERMARK_QUERY = """
+SELECT
+    count(*) AS ticket_count,
+    max(created_at) AS max_created_at,
+    md5(coalesce(string_agg(ticket_id::text || ':' || coalesce(status, ''), ',' ORDER BY ticket_id), '')) AS status_digest,
+    count(*) FILTER (WHERE created_at <= %(as_of)s::timestamp) AS prior_ticket_count,
+    md5(coalesce(string_agg(ticket_id::text || ':' || coalesce(status, ''), ',' ORDER BY ticket_id)
+        FILTER (WHERE created_at <= %(as_of)s::timestamp), '')) AS prior_status_digest
+FROM support_tickets
+WHERE product_id = %(product_id)s;
+"""
+
+
+def get_ticket_watermark(product_id: int, as_of: str = None) -> dict:
+    """Returns the ticket watermark of a product (see _TICKET_WATERMARK_QUERY)."""
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(_TICKET_WATERMARK_QUERY, {"product_id": product_id, "as_of": as_of})
+            watermark = cur.fetchone()
+    if as_of is None:
+        watermark.pop("prior_ticket_count")
+        watermark.pop("prior_status_digest")
+    return watermark
+
+
+def get_tickets_since(product_id: int, since: str, limit: int = ASK_MAX_ROWS) -> list:
+    """Returns a product's tickets created after `since`, oldest first."""
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT ticket_id, customer_id, product_id, subject, description, status, created_at
+                FROM support_tickets
+                WHERE product_id = %s AND created_at > %s::timestamp
+                ORDER BY created_at, ticket_id
+                LIMIT %s;
+                """,
+                (product_id, since, limit),
+            )
+            return cur.fetchall()
+
+# --- Schema Introspection ---
+
+_SCHEMA_QUERY = """
+SELECT
+    c.table_name,
+    c.column_name,
+    c.data_type
+FROM
+    information_schema.columns c
+WHERE
+    c.table_schema = 'public'
+ORDER BY
+    c.table_name,
+    c.ordinal_position;
+"""
+
+# Foreign keys between public tables, one row per column pair, so the schema
+# index can find join paths between the tables a question mentions.
+_FOREIGN_KEY_QUERY = """
+SELECT
+    src.relname AS table_name,
+    src_col.attname AS column_name,
+    dst.relname AS foreign_table_name,
+    dst_col.attname AS foreign_column_name
+FROM
+    pg_catalog.pg_constraint con
+    CROSS JOIN LATERAL unnest(con.conkey, con.confkey) AS k(src_attnum, dst_attnum)
+    JOIN pg_catalog.pg_class src ON src.oid = con.conrelid
+    JOIN pg_catalog.pg_class dst ON dst.oid = con.confrelid
+    JOIN pg_catalog.pg_namespace n ON n.oid = src.relnamespace
+    JOIN pg_catalog.pg_attribute src_col ON src_col.attrelid = con.conrelid AND src_col.attnum = k.src_attnum
+    JOIN pg_catalog.pg_attribute dst_col ON dst_col.attrelid = con.confrelid AND dst_col.attnum = k.dst_attnum
+WHERE
+    con.contype = 'f'
+    AND n.nspname = 'public'
+ORDER BY
+    src.relname,
+    con.conname,
+    src_col.attnum;
+"""
+
+# A cheap digest of every user column and foreign key in the public schema,
+# read straight from pg_catalog. It changes whenever a table or column is
+# added, dropped, renamed or retyped, or a foreign key changes, which is all
+# the prompt builder cares about.
+_SCHEMA_FINGERPRINT_QUERY = """
+SELECT md5(
+    (
+        SELECT coalesce(string_agg(
+            c.relname || '.' || a.attname || ':' || format_type(a.atttypid, a.atttypmod),
+            ',' ORDER BY c.relname, a.attnum
+        ), '')
+        FROM
+            pg_catalog.pg_attribute a
+            JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE
+            n.nspname = 'public'
+            AND c.relkind IN ('r', 'v', 'm', 'p', 'f')
+            AND a.attnum > 0
+            AND NOT a.attisdropped
+    ) || '|' || (
+        SELECT coalesce(string_agg(
+            con.conrelid::regclass::text || '->' || con.confrelid::regclass::text || ':' || pg_get_constraintdef(con.oid),
+            ',' ORDER BY con.conrelid::regclass::text, con.conname
+        ), '')
+        FROM
+            pg_catalog.pg_constraint con
+            JOIN pg_catalog.pg_namespace n ON n.oid = con.connamespace
+        WHERE
+            con.contype = 'f'
+            AND n.nspname = 'public'
+    )
+) AS md5;
+"""
+
+
+def get_schema_fingerprint():
+    """Returns the current catalog fingerprint of the public schema."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_SCHEMA_FINGERPRINT_QUERY)
+            return cur.fetchone()[0]
+
+
+def get_schema_snapshot():
+    """
+    Reads the catalog fingerprint, the column listing and the foreign keys
+    over one connection. Returns a (fingerprint, columns_info, foreign_keys) tuple.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(_SCHEMA_FINGERPRINT_QUERY)
+            fingerprint = cur.fetchone()["md5"]
+            cur.execute(_SCHEMA_QUERY)
+            columns_info = cur.fetchall()
+            cur.execute(_FOREIGN_KEY_QUERY)
+            foreign_keys = cur.fetchall()
+    return fingerprint, columns_info, foreign_keys
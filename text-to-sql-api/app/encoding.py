@@ -0,0 +1,61 @@
+import datetime
+import decimal
+import json
+import uuid
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the standard library encoder
+    orjson = None
+
+# Media type of the columnar /ask response; clients opt in with Accept or ?format=columnar.
+COLUMNAR_MEDIA_TYPE = "application/vnd.text-to-sql.columnar+json"
+
+
+def json_default(value):
+    """Encodes the Postgres types psycopg2 returns that json cannot handle natively."""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        # Postgres intervals, as a number of seconds.
+        return value.total_seconds()
+    if isinstance(value, memoryview):
+        # bytea, hex-encoded like Postgres' own output without the "\x" prefix.
+        return bytes(value).hex()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload) -> bytes:
+    """
+    Compact JSON as bytes. Uses orjson when it is installed; dates, times and
+    UUIDs come out the same either way, and Decimal is written as a number.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=json_default, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """A JSONResponse that skips response-model validation and uses dumps()."""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class ColumnarResponse(FastJSONResponse):
+    media_type = COLUMNAR_MEDIA_TYPE
+
+
+def wants_columnar(format: str = None, accept: str = None) -> bool:
+    """True if the client asked for columnar rows with ?format=columnar or the Accept header."""
+    if format is not None:
+        return format.lower() == "columnar"
+    return bool(accept) and COLUMNAR_MEDIA_TYPE in accept.lower()
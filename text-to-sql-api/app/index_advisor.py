@@ -0,0 +1,362 @@
+import logging
+import os
+import re
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from . import database
+from . import query_log
+from . import schema_cache
+from . import sql_guard
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+
+# Widest composite index the advisor will suggest.
+INDEX_ADVISOR_MAX_COLUMNS = int(os.environ.get("INDEX_ADVISOR_MAX_COLUMNS", "3"))
+# Building an index to measure it can take a while on big tables.
+INDEX_ADVISOR_TIMEOUT_MS = int(os.environ.get("INDEX_ADVISOR_TIMEOUT_MS", "300000"))
+
+_EXISTING_INDEXES_QUERY = """
+SELECT
+    t.relname AS table_name,
+    i.relname AS index_name,
+    array_agg(a.attname ORDER BY k.ord) AS columns
+FROM
+    pg_catalog.pg_index x
+    JOIN pg_catalog.pg_class t ON t.oid = x.indrelid
+    JOIN pg_catalog.pg_class i ON i.oid = x.indexrelid
+    JOIN pg_catalog.pg_namespace n ON n.oid = t.relnamespace
+    CROSS JOIN LATERAL unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+WHERE
+    n.nspname = 'public'
+    -- An index left INVALID by a failed concurrent build serves no queries.
+    AND x.indisvalid
+GROUP BY
+    t.relname,
+    i.relname;
+"""
+
+_INDEX_VALID_QUERY = """
+SELECT x.indisvalid
+FROM pg_catalog.pg_index x
+JOIN pg_catalog.pg_class i ON i.oid = x.indexrelid
+JOIN pg_catalog.pg_namespace n ON n.oid = i.relnamespace
+WHERE n.nspname = 'public' AND i.relname = %s;
+"""
+
+
+class HypotheticalIndexUnavailable(Exception):
+    """Raised when costs are to be compared but the hypopg extension is not installed."""
+
+
+_NOT_ALIASES = (
+    "on", "where", "join", "left", "right", "inner", "outer", "full", "cross", "natural",
+    "group", "order", "limit", "offset", "using", "union", "having", "window", "lateral",
+)
+_TABLE_REF = re.compile(
+    r'\b(?:from|join)\s+(?:public\.)?"?([a-z_][a-z0-9_]*)"?'
+    r'(?:\s+(?:as\s+)?(?!(?:' + "|".join(_NOT_ALIASES) + r')\b)"?([a-z_][a-z0-9_]*)"?)?'
+)
+_COLUMN_REF = r'(?:"?([a-z_][a-z0-9_]*)"?\.)?"?([a-z_][a-z0-9_]*)"?'
+_COMPARISON = re.compile(_COLUMN_REF + r"\s*(<=|>=|<>|!=|=|<|>|\bin\b|\bbetween\b|\bis\b)")
+_JOIN_EQUALITY = re.compile(_COLUMN_REF + r"\s*=\s*" + _COLUMN_REF)
+_ORDER_BY = re.compile(r"\border by\s+(.+?)(?:\blimit\b|\boffset\b|\)|$)")
+
+
+def _resolve(qualifier, column, aliases: dict, columns: dict):
+    """Maps a (possibly qualified) column reference to (table, column), or None."""
+    if qualifier:
+        table = aliases.get(qualifier)
+        return (table, column) if table and column in columns.get(table, ()) else None
+    owners = [table for table in set(aliases.values()) if column in columns.get(table, ())]
+    return (owners[0], column) if len(owners) == 1 else None
+
+
+def analyze(normalized_sql: str, columns: dict) -> dict:
+    """
+    Finds the columns a statement filters, joins and sorts on. Returns
+    {table: {"equality": [...], "range": [...], "join": [...], "order": [...]}}.
+    Expects normalize_sql() output and {table: set(columns)} for the schema.
+    """
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(normalized_sql):
+        if table in columns:
+            aliases[table] = table
+            if alias:
+                aliases[alias] = table
+
+    usage = {}
+
+    def use(kind, ref):
+        if ref is not None:
+            columns_of_kind = usage.setdefault(ref[0], {"equality": [], "range": [], "join": [], "order": []})[kind]
+            if ref[1] not in columns_of_kind:
+                columns_of_kind.append(ref[1])
+
+    for left_qualifier, left, right_qualifier, right in _JOIN_EQUALITY.findall(normalized_sql):
+        left_ref = _resolve(left_qualifier, left, aliases, columns)
+        right_ref = _resolve(right_qualifier, right, aliases, columns)
+        if left_ref and right_ref and left_ref[0] != right_ref[0]:
+            use("join", left_ref)
+            use("join", right_ref)
+
+    for qualifier, column, operator in _COMPARISON.findall(normalized_sql):
+        if operator in ("<>", "!="):
+            continue
+        kind = "equality" if operator in ("=", "in", "is") else "range"
+        ref = _resolve(qualifier, column, aliases, columns)
+        if ref is not None and column not in usage.get(ref[0], {}).get("join", ()):
+            use(kind, ref)
+
+    match = _ORDER_BY.search(normalized_sql)
+    if match:
+        for item in match.group(1).split(","):
+            found = re.match(r"\s*" + _COLUMN_REF, item)
+            if found:
+                use("order", _resolve(found.group(1), found.group(2), aliases, columns))
+    return usage
+
+
+def _candidates(usage: dict) -> list:
+    """Turns one statement's column usage into (table, columns) index candidates."""
+    candidates = []
+    for table, kinds in usage.items():
+        # Equality columns lead; one range or sort column can follow them.
+        leading = kinds["equality"][:INDEX_ADVISOR_MAX_COLUMNS]
+        trailing = [column for column in kinds["range"] + kinds["order"] if column not in leading]
+        if leading or trailing:
+            candidates.append((table, tuple(leading + trailing[:1])[:INDEX_ADVISOR_MAX_COLUMNS]))
+        for column in kinds["join"]:
+            candidates.append((table, (column,)))
+    return candidates
+
+
+def _is_covered(table: str, columns: tuple, indexes: list) -> bool:
+    """True if an index on table starts with these columns."""
+    return any(
+        index["table_name"] == table and tuple(index["columns"][:len(columns)]) == columns
+        for index in indexes
+    )
+
+
+def get_existing_indexes() -> list:
+    with database.get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(_EXISTING_INDEXES_QUERY)
+            return cur.fetchall()
+
+
+def recommend(entries: list, columns_info: list, indexes: list, limit: int = 10) -> list:
+    """
+    Ranks missing indexes by the execution time of the logged statements
+    that would use them. Candidates that an existing index already serves,
+    or that a better-ranked suggestion starts with, are left out.
+    """
+    columns = {}
+    for col in columns_info:
+        columns.setdefault(col['table_name'], set()).add(col['column_name'])
+
+    scored = {}
+    for entry in entries:
+        for candidate in _candidates(analyze(entry["normalized_sql"], columns)):
+            if _is_covered(*candidate, indexes):
+                continue
+            advice = scored.setdefault(candidate, {
+                "table": candidate[0],
+                "columns": list(candidate[1]),
+                "total_seconds": 0.0,
+                "calls": 0,
+                "fingerprints": [],
+            })
+            advice["total_seconds"] += entry["total_seconds"]
+            advice["calls"] += entry["calls"]
+            advice["fingerprints"].append(entry["fingerprint"])
+
+    ranked = sorted(scored.values(), key=lambda advice: (-advice["total_seconds"], -advice["calls"]))
+    chosen = []
+    for advice in ranked:
+        suggested = [{"table_name": other["table"], "columns": other["columns"]} for other in chosen]
+        if _is_covered(advice["table"], tuple(advice["columns"]), suggested):
+            continue
+        advice["create_sql"] = create_index_sql(advice["table"], advice["columns"])
+        advice["total_seconds"] = round(advice["total_seconds"], 6)
+        chosen.append(advice)
+        if len(chosen) >= limit:
+            break
+    return chosen
+
+
+def index_name(table: str, columns: list) -> str:
+    return f"idx_{table}_{'_'.join(columns)}"[:63]
+
+
+def create_index_sql(table: str, columns: list, concurrently: bool = True) -> str:
+    return "CREATE INDEX {}IF NOT EXISTS {} ON {} ({});".format(
+        "CONCURRENTLY " if concurrently else "",
+        index_name(table, columns),
+        table,
+        ", ".join(columns),
+    )
+
+
+def _create_index_statement(table: str, columns: list) -> sql.Composed:
+    return sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})").format(
+        name=sql.Identifier(index_name(table, columns)),
+        table=sql.Identifier(table),
+        columns=sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+    )
+
+
+def _index_valid(cur, name: str):
+    """True or False from pg_index.indisvalid, or None if there is no such index."""
+    cur.execute(_INDEX_VALID_QUERY, (name,))
+    row = cur.fetchone()
+    return None if row is None else row["indisvalid"]
+
+
+def _drop_index(cur, name: str):
+    cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+
+
+def _build_index(conn, cur, table: str, columns: list):
+    """
+    Creates the index CONCURRENTLY, outside a transaction. A failed build
+    leaves an INVALID index that IF NOT EXISTS would then silently accept,
+    so one left by an earlier attempt is dropped first and one left by this
+    attempt is dropped before the error is raised.
+    """
+    name = index_name(table, columns)
+    conn.rollback()
+    conn.autocommit = True
+    try:
+        cur.execute("SET statement_timeout = %s", (INDEX_ADVISOR_TIMEOUT_MS,))
+        if _index_valid(cur, name) is False:
+            logger.warning("Dropping invalid index %s left by an earlier build", name)
+            _drop_index(cur, name)
+        try:
+            cur.execute(_create_index_statement(table, columns))
+        except psycopg2.Error:
+            if not conn.closed and _index_valid(cur, name) is False:
+                _drop_index(cur, name)
+            raise
+    finally:
+        if not conn.closed:
+            cur.execute("RESET statement_timeout")
+            conn.autocommit = False
+
+
+def _has_hypopg(cur) -> bool:
+    cur.execute("SELECT 1 FROM pg_catalog.pg_extension WHERE extname = 'hypopg'")
+    return cur.fetchone() is not None
+
+
+def _columns_used(usage: dict, table: str) -> set:
+    return {column for columns in usage.get(table, {}).values() for column in columns}
+
+
+def _costs(cur, statements: dict) -> dict:
+    """EXPLAINs each statement and returns {fingerprint: total cost}; failures are skipped."""
+    costs = {}
+    for fingerprint, statement in statements.items():
+        try:
+            sql_guard.ensure_single_select(statement)
+        except sql_guard.QueryRejectedError:
+            continue
+        cur.execute("SAVEPOINT advisor_explain")
+        try:
+            costs[fingerprint] = sql_guard.estimate(cur, statement)[0]
+        except psycopg2.Error:
+            cur.execute("ROLLBACK TO SAVEPOINT advisor_explain")
+    return costs
+
+
+def evaluate(table: str, columns: list, apply: bool = False) -> dict:
+    """
+    Compares the planner's cost of the logged statements that would use an
+    index, before and after it exists. Without apply the index is only
+    hypothetical (hypopg), so nothing is built or locked and
+    HypotheticalIndexUnavailable is raised if hypopg is not installed; with
+    apply it is created CONCURRENTLY and kept.
+    """
+    known = {col['column_name'] for col in schema_cache.schema_cache.columns_info if col['table_name'] == table}
+    if not known or not set(columns) <= known:
+        raise ValueError(f"Unknown table or columns: {table}({', '.join(columns)})")
+
+    schema_columns = {}
+    for col in schema_cache.schema_cache.columns_info:
+        schema_columns.setdefault(col['table_name'], set()).add(col['column_name'])
+    # Parameterized templates cannot be EXPLAINed without values, so only plain statements are compared.
+    statements = {
+        entry["fingerprint"]: entry["example_sql"]
+        for entry in query_log.query_log.entries()
+        if "$1" not in entry["example_sql"]
+        and set(columns) & _columns_used(analyze(entry["normalized_sql"], schema_columns), table)
+    }
+
+    with database.get_db_connection() as conn:
+        hypothetical = False
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                if not apply and not _has_hypopg(cur):
+                    raise HypotheticalIndexUnavailable(
+                        "Comparing costs without building the index needs the hypopg extension "
+                        "(CREATE EXTENSION hypopg). Use POST /admin/index-advice/apply to build it for real."
+                    )
+                cur.execute("SET LOCAL statement_timeout = %s", (INDEX_ADVISOR_TIMEOUT_MS,))
+                before = _costs(cur, statements)
+                if apply:
+                    _build_index(conn, cur, table, columns)
+                    cur.execute("SET LOCAL statement_timeout = %s", (INDEX_ADVISOR_TIMEOUT_MS,))
+                else:
+                    # Plain EXPLAIN in this session plans with the hypothetical index.
+                    hypothetical = True
+                    statement = sql.SQL("CREATE INDEX ON {table} ({columns})").format(
+                        table=sql.Identifier(table),
+                        columns=sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+                    )
+                    cur.execute("SELECT * FROM hypopg_create_index(%s)", (statement.as_string(conn),))
+                after = _costs(cur, statements)
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = False
+                if hypothetical:
+                    # Hypothetical indexes live in the session, not the transaction.
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT hypopg_reset()")
+                    conn.rollback()
+
+    before_total = sum(before[fp] for fp in after if fp in before)
+    after_total = sum(after[fp] for fp in after if fp in before)
+    return {
+        "table": table,
+        "columns": columns,
+        "index_name": index_name(table, columns),
+        "applied": apply,
+        "hypothetical": not apply,
+        "statements": len(after),
+        "cost_before": round(before_total, 2),
+        "cost_after": round(after_total, 2),
+        "improvement": round(1 - after_total / before_total, 4) if before_total else 0.0,
+        "per_statement": [
+            {"fingerprint": fp, "cost_before": round(before[fp], 2), "cost_after": round(after[fp], 2)}
+            for fp in after if fp in before
+        ],
+    }
+
+
+def advise(limit: int = 10, evaluate_costs: bool = False) -> list:
+    """Recommends indexes for the logged workload, optionally with before/after costs."""
+    recommendations = recommend(
+        query_log.query_log.entries(), schema_cache.schema_cache.columns_info, get_existing_indexes(), limit
+    )
+    if evaluate_costs:
+        for advice in recommendations:
+            measured = evaluate(advice["table"], advice["columns"])
+            advice.update({key: measured[key] for key in ("cost_before", "cost_after", "improvement")})
+    return recommendations
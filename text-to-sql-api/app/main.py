@@ -1,22 +1,62 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import Optional
 import os
-from groq import Groq
+import psycopg2
 from dotenv import load_dotenv
-import traceback
+import logging
+import asyncio
+import json
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
 # This line reads your .env file at startup
 load_dotenv()
 
 # Use a relative import because we are inside a package
 from . import database
+from . import schema_cache
+from . import schema_index
+from . import sql_cache
+from . import llm
+from . import observability
+from . import sql_guard
+from . import query_log
+from . import index_advisor
+from . import encoding
+
+observability.configure_logging()
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+
+# Responses smaller than this (in bytes) are not worth compressing.
+GZIP_MINIMUM_SIZE = int(os.environ.get("GZIP_MINIMUM_SIZE", "1000"))
+# zlib level 1-9; the middle levels get most of the size win for far less CPU than 9.
+GZIP_COMPRESS_LEVEL = int(os.environ.get("GZIP_COMPRESS_LEVEL", "5"))
 
 # --- Application Setup ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the connection pool before serving traffic and release it on shutdown.
+    await database.open_pool()
+    # Generated SQL is only valid for the schema it was written against.
+    schema_cache.add_listener(sql_cache.sql_cache.invalidate)
+    await schema_cache.load_async()
+    schema_watcher = asyncio.create_task(schema_cache.watch())
+    yield
+    schema_watcher.cancel()
+    await llm.close()
+    database.close_pool()
+
+
 app = FastAPI(
     title="Text-to-SQL API",
     description="A fully dynamic API that converts natural language to SQL queries.",
     version="2.0.0",
+    lifespan=lifespan,
 )
 
 # It tells the FastAPI server to trust requests coming from our React app.
@@ -33,6 +73,12 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Compress larger responses for clients that send Accept-Encoding: gzip.
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+
+# Request counters/latency histograms and the Prometheus /metrics endpoint.
+observability.install(app)
+
 # --- Pydantic Models ---
 class AskRequest(BaseModel):
     question: str
@@ -41,38 +87,49 @@ class AskResponse(BaseModel):
     question: str
     sql_query: str
     data: list
+    truncated: bool = False
 
-# --- API Endpoints ---
+class BatchAskRequest(BaseModel):
+    questions: list[str]
 
-@app.get("/health", tags=["Health Check"])
-async def health_check():
-    """A simple endpoint to confirm the API is running."""
-    return {"status": "ok"}
+class BatchAskResult(BaseModel):
+    question: str
+    sql_query: Optional[str] = None
+    data: list = []
+    truncated: bool = False
+    error: Optional[str] = None
+    # Set when the cost guard stopped the query; see sql_guard.QueryRejectedError.to_dict().
+    rejection: Optional[dict] = None
 
+class BatchAskResponse(BaseModel):
+    results: list[BatchAskResult]
 
-@app.post("/ask", response_model=AskResponse, tags=["Text-to-SQL"])
-async def ask_question(request: AskRequest):
-    """
-    Receives a natural language question, dynamically fetches the DB schema,
-    converts the question to SQL, executes it, and returns the result.
-    """
-    print("\n--- [TEXT-TO-SQL] STEP 1: Received new question ---")
-    try:
-        # 1. Initialize Groq Client
-        print("--- [TEXT-TO-SQL] STEP 2: Initializing Groq client... ---")
-        client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-        print("--- [TEXT-TO-SQL] SUCCESS: Groq client ready. ---")
-
-        # 2. Get Database Schema Dynamically
-        print("--- [TEXT-TO-SQL] STEP 3: Fetching dynamic DB schema... ---")
-        db_schema = database.get_dynamic_schema()
-        if not db_schema:
-            raise HTTPException(status_code=500, detail="Could not retrieve database schema. Is the database empty?")
-        print(f"--- [TEXT-TO-SQL] SUCCESS: Fetched schema:\n{db_schema} ---")
-
-        # 3. Construct the NEW, MORE ROBUST prompt for the LLM
-        print("--- [TEXT-TO-SQL] STEP 4: Building robust prompt for LLM... ---")
-        prompt = f"""
+class GroupedAskRequest(BaseModel):
+    questions: list[str]
+    group_by: str = "product_id"
+    keys: list
+    max_rows_per_group: int = 50
+
+class GroupedAskResult(BaseModel):
+    question: str
+    sql_template: Optional[str] = None
+    groups: dict = {}
+    truncated_keys: list = []
+    error: Optional[str] = None
+    rejection: Optional[dict] = None
+
+class GroupedAskResponse(BaseModel):
+    group_by: str
+    results: list[GroupedAskResult]
+
+class IndexRequest(BaseModel):
+    table: str
+    columns: list[str]
+
+# --- SQL Generation ---
+
+def _build_prompt(db_schema: str, question: str) -> str:
+    return f"""
         You are an expert PostgreSQL query writer. Your job is to write a SQL query based on the user's question and the database schema provided.
 
         **RULES:**
@@ -86,44 +143,468 @@ async def ask_question(request: AskRequest):
         {db_schema}
 
         **User Question:**
-        {request.question}
+        {question}
 
         **SQL Query:**
         """
 
-        # 4. Generate SQL query using Groq
-        print("--- [TEXT-TO-SQL] STEP 5: Calling LLM to generate SQL... ---")
-        chat_completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.1-8b-instant",
-            temperature=0,
-        )
-        sql_query = chat_completion.choices[0].message.content.strip()
-        print(f"--- [TEXT-TO-SQL] SUCCESS: Generated SQL: {sql_query} ---")
 
-        # 5. Execute the SQL query
-        print("--- [TEXT-TO-SQL] STEP 6: Executing SQL query against database... ---")
-        data = database.execute_query(sql_query)
+def _build_template_prompt(db_schema: str, question: str, group_by: str) -> str:
+    return f"""
+        You are an expert PostgreSQL query writer. Your job is to write ONE set-based SQL query that answers the
+        user's question for MANY entities at once, identified by the column `{group_by}`.
+
+        **RULES:**
+        1.  You **MUST ONLY** use the tables and columns provided in the schema. Do not guess or "hallucinate" columns.
+        2.  The query **MUST** filter on `{group_by}` with exactly `{group_by} = ANY($1)`, qualified with the table alias if needed. `$1` is an array of {group_by} values.
+        3.  The query **MUST** return a column named exactly `{group_by}` so rows can be attributed to each entity.
+        4.  Do not add a global LIMIT; if the question asks for "most recent" or "top" rows, order by `{group_by}` first.
+        5.  Output ONLY the raw SQL query. No explanation, no markdown, no surrounding text.
+
+        **Schema:**
+        {db_schema}
+
+        **User Question (about a single {group_by}):**
+        {question}
+
+        **SQL Query:**
+        """
+
+
+async def _generate_sql(question: str, db_schema: str, group_by: str = None) -> str:
+    """
+    Asks the LLM to turn a question into SQL for the given schema. With
+    group_by, it writes a parameterized template over many key values instead.
+    """
+    if group_by:
+        prompt = _build_template_prompt(db_schema, question, group_by)
+    else:
+        prompt = _build_prompt(db_schema, question)
+    with observability.timed("llm_generation"):
+        completion = await llm.chat(prompt, temperature=0)
+    sql_query = completion.content.strip()
+    logger.debug("Generated SQL: %s", sql_query)
+    return sql_query
+
+
+async def _load_schema():
+    """Makes sure the schema cache is warm and returns the schema fingerprint."""
+    # The schema is cached and reloaded only when the catalog changes
+    with observability.timed("schema_fetch"):
+        loaded = await schema_cache.ensure_loaded_async()
+    if not loaded:
+        raise HTTPException(status_code=500, detail="Could not retrieve database schema. Is the database empty?")
+    fingerprint = schema_cache.current_fingerprint()
+    logger.debug("Using schema fingerprint %s", fingerprint)
+    return fingerprint
+
+
+def _cache_question(question: str, group_by: str = None) -> str:
+    # Templates are cached separately from plain SQL for the same question.
+    return f"[grouped by {group_by}] {question}" if group_by else question
+
+
+async def _resolve_sql(question: str, fingerprint: str, group_by: str = None):
+    """
+    Returns (sql_query, cache_hit) for a question, reusing SQL generated
+    earlier for the same question and schema when possible. On a miss, the
+    prompt only describes the tables relevant to the question.
+    """
+    sql_query = await sql_cache.get_async(_cache_question(question, group_by), fingerprint)
+    if sql_query is not None:
+        logger.debug("SQL cache hit: %s", sql_query)
+        return sql_query, True
+    with observability.timed("schema_select"):
+        # Templates must reach the group_by column, so it counts as part of the question.
+        db_schema = await schema_cache.get_prompt_fragment_for_async(f"{question} {group_by or ''}")
+    return await _generate_sql(question, db_schema, group_by), False
+
+
+def _ndjson_line(payload: dict) -> str:
+    return json.dumps(payload, default=encoding.json_default, separators=(",", ":")) + "\n"
+
+
+# --- API Endpoints ---
+
+@app.get("/health", tags=["Health Check"])
+async def health_check():
+    """A simple endpoint to confirm the API is running."""
+    return {"status": "ok"}
+
+
+@app.post("/admin/schema/refresh", tags=["Admin"])
+async def refresh_schema():
+    """Forces the cached schema and prompt fragment to be rebuilt from the database."""
+    try:
+        await schema_cache.refresh_async(force=True)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Could not refresh schema: {e}")
+    return schema_cache.status()
+
+
+@app.get("/admin/schema/context", tags=["Admin"])
+async def preview_schema_context(question: str):
+    """Shows the schema text a question would be given, and how much of the full schema that is."""
+    fingerprint = await _load_schema()
+    fragment = await schema_cache.get_prompt_fragment_for_async(question)
+    return {
+        "fingerprint": fingerprint,
+        "tokens": schema_index.estimate_tokens(fragment),
+        "full_schema_tokens": schema_index.estimate_tokens(schema_cache.schema_cache.prompt_fragment),
+        "schema": fragment,
+    }
+
+
+@app.get("/admin/sql-cache", tags=["Admin"])
+async def sql_cache_stats():
+    """Returns hit/miss counters for the question-to-SQL cache."""
+    return sql_cache.stats()
+
+
+@app.delete("/admin/sql-cache", tags=["Admin"])
+async def clear_sql_cache():
+    """Drops every cached question-to-SQL entry."""
+    await sql_cache.invalidate_async()
+    return sql_cache.stats()
+
+
+@app.get("/products/{product_id}/ticket-watermark", tags=["Watermarks"])
+async def get_ticket_watermark(product_id: int, as_of: Optional[str] = None):
+    """
+    Returns a cheap watermark of a product's support tickets: count, newest
+    created_at and a digest of ticket statuses. With as_of, also returns the
+    count and digest of the tickets created up to that time.
+    """
+    try:
+        watermark = await asyncio.to_thread(database.get_ticket_watermark, product_id, as_of)
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Could not read ticket watermark: {e.pgerror or e}")
+    if watermark["max_created_at"] is not None:
+        watermark["max_created_at"] = watermark["max_created_at"].isoformat()
+    return {"product_id": product_id, **watermark}
+
+
+@app.get("/products/{product_id}/tickets", tags=["Watermarks"])
+async def get_tickets_since(product_id: int, since: str, limit: int = database.ASK_MAX_ROWS):
+    """Returns the product's support tickets created after `since`."""
+    try:
+        tickets = await asyncio.to_thread(database.get_tickets_since, product_id, since, limit)
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Could not read tickets: {e.pgerror or e}")
+    return {"product_id": product_id, "since": since, "data": tickets}
+
+
+@app.get("/admin/db", tags=["Admin"])
+async def db_status():
+    """Shows pool usage on the primary and the health of each read replica."""
+    return database.pool_status()
+
+
+@app.get("/admin/llm", tags=["Admin"])
+async def llm_stats():
+    """Returns call, retry, latency and token counters for the LLM gateway."""
+    return llm.stats()
+
+
+@app.get("/admin/query-log", tags=["Admin"])
+async def query_log_top(limit: int = 20, order_by: str = "total_seconds"):
+    """Returns the heaviest SQL fingerprints seen by this process."""
+    if order_by not in ("total_seconds", "avg_seconds", "max_seconds", "calls"):
+        raise HTTPException(status_code=400, detail=f"Cannot order by {order_by}")
+    return {"fingerprints": query_log.top(limit, order_by)}
+
+
+@app.delete("/admin/query-log", tags=["Admin"])
+async def clear_query_log():
+    """Forgets every logged fingerprint."""
+    query_log.reset()
+    return {"fingerprints": query_log.top()}
+
+
+@app.get("/admin/index-advice", tags=["Admin"])
+async def index_advice(limit: int = 10, evaluate: bool = False):
+    """
+    Suggests indexes for the logged workload. With evaluate=true, EXPLAIN
+    costs are compared with each one as a hypothetical (hypopg) index; nothing
+    is built, and the request fails with 409 if hypopg is not installed.
+    """
+    try:
+        return {"recommendations": await asyncio.to_thread(index_advisor.advise, limit, evaluate)}
+    except index_advisor.HypotheticalIndexUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Could not compute index advice: {e.pgerror or e}")
+
+
+@app.post("/admin/index-advice/apply", tags=["Admin"])
+async def apply_index_advice(request: IndexRequest):
+    """
+    Creates an index CONCURRENTLY and reports EXPLAIN costs before and after.
+    An INVALID index left by an earlier failed build is dropped and rebuilt.
+    """
+    try:
+        return await asyncio.to_thread(index_advisor.evaluate, request.table, request.columns, True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Could not create index: {e.pgerror or e}")
+
+
+@app.post(
+    "/ask",
+    response_model=AskResponse,
+    tags=["Text-to-SQL"],
+    responses={200: {"content": {encoding.COLUMNAR_MEDIA_TYPE: {}}}},
+)
+async def ask_question(request: AskRequest, format: Optional[str] = None, accept: Optional[str] = Header(None)):
+    """
+    Receives a natural language question, dynamically fetches the DB schema,
+    converts the question to SQL, executes it, and returns the result.
+
+    With ?format=columnar (or Accept: application/vnd.text-to-sql.columnar+json)
+    the result comes back as "columns" (name and type, sent once) and "rows"
+    (one array per row) instead of "data".
+    """
+    columnar = encoding.wants_columnar(format, accept)
+    try:
+        # 1. Resolve the SQL, from the cache or by calling the LLM
+        fingerprint = await _load_schema()
+        sql_query, cache_hit = await _resolve_sql(request.question, fingerprint)
+
+        # 2. Execute the SQL query
+        with observability.timed("sql_execution"):
+            data, truncated = await database.execute_query_async(sql_query, columnar=columnar)
         
         # --- FIX ADDED HERE ---
         # Handle cases where the query returns no results. The database function
         # might return None, which would cause a crash. We convert it to an empty list.
         if data is None:
-            data = []
+            data = {"columns": [], "rows": []} if columnar else []
 
-        print(f"--- [TEXT-TO-SQL] SUCCESS: Query executed. Found {len(data)} results. ---")
+        logger.info(
+            "Query returned %d rows (truncated=%s, cache_hit=%s)",
+            len(data["rows"] if columnar else data), truncated, cache_hit,
+        )
 
-        # 6. Return the response
+        # Only cache SQL that actually executed, so bad generations are retried.
+        if not cache_hit:
+            await sql_cache.put_async(request.question, fingerprint, sql_query)
+
+        # 3. Return the response
+        if columnar:
+            # Rows are plain arrays; skip response-model validation and encode them directly.
+            return encoding.ColumnarResponse({
+                "question": request.question,
+                "sql_query": sql_query,
+                "columns": data["columns"],
+                "rows": data["rows"],
+                "truncated": truncated,
+            })
         return AskResponse(
             question=request.question,
             sql_query=sql_query,
             data=data,
+            truncated=truncated,
         )
+    except sql_guard.QueryRejectedError as e:
+        logger.warning("Rejected SQL for %r: %s", request.question, e)
+        raise HTTPException(status_code=422, detail={"sql_query": sql_query, **e.to_dict()})
     except Exception as e:
-        print(f"--- [TEXT-TO-SQL] FATAL ERROR in ask_question: {e} ---")
-        traceback.print_exc()
+        logger.exception("Error in ask_question: %s", e)
         # It's better to return the actual error from the database if possible
         error_detail = str(e)
         if hasattr(e, 'pgerror'):
             error_detail = e.pgerror
         raise HTTPException(status_code=500, detail=f"Error executing SQL query: {error_detail}")
+
+
+@app.post(
+    "/ask/batch",
+    response_model=BatchAskResponse,
+    tags=["Text-to-SQL"],
+    responses={200: {"content": {encoding.COLUMNAR_MEDIA_TYPE: {}}}},
+)
+async def ask_questions_batch(request: BatchAskRequest, format: Optional[str] = None,
+                              accept: Optional[str] = Header(None)):
+    """
+    Answers many questions in one round-trip. The schema is read once, SQL
+    for all questions is generated in parallel, and every statement runs over
+    a single pooled connection. Failures are reported per question.
+
+    With ?format=columnar (or the columnar Accept header) every result carries
+    "columns" and "rows" instead of "data", as in /ask.
+    """
+    columnar = encoding.wants_columnar(format, accept)
+    logger.info("Received batch of %d questions", len(request.questions))
+    fingerprint = await _load_schema()
+
+    resolved = await asyncio.gather(
+        *(_resolve_sql(question, fingerprint) for question in request.questions),
+        return_exceptions=True,
+    )
+
+    results = []
+    to_execute = []
+    for question, outcome in zip(request.questions, resolved):
+        if isinstance(outcome, Exception):
+            logger.error("Error generating SQL for %r: %s", question, outcome)
+            results.append(BatchAskResult(question=question, error=f"Error generating SQL query: {outcome}"))
+            to_execute.append(None)
+        else:
+            results.append(BatchAskResult(question=question, sql_query=outcome[0]))
+            to_execute.append(outcome[0])
+
+    try:
+        with observability.timed("sql_execution"):
+            executed = await database.execute_queries_async(to_execute, columnar=columnar)
+    except Exception as e:
+        logger.exception("Error in ask_questions_batch: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error executing SQL queries: {e}")
+
+    # Columnar results by position; they bypass the response model, like in /ask.
+    tables = {}
+    for position, (result, generated, outcome) in enumerate(zip(results, resolved, executed)):
+        if outcome is None:
+            continue
+        data, truncated, error = outcome
+        if isinstance(error, sql_guard.QueryRejectedError):
+            result.error = f"Query rejected: {error}"
+            result.rejection = error.to_dict()
+            continue
+        if error is not None:
+            result.error = f"Error executing SQL query: {error}"
+            continue
+        if columnar:
+            tables[position] = data
+        else:
+            result.data = data
+        result.truncated = truncated
+        # Only cache SQL that actually executed, as in /ask.
+        sql_query, cache_hit = generated
+        if not cache_hit:
+            await sql_cache.put_async(result.question, fingerprint, sql_query)
+
+    logger.info("Batch done, %d/%d succeeded", sum(r.error is None for r in results), len(results))
+    if columnar:
+        return encoding.ColumnarResponse({"results": [
+            {**result.model_dump(exclude={"data"}), **tables.get(position, {"columns": [], "rows": []})}
+            for position, result in enumerate(results)
+        ]})
+    return BatchAskResponse(results=results)
+
+
+@app.post(
+    "/ask/grouped",
+    response_model=GroupedAskResponse,
+    tags=["Text-to-SQL"],
+    responses={200: {"content": {encoding.COLUMNAR_MEDIA_TYPE: {}}}},
+)
+async def ask_questions_grouped(request: GroupedAskRequest, format: Optional[str] = None,
+                                accept: Optional[str] = Header(None)):
+    """
+    Answers each question for many entities at once. For every question the
+    LLM writes one parameterized, set-based template filtered on
+    `group_by = ANY($1)`; it is prepared once and executed for all keys, and
+    the rows are returned grouped by key.
+
+    With ?format=columnar (or the columnar Accept header) every result carries
+    its "columns" once and each group's rows as arrays.
+    """
+    columnar = encoding.wants_columnar(format, accept)
+    logger.info("Received %d grouped questions for %d keys", len(request.questions), len(request.keys))
+    fingerprint = await _load_schema()
+    if not schema_cache.has_column(request.group_by):
+        raise HTTPException(status_code=400, detail=f"Unknown group_by column: {request.group_by}")
+
+    resolved = await asyncio.gather(
+        *(_resolve_sql(question, fingerprint, request.group_by) for question in request.questions),
+        return_exceptions=True,
+    )
+
+    results = []
+    columns_by_result = {}
+    for question, outcome in zip(request.questions, resolved):
+        if isinstance(outcome, Exception):
+            logger.error("Error generating template for %r: %s", question, outcome)
+            results.append(GroupedAskResult(question=question, error=f"Error generating SQL template: {outcome}"))
+            continue
+        sql_template, cache_hit = outcome
+        result = GroupedAskResult(question=question, sql_template=sql_template)
+        try:
+            with observability.timed("sql_execution"):
+                groups, truncated_keys, columns = await asyncio.to_thread(
+                    database.execute_grouped_template,
+                    sql_template, request.group_by, request.keys, request.max_rows_per_group,
+                    columnar=columnar,
+                )
+        except sql_guard.QueryRejectedError as e:
+            logger.warning("Rejected template for %r: %s", question, e)
+            result.error = f"Query rejected: {e}"
+            result.rejection = e.to_dict()
+            results.append(result)
+            continue
+        except (psycopg2.Error, ValueError) as e:
+            logger.error("Error executing template for %r: %s", question, e)
+            result.error = f"Error executing SQL template: {getattr(e, 'pgerror', None) or e}"
+            results.append(result)
+            continue
+        result.groups = {str(key): rows for key, rows in groups.items()}
+        result.truncated_keys = truncated_keys
+        if columnar:
+            columns_by_result[len(results)] = columns or []
+        if not cache_hit:
+            await sql_cache.put_async(_cache_question(question, request.group_by), fingerprint, sql_template)
+        results.append(result)
+
+    if columnar:
+        return encoding.ColumnarResponse({"group_by": request.group_by, "results": [
+            {**result.model_dump(), "columns": columns_by_result.get(position, [])}
+            for position, result in enumerate(results)
+        ]})
+    return GroupedAskResponse(group_by=request.group_by, results=results)
+
+
+@app.post("/ask/stream", tags=["Text-to-SQL"])
+async def ask_question_stream(request: AskRequest):
+    """
+    Like /ask, but streams the result as NDJSON while rows arrive from a
+    server-side cursor. The first line carries the SQL, each following line
+    one row, and the last line the row count and whether ASK_MAX_ROWS cut
+    the result short.
+    """
+    try:
+        fingerprint = await _load_schema()
+        sql_query, cache_hit = await _resolve_sql(request.question, fingerprint)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error in ask_question_stream: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error generating SQL query: {e}")
+
+    # Check the cost before the first byte goes out, while a 422 is still possible.
+    try:
+        guarded_sql = await database.guard_query_async(sql_query)
+    except sql_guard.QueryRejectedError as e:
+        logger.warning("Rejected SQL for %r: %s", request.question, e)
+        raise HTTPException(status_code=422, detail={"sql_query": sql_query, **e.to_dict()})
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Error executing SQL query: {e.pgerror or e}")
+
+    rows = database.RowStream(guarded_sql)
+
+    # A plain generator: Starlette iterates it in a worker thread, so the
+    # blocking cursor reads never run on the event loop.
+    def body():
+        yield _ndjson_line({"type": "meta", "question": request.question, "sql_query": sql_query})
+        try:
+            for batch in rows:
+                yield "".join(_ndjson_line({"type": "row", "data": row}) for row in batch)
+        except Exception as e:
+            logger.error("Error while streaming results: %s", e)
+            yield _ndjson_line({"type": "error", "detail": getattr(e, "pgerror", None) or str(e)})
+            return
+        yield _ndjson_line({"type": "end", "row_count": rows.row_count, "truncated": rows.truncated})
+        if not cache_hit:
+            sql_cache.sql_cache.put(request.question, fingerprint, sql_query)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# --- Configuration ---
+
+# Distinct statement shapes kept in memory; the least recently seen is dropped first.
+QUERY_LOG_MAX_FINGERPRINTS = int(os.environ.get("QUERY_LOG_MAX_FINGERPRINTS", "500"))
+
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"(?<![\w$.])-?\d+(?:\.\d+)?(?![\w.])")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    Reduces a statement to its shape: comments dropped, literals replaced by
+    ?, IN lists collapsed, whitespace collapsed and everything lower-cased.
+    """
+    text = _COMMENTS.sub(" ", sql_query)
+    text = _STRINGS.sub("?", text)
+    text = _NUMBERS.sub("?", text)
+    text = _IN_LISTS.sub("(?)", text)
+    return _WHITESPACE.sub(" ", text).strip().rstrip(";").strip().lower()
+
+
+def fingerprint_sql(sql_query: str) -> str:
+    return hashlib.sha1(normalize_sql(sql_query).encode("utf-8")).hexdigest()[:16]
+
+
+class QueryLog:
+    """
+    In-memory statistics per SQL fingerprint: how often a statement shape
+    ran, how long it took and how many rows it returned, plus the latest
+    concrete statement so it can be EXPLAINed later.
+    """
+
+    def __init__(self, max_fingerprints: int = QUERY_LOG_MAX_FINGERPRINTS):
+        self.max_fingerprints = max_fingerprints
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, sql_query: str, seconds: float, rows: int = 0, error: bool = False):
+        normalized = normalize_sql(sql_query)
+        fingerprint = hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                entry = self._entries[fingerprint] = {
+                    "fingerprint": fingerprint,
+                    "normalized_sql": normalized,
+                    "calls": 0,
+                    "errors": 0,
+                    "rows": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                }
+            entry["example_sql"] = sql_query
+            entry["calls"] += 1
+            entry["errors"] += int(error)
+            entry["rows"] += rows
+            entry["total_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["last_seen"] = time.time()
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_fingerprints:
+                self._entries.popitem(last=False)
+
+    def entries(self) -> list:
+        with self._lock:
+            return [dict(entry) for entry in self._entries.values()]
+
+    def top(self, limit: int = 20, order_by: str = "total_seconds") -> list:
+        """Returns the heaviest fingerprints by total_seconds, max_seconds, avg_seconds or calls."""
+        entries = self.entries()
+        for entry in entries:
+            entry["avg_seconds"] = round(entry["total_seconds"] / entry["calls"], 6)
+            entry["total_seconds"] = round(entry["total_seconds"], 6)
+            entry["max_seconds"] = round(entry["max_seconds"], 6)
+        entries.sort(key=lambda entry: entry[order_by], reverse=True)
+        return entries[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+query_log = QueryLog()
+
+
+class _Timing:
+    rows = 0
+
+
+@contextmanager
+def timed(sql_query: str):
+    """
+    Records the enclosed execution of sql_query. Set `rows` on the yielded
+    object to the number of rows fetched; exceptions are recorded as errors.
+    """
+    timing = _Timing()
+    started = time.perf_counter()
+    try:
+        yield timing
+    except Exception:
+        query_log.record(sql_query, time.perf_counter() - started, timing.rows, error=True)
+        raise
+    query_log.record(sql_query, time.perf_counter() - started, timing.rows)
+
+
+def top(limit: int = 20, order_by: str = "total_seconds") -> list:
+    return query_log.top(limit, order_by)
+
+
+def reset():
+    query_log.reset()
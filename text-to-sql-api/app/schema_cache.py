@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+
+from . import database
+from . import schema_index
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+
+# How often (in seconds) the background watcher compares the catalog fingerprint.
+SCHEMA_CHECK_INTERVAL = float(os.environ.get("SCHEMA_CHECK_INTERVAL", "30"))
+
+
+class SchemaCache:
+    """
+    Process-level cache of the database schema and its prompt fragment.
+
+    The schema is loaded once at startup and only reloaded when the catalog
+    fingerprint changes or an admin asks for a refresh, so /ask never has to
+    query information_schema on the request path. A SchemaIndex built at load
+    time picks the part of the schema each question needs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fingerprint = None
+        self.columns_info = []
+        self.index = None
+        self.prompt_fragment = None
+        self.loaded_at = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Registers callback(new_fingerprint), called whenever the schema changes."""
+        self._listeners.append(callback)
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.prompt_fragment is not None
+
+    def load(self) -> bool:
+        """Reads the schema from the database and rebuilds the prompt fragment."""
+        fingerprint, columns_info, foreign_keys = database.get_schema_snapshot()
+        index = schema_index.SchemaIndex(columns_info, foreign_keys)
+        previous = self.fingerprint
+        with self._lock:
+            self.fingerprint = fingerprint
+            self.columns_info = columns_info
+            self.index = index
+            self.prompt_fragment = index.full_text if columns_info else None
+            self.loaded_at = time.time()
+        logger.info("Loaded schema (%d columns, fingerprint %s)", len(columns_info), fingerprint)
+        if previous is not None and previous != fingerprint:
+            for callback in self._listeners:
+                callback(fingerprint)
+        return self.is_loaded
+
+    def refresh_if_changed(self) -> bool:
+        """Reloads the schema if the catalog fingerprint moved. Returns True on reload."""
+        if self.is_loaded and database.get_schema_fingerprint() == self.fingerprint:
+            return False
+        self.load()
+        return True
+
+    def ensure_loaded(self) -> bool:
+        """Loads the schema if startup could not. Returns False if the database has none."""
+        if not self.is_loaded:
+            self.load()
+        return self.is_loaded
+
+    def get_prompt_fragment_for(self, question: str, budget: int = schema_index.SCHEMA_PROMPT_TOKEN_BUDGET):
+        """Returns only the schema text relevant to a question, within the token budget."""
+        return self.index.prompt_fragment(question, budget) if self.ensure_loaded() else None
+
+    def has_column(self, column_name: str) -> bool:
+        return any(col['column_name'] == column_name for col in self.columns_info)
+
+    def status(self) -> dict:
+        tables = {col['table_name'] for col in self.columns_info}
+        return {
+            "fingerprint": self.fingerprint,
+            "tables": len(tables),
+            "columns": len(self.columns_info),
+            "foreign_keys": len(self.index.foreign_keys) if self.index else 0,
+            "full_schema_tokens": schema_index.estimate_tokens(self.prompt_fragment or ""),
+            "token_budget": schema_index.SCHEMA_PROMPT_TOKEN_BUDGET,
+            "loaded_at": self.loaded_at,
+        }
+
+
+schema_cache = SchemaCache()
+
+
+async def load_async():
+    """Loads the schema at startup without blocking the event loop."""
+    try:
+        await asyncio.to_thread(schema_cache.load)
+    except psycopg2.Error as e:
+        logger.warning("Could not load schema at startup: %s", e)
+
+
+def add_listener(callback):
+    schema_cache.add_listener(callback)
+
+
+def current_fingerprint():
+    return schema_cache.fingerprint
+
+
+def has_column(column_name: str) -> bool:
+    return schema_cache.has_column(column_name)
+
+
+def status() -> dict:
+    return schema_cache.status()
+
+
+async def ensure_loaded_async() -> bool:
+    # The common case is a warm cache, which needs no thread hop at all.
+    if schema_cache.is_loaded:
+        return True
+    return await asyncio.to_thread(schema_cache.ensure_loaded)
+
+
+async def get_prompt_fragment_for_async(question: str):
+    # Selecting tables is a little CPU work on the in-memory index; only a cold cache needs a thread.
+    if schema_cache.is_loaded:
+        return schema_cache.get_prompt_fragment_for(question)
+    return await asyncio.to_thread(schema_cache.get_prompt_fragment_for, question)
+
+
+async def refresh_async(force: bool = False) -> bool:
+    if force:
+        return await asyncio.to_thread(schema_cache.load)
+    return await asyncio.to_thread(schema_cache.refresh_if_changed)
+
+
+async def watch(interval: float = SCHEMA_CHECK_INTERVAL):
+    """Background task that reloads the schema whenever the catalog changes."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await refresh_async():
+                logger.info("Schema change detected; prompt fragment rebuilt.")
+        except Exception as e:
+            logger.warning("Schema change check failed: %s", e)
@@ -0,0 +1,194 @@
+import os
+import re
+from collections import deque
+
+# --- Configuration ---
+
+# Rough upper bound, in tokens, on the schema text put into one prompt.
+SCHEMA_PROMPT_TOKEN_BUDGET = int(os.environ.get("SCHEMA_PROMPT_TOKEN_BUDGET", "1500"))
+# How many of the best-scoring tables seed the selection for a question.
+SCHEMA_MAX_SEED_TABLES = int(os.environ.get("SCHEMA_MAX_SEED_TABLES", "6"))
+
+_WORD = re.compile(r"[a-z0-9]+")
+# Words that appear in most questions or most identifiers and say nothing about which table is meant.
+_STOP_WORDS = {
+    "a", "an", "and", "are", "by", "each", "for", "from", "give", "how", "id", "in", "is", "list",
+    "many", "me", "much", "of", "on", "or", "per", "show", "the", "to", "was", "were", "what",
+    "when", "which", "who", "with",
+}
+
+
+def _chars_to_tokens(chars: int) -> int:
+    # A tokenizer-free estimate: about four characters per token for schema text.
+    return chars // 4 + 1
+
+
+def estimate_tokens(text: str) -> int:
+    return _chars_to_tokens(len(text))
+
+
+def _stem(word: str) -> str:
+    # Just enough stemming to match "tickets" to "ticket", "categories" to
+    # "category" and "statuses" to "status".
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("sses", "tuses", "xes", "ches", "shes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> set:
+    """Lower-cased, stemmed words; identifiers are split on underscores and digits."""
+    return {
+        _stem(word) for word in _WORD.findall(text.lower().replace("_", " "))
+        if word not in _STOP_WORDS
+    }
+
+
+class SchemaIndex:
+    """
+    Tables, columns and the foreign-key graph of a schema, for building
+    prompts that only describe what a question needs.
+
+    Tables are scored lexically against the question: words that match the
+    table name count more than words that match one of its columns. The best
+    tables are joined up along the shortest foreign-key paths, their direct
+    neighbours are added while room remains, and the result is cut off at the
+    token budget.
+    """
+
+    def __init__(self, columns_info: list, foreign_keys: list = ()):
+        self.tables = {}
+        for col in columns_info:
+            self.tables.setdefault(col['table_name'], []).append((col['column_name'], col['data_type']))
+
+        self.foreign_keys = [
+            fk for fk in foreign_keys
+            if fk['table_name'] in self.tables and fk['foreign_table_name'] in self.tables
+        ]
+        self._relationship_lines = [
+            f"  - {fk['table_name']}.{fk['column_name']} -> {fk['foreign_table_name']}.{fk['foreign_column_name']}"
+            for fk in self.foreign_keys
+        ]
+        self._neighbours = {table: set() for table in self.tables}
+        self._table_fks = {table: [] for table in self.tables}
+        for i, fk in enumerate(self.foreign_keys):
+            self._neighbours[fk['table_name']].add(fk['foreign_table_name'])
+            self._neighbours[fk['foreign_table_name']].add(fk['table_name'])
+            self._table_fks[fk['table_name']].append(i)
+            if fk['foreign_table_name'] != fk['table_name']:
+                self._table_fks[fk['foreign_table_name']].append(i)
+
+        self._table_words = {table: tokenize(table) for table in self.tables}
+        self._column_words = {
+            table: set().union(*(tokenize(name) for name, _ in columns))
+            for table, columns in self.tables.items()
+        }
+        self._blocks = {table: self._format_table(table) for table in self.tables}
+        self.full_text = self.format(list(self.tables))
+
+    # --- Formatting ---
+
+    def _format_table(self, table: str) -> str:
+        lines = [f"Table: {table}"]
+        lines.extend(f"  - {name} ({data_type})" for name, data_type in self.tables[table])
+        return "\n".join(lines)
+
+    def _format_relationships(self, tables: set) -> list:
+        return [
+            line for fk, line in zip(self.foreign_keys, self._relationship_lines)
+            if fk['table_name'] in tables and fk['foreign_table_name'] in tables
+        ]
+
+    def format(self, tables: list) -> str:
+        """Formats tables (in the given order) and the foreign keys among them."""
+        text = "\n\n".join(self._blocks[table] for table in tables)
+        relationships = self._format_relationships(set(tables))
+        if relationships:
+            text += "\n\nRelationships:\n" + "\n".join(relationships)
+        return text
+
+    # --- Selection ---
+
+    def score(self, question: str) -> dict:
+        """Returns {table: score} for every table that shares a word with the question."""
+        words = tokenize(question)
+        scores = {}
+        for table in self.tables:
+            score = 3 * len(words & self._table_words[table]) + len(words & self._column_words[table])
+            if score:
+                scores[table] = score
+        return scores
+
+    def _join_path(self, start: str, goals: set) -> list:
+        """Shortest foreign-key path from start to any table in goals (BFS), excluding start."""
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            table = queue.popleft()
+            if table in goals and table != start:
+                path = []
+                while previous[table] is not None:
+                    path.append(table)
+                    table = previous[table]
+                return path[::-1]
+            for neighbour in sorted(self._neighbours[table]):
+                if neighbour not in previous:
+                    previous[neighbour] = table
+                    queue.append(neighbour)
+        return []
+
+    def select_tables(self, question: str) -> list:
+        """
+        Returns the tables to describe for a question, most relevant first:
+        the seed tables, the tables on the join paths between them, then
+        their direct neighbours. Every table after the first seed is adjacent
+        to one listed before it, unless no foreign-key path links them at all.
+        """
+        scores = self.score(question)
+        seeds = sorted(scores, key=lambda table: (-scores[table], table))[:SCHEMA_MAX_SEED_TABLES]
+        if not seeds:
+            return list(self.tables)
+
+        selected = [seeds[0]]
+        for seed in seeds[1:]:
+            # Connect each seed to what is already selected along the shortest
+            # path, walking it from the selected end back towards the seed.
+            for table in self._join_path(seed, set(selected))[::-1] + [seed]:
+                if table not in selected:
+                    selected.append(table)
+        for table in list(selected):
+            for neighbour in sorted(self._neighbours[table]):
+                if neighbour not in selected:
+                    selected.append(neighbour)
+        return selected
+
+    def prompt_fragment(self, question: str, budget: int = SCHEMA_PROMPT_TOKEN_BUDGET) -> str:
+        """
+        Returns schema text for a question within the token budget. When the
+        whole schema fits it is used as is, so small databases lose nothing.
+        """
+        if estimate_tokens(self.full_text) <= budget:
+            return self.full_text
+        chosen = []
+        chosen_set = set()
+        used = len("\n\nRelationships:")
+        for table in self.select_tables(question):
+            # A table costs its own block plus the relationship lines it brings in.
+            added = len(self._blocks[table]) + 2 + sum(
+                len(self._relationship_lines[i]) + 1
+                for i in self._table_fks[table]
+                if {self.foreign_keys[i]['table_name'], self.foreign_keys[i]['foreign_table_name']} <= chosen_set | {table}
+            )
+            # The most relevant table is always kept, even if it is over budget on its own.
+            if chosen and _chars_to_tokens(used + added) > budget:
+                continue
+            # A table whose link to the chosen ones was skipped would have no join path in the prompt.
+            if chosen and not self._neighbours[table] & chosen_set and self._join_path(table, chosen_set):
+                continue
+            chosen.append(table)
+            chosen_set.add(table)
+            used += added
+        return self.format(chosen)
@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+
+SQL_CACHE_MAX_ENTRIES = int(os.environ.get("SQL_CACHE_MAX_ENTRIES", "1024"))
+SQL_CACHE_TTL = float(os.environ.get("SQL_CACHE_TTL", "3600"))
+# When enabled, generated SQL is also stored in text_to_sql_cache.generated_sql
+# (see init-db/init.sql) so the cache survives restarts.
+SQL_CACHE_PERSIST = os.environ.get("SQL_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Lower-cases, collapses whitespace and drops trailing punctuation."""
+    return _WHITESPACE.sub(" ", question).strip().rstrip("?.! ").lower()
+
+
+def cache_key(question: str, fingerprint: str) -> str:
+    """Keys an entry on the normalized question and the schema it was generated for."""
+    raw = f"{fingerprint or ''}\x00{normalize_question(question)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SQLCache:
+    """
+    Two-tier cache from (normalized question, schema fingerprint) to generated SQL.
+
+    The in-memory tier is an LRU with a TTL. The optional persistent tier lives
+    in Postgres and is consulted on memory misses. Entries generated against an
+    older schema never match because the fingerprint is part of the key, and
+    they are purged as soon as the schema cache reports a change.
+    """
+
+    def __init__(self, max_entries: int = SQL_CACHE_MAX_ENTRIES, ttl: float = SQL_CACHE_TTL,
+                 persist: bool = SQL_CACHE_PERSIST):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist = persist
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # --- In-memory tier ---
+
+    def _get_memory(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            sql_query, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return sql_query
+
+    def _put_memory(self, key: str, sql_query: str):
+        with self._lock:
+            self._entries[key] = (sql_query, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # --- Persistent tier ---
+
+    def _get_persistent(self, key: str):
+        with database.get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE text_to_sql_cache.generated_sql
+                    SET hit_count = hit_count + 1, last_hit_at = CURRENT_TIMESTAMP
+                    WHERE cache_key = %s
+                      AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    RETURNING sql_query;
+                    """,
+                    (key, self.ttl),
+                )
+                row = cur.fetchone()
+            conn.commit()
+        return row[0] if row else None
+
+    def _put_persistent(self, key: str, question: str, fingerprint: str, sql_query: str):
+        with database.get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO text_to_sql_cache.generated_sql
+                        (cache_key, question, schema_fingerprint, sql_query)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (cache_key) DO UPDATE
+                    SET sql_query = EXCLUDED.sql_query, created_at = CURRENT_TIMESTAMP;
+                    """,
+                    (key, normalize_question(question), fingerprint, sql_query),
+                )
+            conn.commit()
+
+    def _purge_persistent(self, fingerprint: str = None):
+        with database.get_db_connection() as conn:
+            with conn.cursor() as cur:
+                if fingerprint is None:
+                    cur.execute("DELETE FROM text_to_sql_cache.generated_sql;")
+                else:
+                    cur.execute(
+                        "DELETE FROM text_to_sql_cache.generated_sql WHERE schema_fingerprint <> %s;",
+                        (fingerprint,),
+                    )
+            conn.commit()
+
+    # --- Public API ---
+
+    def get(self, question: str, fingerprint: str):
+        key = cache_key(question, fingerprint)
+        sql_query = self._get_memory(key)
+        if sql_query is not None:
+            self.hits += 1
+            return sql_query
+        if self.persist:
+            try:
+                sql_query = self._get_persistent(key)
+            except psycopg2.Error as e:
+                logger.warning("Persistent SQL cache lookup failed: %s", e)
+                sql_query = None
+            if sql_query is not None:
+                self._put_memory(key, sql_query)
+                self.persistent_hits += 1
+                return sql_query
+        self.misses += 1
+        return None
+
+    def put(self, question: str, fingerprint: str, sql_query: str):
+        key = cache_key(question, fingerprint)
+        self._put_memory(key, sql_query)
+        if self.persist:
+            try:
+                self._put_persistent(key, question, fingerprint, sql_query)
+            except psycopg2.Error as e:
+                logger.warning("Persistent SQL cache write failed: %s", e)
+
+    def invalidate(self, fingerprint: str = None):
+        """
+        Drops cached SQL. With a fingerprint, only entries generated for other
+        schemas are purged from the persistent tier; memory is always cleared.
+        """
+        with self._lock:
+            self._entries.clear()
+        if self.persist:
+            try:
+                self._purge_persistent(fingerprint)
+            except psycopg2.Error as e:
+                logger.warning("Persistent SQL cache purge failed: %s", e)
+        logger.info("SQL cache invalidated")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.persistent_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "persistent": self.persist,
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.persistent_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+sql_cache = SQLCache()
+
+
+async def get_async(question: str, fingerprint: str):
+    """Looks up cached SQL; only the persistent tier needs a worker thread."""
+    if not sql_cache.persist:
+        return sql_cache.get(question, fingerprint)
+    return await asyncio.to_thread(sql_cache.get, question, fingerprint)
+
+
+async def put_async(question: str, fingerprint: str, sql_query: str):
+    if not sql_cache.persist:
+        sql_cache.put(question, fingerprint, sql_query)
+        return
+    await asyncio.to_thread(sql_cache.put, question, fingerprint, sql_query)
+
+
+async def invalidate_async(fingerprint: str = None):
+    await asyncio.to_thread(sql_cache.invalidate, fingerprint)
+
+
+def stats() -> dict:
+    return sql_cache.stats()
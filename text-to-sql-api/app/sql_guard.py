@@ -0,0 +1,149 @@
+import os
+import re
+
+# --- Configuration ---
+
+# The guard can be switched off for trusted, offline use.
+SQL_GUARD_ENABLED = os.environ.get("SQL_GUARD_ENABLED", "true").lower() in ("1", "true", "yes")
+# Upper bounds on the planner's estimate for the whole statement, in Postgres
+# cost units and rows. Queries over either bound are limited or rejected.
+SQL_MAX_PLAN_COST = float(os.environ.get("SQL_MAX_PLAN_COST", "500000"))
+SQL_MAX_PLAN_ROWS = float(os.environ.get("SQL_MAX_PLAN_ROWS", "1000000"))
+# When a query is over a bound, first try wrapping it in a LIMIT before rejecting it.
+SQL_GUARD_REWRITE = os.environ.get("SQL_GUARD_REWRITE", "true").lower() in ("1", "true", "yes")
+SQL_STATEMENT_TIMEOUT_MS = int(os.environ.get("SQL_STATEMENT_TIMEOUT_MS", "15000"))
+
+_SELECT_START = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+# Pieces of SQL that may contain a ';' without ending the statement.
+_LEXEME = re.compile(
+    r"[eE]'(?:[^'\\]|\\.|'')*'"  # escape string, E'...'
+    r"|'(?:[^']|'')*'"  # string literal
+    r'|"(?:[^"]|"")*"'  # quoted identifier
+    r"|(\$[A-Za-z_]*\$).*?\1"  # dollar-quoted string
+    r"|--[^\n]*"  # line comment
+    r"|/\*.*?\*/",  # block comment
+    re.DOTALL,
+)
+
+
+class QueryRejectedError(Exception):
+    """
+    Raised when a query is not run because of the guard. `reason` is one of
+    "statement", "plan_cost", "plan_rows" or "statement_timeout".
+    """
+
+    def __init__(self, reason: str, message: str, plan_cost: float = None, plan_rows: float = None):
+        super().__init__(message)
+        self.reason = reason
+        self.plan_cost = plan_cost
+        self.plan_rows = plan_rows
+
+    @classmethod
+    def timed_out(cls):
+        return cls("statement_timeout", f"Query was cancelled after {SQL_STATEMENT_TIMEOUT_MS} ms.")
+
+    def to_dict(self) -> dict:
+        return {
+            "reason": self.reason,
+            "message": str(self),
+            "plan_cost": self.plan_cost,
+            "plan_rows": self.plan_rows,
+            "max_plan_cost": SQL_MAX_PLAN_COST,
+            "max_plan_rows": SQL_MAX_PLAN_ROWS,
+            "statement_timeout_ms": SQL_STATEMENT_TIMEOUT_MS,
+        }
+
+
+def begin(cur, timeout_ms: int = SQL_STATEMENT_TIMEOUT_MS):
+    """
+    Makes the cursor's current transaction read-only and bounds how long any
+    statement in it may run. Both settings end with the transaction.
+    """
+    cur.execute("SET TRANSACTION READ ONLY")
+    cur.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+
+
+def ensure_single_select(sql_query: str):
+    """
+    Raises QueryRejectedError unless the text is exactly one SELECT or WITH
+    statement. A second statement (e.g. "SELECT 1; COMMIT; ...") would run
+    outside the read-only transaction and statement timeout set by begin().
+    """
+    # Literals, quoted identifiers and comments are blanked out first, since they may contain ';'.
+    bare = _LEXEME.sub(" ", sql_query).strip().rstrip(";").strip()
+    if ";" in bare:
+        raise QueryRejectedError("statement", "Only a single SQL statement can be run.")
+    if not _SELECT_START.match(bare):
+        raise QueryRejectedError("statement", "Only SELECT and WITH queries can be run.")
+
+
+def estimate(cur, sql_query: str):
+    """Returns the planner's (total cost, rows) for a statement without running it."""
+    # No parameters are passed here, so '%' in the query is left alone.
+    cur.execute(f"EXPLAIN (FORMAT JSON) {sql_query}")
+    row = cur.fetchone()
+    plan = (row["QUERY PLAN"] if isinstance(row, dict) else row[0])[0]["Plan"]
+    return plan["Total Cost"], plan["Plan Rows"]
+
+
+def _over_limits(cost: float, rows: float):
+    if cost > SQL_MAX_PLAN_COST:
+        return "plan_cost"
+    if rows > SQL_MAX_PLAN_ROWS:
+        return "plan_rows"
+    return None
+
+
+def _without_tail(sql_query: str) -> str:
+    """Drops trailing semicolons, whitespace and comments, which may not sit inside a subquery."""
+    end = pos = 0
+    for match in _LEXEME.finditer(sql_query):
+        if sql_query[pos:match.start()].strip(" \t\r\n;"):
+            end = pos + len(sql_query[pos:match.start()].rstrip(" \t\r\n;"))
+        if not match.group(0).startswith(("--", "/*")):
+            end = match.end()
+        pos = match.end()
+    if sql_query[pos:].strip(" \t\r\n;"):
+        end = pos + len(sql_query[pos:].rstrip(" \t\r\n;"))
+    return sql_query[:end].strip()
+
+
+def with_limit(sql_query: str, limit: int) -> str:
+    """Wraps a SELECT so the server stops producing rows after `limit`."""
+    return f"SELECT * FROM ({_without_tail(sql_query)}) AS guarded LIMIT {int(limit)}"
+
+
+def check(cur, sql_query: str, max_rows: int, rewrite: bool = SQL_GUARD_REWRITE,
+          single_select: bool = True) -> str:
+    """
+    EXPLAINs a query and returns the SQL that should run: the query itself
+    when it is within the bounds, or a LIMIT-ed rewrite that is. Raises
+    QueryRejectedError otherwise. Call after begin(), on the same transaction.
+
+    The query must be a single SELECT or WITH statement, even with the cost
+    guard switched off. Pass single_select=False only for SQL the service
+    builds itself around an already checked query, such as an EXECUTE.
+    """
+    if single_select:
+        ensure_single_select(sql_query)
+    if not SQL_GUARD_ENABLED:
+        return sql_query
+    cost, rows = estimate(cur, sql_query)
+    reason = _over_limits(cost, rows)
+    if reason is None:
+        return sql_query
+
+    if rewrite and single_select:
+        # One row past the cap lets the caller still report truncation.
+        limited = with_limit(sql_query, max_rows + 1)
+        limited_cost, limited_rows = estimate(cur, limited)
+        if _over_limits(limited_cost, limited_rows) is None:
+            return limited
+
+    raise QueryRejectedError(
+        reason,
+        f"Query is too expensive to run (estimated cost {cost:.0f}, {rows:.0f} rows; "
+        f"limits are {SQL_MAX_PLAN_COST:.0f} and {SQL_MAX_PLAN_ROWS:.0f}).",
+        plan_cost=cost,
+        plan_rows=rows,
+    )
@@ -42,3 +42,17 @@ INSERT INTO support_tickets (customer_id, product_id, subject, description, stat
 (2, 2, 'Cannot connect to Wi-Fi', 'My DataStream Router is not broadcasting a Wi-Fi signal.', 'in_progress'),
 (1, 3, 'Drive not recognized', 'The Cloud-Sync Hard Drive is not showing up on my computer.', 'closed');
 
+-- Persistent tier of the question-to-SQL cache (used when SQL_CACHE_PERSIST=true).
+-- It lives outside the public schema so it never appears in the LLM prompt.
+CREATE SCHEMA text_to_sql_cache;
+
+CREATE TABLE text_to_sql_cache.generated_sql (
+    cache_key CHAR(64) PRIMARY KEY,
+    question TEXT NOT NULL,
+    schema_fingerprint VARCHAR(32) NOT NULL,
+    sql_query TEXT NOT NULL,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP WITH TIME ZONE
+);
+
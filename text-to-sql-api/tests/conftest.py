@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The service runs with PYTHONPATH=/code (see the Dockerfile); mirror that for the tests.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import database
+from app import encoding
+from app import main
+from app import schema_cache
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def load_schema():
+        return "fingerprint"
+
+    async def resolve_sql(question, fingerprint, group_by=None):
+        if question == "broken":
+            raise RuntimeError("no SQL")
+        return "SELECT 1", True
+
+    async def execute_queries_async(sql_queries, max_rows=database.ASK_MAX_ROWS, columnar=False):
+        if columnar:
+            data = {"columns": [{"name": "status", "type": "text"}], "rows": [("open",), ("closed",)]}
+        else:
+            data = [{"status": "open"}, {"status": "closed"}]
+        return [None if sql is None else (data, False, None) for sql in sql_queries]
+
+    def execute_grouped_template(sql_template, group_by, keys, max_rows_per_group, columnar=False):
+        if columnar:
+            columns = [{"name": "product_id", "type": "int4"}, {"name": "status", "type": "text"}]
+            return {key: [(key, "open")] for key in keys}, [], columns
+        return {key: [{"product_id": key, "status": "open"}] for key in keys}, [], None
+
+    monkeypatch.setattr(main, "_load_schema", load_schema)
+    monkeypatch.setattr(main, "_resolve_sql", resolve_sql)
+    monkeypatch.setattr(database, "execute_queries_async", execute_queries_async)
+    monkeypatch.setattr(database, "execute_grouped_template", execute_grouped_template)
+    monkeypatch.setattr(schema_cache, "has_column", lambda column: True)
+    # Not used as a context manager, so the lifespan (database pool, schema load) does not run.
+    return TestClient(main.app)
+
+
+def test_batch_default_format_is_unchanged(client):
+    response = client.post("/ask/batch", json={"questions": ["q"]})
+    assert response.headers["content-type"] == "application/json"
+    assert response.json()["results"][0]["data"] == [{"status": "open"}, {"status": "closed"}]
+
+
+def test_batch_columnar(client):
+    response = client.post("/ask/batch?format=columnar", json={"questions": ["q", "broken"]})
+    assert response.headers["content-type"] == encoding.COLUMNAR_MEDIA_TYPE
+    ok, failed = response.json()["results"]
+    assert ok["columns"] == [{"name": "status", "type": "text"}]
+    assert ok["rows"] == [["open"], ["closed"]]
+    assert "data" not in ok
+    assert failed["error"].startswith("Error generating SQL query")
+    assert failed["rows"] == []
+
+
+def test_grouped_columnar_with_accept_header(client):
+    response = client.post(
+        "/ask/grouped",
+        json={"questions": ["q"], "keys": [1, 2]},
+        headers={"Accept": encoding.COLUMNAR_MEDIA_TYPE},
+    )
+    result = response.json()["results"][0]
+    assert result["columns"][0] == {"name": "product_id", "type": "int4"}
+    assert result["groups"] == {"1": [[1, "open"]], "2": [[2, "open"]]}
@@ -0,0 +1,61 @@
+import psycopg2
+import psycopg2.pool
+
+from app import database
+
+
+class FakeConnection:
+    def __init__(self, alive=True, closed=False):
+        self.alive = alive
+        self.closed = closed
+
+    def rollback(self):
+        if not self.alive:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        self.rollback()
+
+
+class FakeThreadedPool:
+    """Stands in for psycopg2's pool: hands out idle connections first, then opens new ones."""
+
+    def __init__(self, min_size, max_size, **conn_params):
+        self.idle = []
+        self.opened = 0
+        self.discarded = []
+
+    def getconn(self):
+        if self.idle:
+            return self.idle.pop(0)
+        self.opened += 1
+        return FakeConnection()
+
+    def putconn(self, conn, close=False):
+        if close:
+            self.discarded.append(conn)
+        else:
+            self.idle.append(conn)
+
+
+def test_getconn_skips_every_broken_pooled_connection(monkeypatch):
+    monkeypatch.setattr(psycopg2.pool, "ThreadedConnectionPool", FakeThreadedPool)
+    pool = database.ConnectionPool(1, 3)
+    dead = [FakeConnection(alive=False), FakeConnection(closed=True)]
+    pool._pool.idle = list(dead)
+
+    conn = pool.getconn()
+    assert conn.alive and not conn.closed
+    assert pool._pool.discarded == dead
+    assert pool._pool.opened == 1
+    pool.putconn(conn)
+    assert pool.in_use == 0
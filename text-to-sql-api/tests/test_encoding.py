@@ -0,0 +1,23 @@
+import datetime
+import json
+
+import pytest
+
+from app import encoding
+
+
+@pytest.fixture(params=["orjson", "json"])
+def dumps(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(encoding, "orjson", None)
+    elif encoding.orjson is None:
+        pytest.skip("orjson is not installed")
+    return lambda payload: json.loads(encoding.dumps(payload))
+
+
+def test_interval_is_encoded_as_seconds(dumps):
+    assert dumps({"wait": datetime.timedelta(days=1, seconds=90, microseconds=500000)}) == {"wait": 86490.5}
+
+
+def test_bytea_is_encoded_as_hex(dumps):
+    assert dumps({"blob": memoryview(b"\x00\xffab")}) == {"blob": "00ff6162"}
@@ -0,0 +1,124 @@
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+from psycopg2 import sql
+
+from app import database
+from app import index_advisor
+from app import query_log
+from app import schema_cache
+
+
+class FakeCursor:
+    """Records every statement; answers the advisor's catalog lookups from `conn.state`."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._row = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        text = statement if isinstance(statement, str) else repr(statement)
+        self.conn.executed.append(text)
+        self._row = None
+        if "pg_extension" in text:
+            self._row = {"?column?": 1} if self.conn.state["hypopg"] else None
+        elif "indisvalid" in text:
+            valid = self.conn.state["index_valid"]
+            self._row = None if valid is None else {"indisvalid": valid}
+        elif text.startswith("EXPLAIN"):
+            cost = 10.0 if self.conn.state["indexed"] else 100.0
+            self._row = {"QUERY PLAN": [{"Plan": {"Total Cost": cost, "Plan Rows": 1}}]}
+        elif "hypopg_create_index" in text:
+            self.conn.state["indexed"] = True
+        elif "CREATE INDEX CONCURRENTLY" in text:
+            if self.conn.state["build_fails"]:
+                self.conn.state["index_valid"] = False
+                raise psycopg2.errors.UniqueViolation("could not create unique index")
+            self.conn.state["index_valid"] = True
+            self.conn.state["indexed"] = True
+        elif "DROP INDEX" in text:
+            self.conn.state["index_valid"] = None
+
+    def fetchone(self):
+        return self._row
+
+
+class FakeConn:
+    def __init__(self, **state):
+        self.state = {"hypopg": True, "index_valid": None, "indexed": False, "build_fails": False, **state}
+        self.executed = []
+        self.autocommit = False
+        self.closed = False
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def use_conn(monkeypatch):
+    monkeypatch.setattr(schema_cache.schema_cache, "columns_info", [
+        {"table_name": "support_tickets", "column_name": "status"},
+        {"table_name": "support_tickets", "column_name": "ticket_id"},
+    ])
+    log = query_log.QueryLog()
+    log.record("SELECT ticket_id FROM support_tickets WHERE status = 'open'", 0.5)
+    monkeypatch.setattr(query_log, "query_log", log)
+
+    # Composed SQL needs a real connection to render; the fake records its repr instead.
+    monkeypatch.setattr(sql.Composed, "as_string", lambda self, context: repr(self))
+
+    def use(conn):
+        @contextmanager
+        def get_db_connection():
+            yield conn
+
+        monkeypatch.setattr(database, "get_db_connection", get_db_connection)
+        return conn
+
+    return use
+
+
+def test_evaluate_uses_a_hypothetical_index(use_conn):
+    conn = use_conn(FakeConn())
+    result = index_advisor.evaluate("support_tickets", ["status"])
+    assert result["hypothetical"] and not result["applied"]
+    assert (result["cost_before"], result["cost_after"]) == (100.0, 10.0)
+    assert not any("CREATE INDEX" in statement for statement in conn.executed)
+    assert any("hypopg_create_index" in statement for statement in conn.executed)
+    assert conn.executed[-1] == "SELECT hypopg_reset()"
+
+
+def test_evaluate_without_hypopg_builds_nothing(use_conn):
+    conn = use_conn(FakeConn(hypopg=False))
+    with pytest.raises(index_advisor.HypotheticalIndexUnavailable):
+        index_advisor.evaluate("support_tickets", ["status"])
+    assert not any("INDEX" in statement for statement in conn.executed)
+
+
+def test_apply_rebuilds_an_invalid_index(use_conn):
+    conn = use_conn(FakeConn(index_valid=False))
+    result = index_advisor.evaluate("support_tickets", ["status"], apply=True)
+    drops = [i for i, statement in enumerate(conn.executed) if "DROP INDEX" in statement]
+    creates = [i for i, statement in enumerate(conn.executed) if "CREATE INDEX CONCURRENTLY" in statement]
+    assert len(drops) == 1 and len(creates) == 1 and drops[0] < creates[0]
+    assert conn.state["index_valid"] is True
+    assert result["applied"] and result["cost_after"] == 10.0
+
+
+def test_failed_apply_drops_the_invalid_index(use_conn):
+    conn = use_conn(FakeConn(build_fails=True))
+    with pytest.raises(psycopg2.Error):
+        index_advisor.evaluate("support_tickets", ["status"], apply=True)
+    assert conn.state["index_valid"] is None
+    assert "RESET statement_timeout" in conn.executed
+    assert conn.autocommit is False
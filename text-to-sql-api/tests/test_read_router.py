@@ -0,0 +1,92 @@
+import threading
+import time
+
+import psycopg2
+import psycopg2.errors
+import pytest
+
+from app import database
+
+
+class FakePool:
+    """Stands in for ConnectionPool; records what was put back and whether it was closed."""
+
+    built = []
+
+    def __init__(self, min_size, max_size, **conn_params):
+        self.conn_params = conn_params
+        self.in_use = 0
+        self.returned = []
+        self.closed = False
+        if conn_params.get("host") == "slow":
+            time.sleep(0.5)
+        FakePool.built.append(self)
+
+    def getconn(self):
+        return object()
+
+    def putconn(self, conn, close=False):
+        self.returned.append(close)
+
+    def closeall(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fake_pool(monkeypatch):
+    FakePool.built = []
+    monkeypatch.setattr(database, "ConnectionPool", FakePool)
+
+
+def test_replica_connections_have_a_connect_timeout():
+    replica = database.Replica("replica-1:5433")
+    assert replica.conn_params["connect_timeout"] == database.DB_CONNECT_TIMEOUT
+    assert replica.conn_params["port"] == "5433"
+
+
+def test_slow_replica_does_not_block_other_reads():
+    router = database.ReadRouter(["slow", "fast"])
+    slow = threading.Thread(target=router._checkout, args=(router.replicas[0],))
+    slow.start()
+    time.sleep(0.05)
+    try:
+        started = time.perf_counter()
+        router._candidates()
+        router._checkout(router.replicas[1])
+        assert time.perf_counter() - started < 0.2
+    finally:
+        slow.join()
+
+
+def test_concurrent_first_checkouts_keep_one_pool():
+    router = database.ReadRouter(["slow"])
+    threads = [threading.Thread(target=router._checkout, args=(router.replicas[0],)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    kept = router.replicas[0].pool
+    assert [pool.closed for pool in FakePool.built].count(False) == 1
+    assert not kept.closed
+
+
+def test_statement_timeout_returns_the_replica_connection():
+    router = database.ReadRouter(["replica-1"])
+    with pytest.raises(psycopg2.errors.QueryCanceled):
+        with router.connection():
+            raise psycopg2.errors.QueryCanceled()
+    replica = router.replicas[0]
+    assert replica.pool.returned == [False]
+    assert replica.healthy
+
+
+def test_statement_timeout_returns_the_primary_connection(monkeypatch):
+    primary = FakePool(1, 1)
+    monkeypatch.setattr(database, "get_pool", lambda: primary)
+    with pytest.raises(psycopg2.errors.QueryCanceled):
+        with database.get_db_connection():
+            raise psycopg2.errors.QueryCanceled()
+    with pytest.raises(psycopg2.OperationalError):
+        with database.get_db_connection():
+            raise psycopg2.OperationalError("server closed the connection")
+    assert primary.returned == [False, True]
@@ -0,0 +1,53 @@
+from app import schema_index
+
+
+def _columns(table: str, names: list) -> list:
+    return [{"table_name": table, "column_name": name, "data_type": "integer"} for name in names]
+
+
+def _fk(table: str, column: str, foreign_table: str, foreign_column: str) -> dict:
+    return {
+        "table_name": table, "column_name": column,
+        "foreign_table_name": foreign_table, "foreign_column_name": foreign_column,
+    }
+
+
+# support_tickets -> customers -> regions, with a wide customers table in the middle.
+COLUMNS = (
+    _columns("support_tickets", ["ticket_id", "customer_id", "status"])
+    + _columns("customers", ["customer_id", "region_id"] + [f"attribute_{i}" for i in range(60)])
+    + _columns("regions", ["region_id", "region_name"])
+    + _columns("audit_events", ["event_id", "payload"])
+)
+FOREIGN_KEYS = [
+    _fk("support_tickets", "customer_id", "customers", "customer_id"),
+    _fk("customers", "region_id", "regions", "region_id"),
+]
+QUESTION = "How many support tickets per region name?"
+
+
+def test_join_path_tables_follow_the_selected_end():
+    index = schema_index.SchemaIndex(COLUMNS, FOREIGN_KEYS)
+    assert index.select_tables(QUESTION)[:3] == ["support_tickets", "customers", "regions"]
+
+
+def test_skipped_link_drops_the_tables_behind_it():
+    index = schema_index.SchemaIndex(COLUMNS, FOREIGN_KEYS)
+    small = len(index._blocks["regions"]) + len(index._blocks["support_tickets"])
+    fragment = index.prompt_fragment(QUESTION, budget=small // 4 + 20)
+    assert "Table: support_tickets" in fragment
+    # customers does not fit, so regions would have no join path to support_tickets.
+    assert "Table: customers" not in fragment
+    assert "Table: regions" not in fragment
+
+
+def test_unrelated_table_is_still_added_when_it_fits():
+    index = schema_index.SchemaIndex(COLUMNS, FOREIGN_KEYS)
+    question = "Which audit events mention a region name?"
+    fragment = index.prompt_fragment(question, budget=len(index.full_text) // 4 - 50)
+    assert "Table: regions" in fragment and "Table: audit_events" in fragment
+
+
+def test_whole_schema_is_used_when_it_fits():
+    index = schema_index.SchemaIndex(COLUMNS, FOREIGN_KEYS)
+    assert index.prompt_fragment(QUESTION, budget=10000) == index.full_text
@@ -0,0 +1,17 @@
+import importlib.util
+import os
+
+import pytest
+
+SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "scripts", "sync_shared_modules.py",
+)
+
+
+@pytest.mark.skipif(not os.path.exists(SCRIPT), reason="not run from a full checkout")
+def test_vendored_copies_match_their_source():
+    spec = importlib.util.spec_from_file_location("sync_shared_modules", SCRIPT)
+    sync = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sync)
+    assert sync.out_of_sync() == [], "run python scripts/sync_shared_modules.py --write"
@@ -0,0 +1,153 @@
+import os
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.errors
+import pytest
+from psycopg2.extras import RealDictCursor
+
+from app import database
+from app import sql_guard
+
+# libpq connection string of a scratch Postgres, e.g. "host=localhost dbname=test user=postgres".
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+needs_postgres = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+# --- Statement checks (no database) ---
+
+@pytest.mark.parametrize("sql_query", [
+    "SELECT 1",
+    "select 1;",
+    "  WITH t AS (SELECT 1 AS x) SELECT x FROM t ;  ",
+    "SELECT 'a;b' AS s",
+    "SELECT 'it''s; fine'",
+    "SELECT E'\\'; DROP TABLE t; --'",
+    'SELECT 1 AS "odd;name"',
+    "SELECT $$;$$, $tag$ ; $tag$",
+    "SELECT 1 -- trailing; comment",
+    "/* leading; comment */ SELECT 1",
+])
+def test_single_select_is_accepted(sql_query):
+    sql_guard.ensure_single_select(sql_query)
+
+
+@pytest.mark.parametrize("sql_query", [
+    "SELECT 1; COMMIT; DROP TABLE products",
+    "SELECT 1; SELECT 2",
+    "SELECT ';' ; DELETE FROM products",
+    "DELETE FROM products",
+    "COMMIT; SELECT 1",
+    "SET statement_timeout = 0",
+    "EXPLAIN ANALYZE SELECT 1",
+    "",
+])
+def test_other_statements_are_rejected(sql_query):
+    with pytest.raises(sql_guard.QueryRejectedError) as rejected:
+        sql_guard.ensure_single_select(sql_query)
+    assert rejected.value.reason == "statement"
+
+
+def test_check_rejects_before_explain():
+    class NoCursor:
+        def execute(self, *args):
+            raise AssertionError("nothing may reach the database")
+
+    with pytest.raises(sql_guard.QueryRejectedError):
+        sql_guard.check(NoCursor(), "SELECT 1; COMMIT; SELECT pg_sleep(60)", 10)
+
+
+def test_with_limit_wraps_the_query():
+    assert sql_guard.with_limit("SELECT * FROM t;\n", 11) == "SELECT * FROM (SELECT * FROM t) AS guarded LIMIT 11"
+
+
+def test_with_limit_drops_trailing_comments():
+    assert sql_guard.with_limit("SELECT * FROM t -- all rows", 11) == "SELECT * FROM (SELECT * FROM t) AS guarded LIMIT 11"
+    assert sql_guard.with_limit("SELECT * FROM t; -- all rows\n/* done */", 11) == (
+        "SELECT * FROM (SELECT * FROM t) AS guarded LIMIT 11"
+    )
+    # Comment markers inside literals and earlier comments stay as they are.
+    assert sql_guard.with_limit("SELECT '--;' -- x\nFROM t", 5) == "SELECT * FROM (SELECT '--;' -- x\nFROM t) AS guarded LIMIT 5"
+
+
+# --- Against a local Postgres ---
+
+@pytest.fixture
+def conn():
+    connection = psycopg2.connect(TEST_DATABASE_URL)
+    try:
+        with connection.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE guard_numbers AS SELECT n FROM generate_series(1, 100000) AS n")
+            cur.execute("ANALYZE guard_numbers")
+        connection.commit()
+        yield connection
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def pooled(monkeypatch, conn):
+    """Routes database.execute_query through the test connection."""
+    @contextmanager
+    def get_read_connection():
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+    monkeypatch.setattr(database, "get_read_connection", get_read_connection)
+    return conn
+
+
+@needs_postgres
+def test_rejects_on_plan_cost(monkeypatch, conn):
+    monkeypatch.setattr(sql_guard, "SQL_MAX_PLAN_COST", 10.0)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        sql_guard.begin(cur)
+        with pytest.raises(sql_guard.QueryRejectedError) as rejected:
+            sql_guard.check(cur, "SELECT a.n FROM guard_numbers a JOIN guard_numbers b ON a.n < b.n", 100,
+                            rewrite=False)
+    assert rejected.value.reason == "plan_cost"
+    assert rejected.value.plan_cost > 10.0
+
+
+@needs_postgres
+def test_rejects_on_plan_rows(monkeypatch, conn):
+    monkeypatch.setattr(sql_guard, "SQL_MAX_PLAN_ROWS", 1000.0)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        sql_guard.begin(cur)
+        with pytest.raises(sql_guard.QueryRejectedError) as rejected:
+            sql_guard.check(cur, "SELECT n FROM guard_numbers", 100, rewrite=False)
+    assert rejected.value.reason == "plan_rows"
+    assert rejected.value.plan_rows > 1000.0
+
+
+@needs_postgres
+def test_over_limit_query_is_wrapped_in_a_limit(monkeypatch, pooled):
+    monkeypatch.setattr(sql_guard, "SQL_MAX_PLAN_ROWS", 1000.0)
+    with pooled.cursor(cursor_factory=RealDictCursor) as cur:
+        sql_guard.begin(cur)
+        guarded = sql_guard.check(cur, "SELECT n FROM guard_numbers ORDER BY n;", 100, rewrite=True)
+    pooled.rollback()
+    assert guarded == "SELECT * FROM (SELECT n FROM guard_numbers ORDER BY n) AS guarded LIMIT 101"
+
+    results, truncated = database.execute_query("SELECT n FROM guard_numbers ORDER BY n", max_rows=100)
+    assert [row["n"] for row in results] == list(range(1, 101))
+    assert truncated
+
+
+@needs_postgres
+def test_statement_timeout_cancels_the_query(monkeypatch, pooled):
+    with pooled.cursor() as cur:
+        sql_guard.begin(cur, timeout_ms=100)
+        with pytest.raises(psycopg2.errors.QueryCanceled):
+            cur.execute("SELECT pg_sleep(2)")
+    pooled.rollback()
+
+    # The same cancellation through execute_query surfaces as a guard rejection.
+    begin = sql_guard.begin
+    monkeypatch.setattr(sql_guard, "begin", lambda cur: begin(cur, timeout_ms=100))
+    with pytest.raises(sql_guard.QueryRejectedError) as rejected:
+        database.execute_query("SELECT pg_sleep(2)")
+    assert rejected.value.reason == "statement_timeout"